@@ -7,6 +7,21 @@ from pydantic import AnyHttpUrl, BaseSettings, validator
 class Settings(BaseSettings):
     PROJECT_NAME: str
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = []
+    EVENT_BUFFER_SIZE: int = 1024
+    DATA_DIR: str = ""
+    SNAPSHOT_INTERVAL: int = 100000
+    SYNC_LOG: bool = True
+    NODE_STORAGE: str = "objects"
+    METRICS_SAMPLE_EVERY: int = 16
+    TENANT_MEMORY_BUDGET: int = 256 * 1024 * 1024
+    TENANT_DIR: str = ""
+    TENANT_IDLE_SECONDS: float = 0
+    SHARDS: int = 0
+    PLACEMENT: str = "best-fit"
+    CONSOLIDATION: int = 0
+    REBALANCE_INTERVAL: float = 0
+    REBALANCE_MOVES: int = 64
+    REBALANCE_SLACK: int = 2
 
     @validator("BACKEND_CORS_ORIGINS", pre=True)
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
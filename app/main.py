@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
+from network.api import tenants
 from network.api.v1 import router
 
 
@@ -22,6 +23,7 @@ def get_application():
 
 def route_application(app: FastAPI):
     app.include_router(router, prefix="/network")
+    app.include_router(tenants.router, prefix="/networks")
 
 
 app = get_application()
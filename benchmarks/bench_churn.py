@@ -0,0 +1,186 @@
+'''
+Benchmark of the network under churn workloads
+
+Runs each workload (see network.workloads) at each size, and measures the operations per second,
+the p50/p99 latencies of join, leave and info, and the peak memory.
+The info is the JSON status, rendered every --info-every operations of the churn.
+The results are written to a JSON file, which can be compared with the one of another commit.
+
+    $ python -m benchmarks.bench_churn --sizes 1000 10000 100000 --output churn.json
+    $ python -m benchmarks.bench_churn --compare churn.json
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from array import array
+from time import perf_counter, perf_counter_ns
+from typing import Dict, List, Union
+from network.crud import P2PNetwork
+from network.workloads import WORKLOADS
+
+
+def get_percentile(values: array, percentile: float) -> float:
+    ''' The nearest-rank percentile of the sorted values '''
+
+    if len(values) == 0:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(percentile / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def summarize(latencies: array) -> dict:
+    ''' Summarize the latencies in nanoseconds, as microseconds '''
+
+    values = array("q", sorted(latencies))
+    return {
+        "count": len(values),
+        "p50_us": get_percentile(values, 50) / 1000,
+        "p99_us": get_percentile(values, 99) / 1000,
+        "max_us": (values[-1] if len(values) > 0 else 0) / 1000
+    }
+
+
+def run_workload(workload: str, size: int, operations: int, seed: int, storage: str,
+                 info_every: int) -> dict:
+    ''' Apply the workload to a new network, timing every operation '''
+
+    network = P2PNetwork(storage)
+    latencies = {"join": array("q"), "leave": array("q"), "info": array("q")}
+    phase_seconds = {"warmup": 0.0, "churn": 0.0}
+    phase_operations = {"warmup": 0, "churn": 0}
+
+    for phase, operation in WORKLOADS[workload](size, operations, seed):
+        if "join" in operation:
+            started_at = perf_counter_ns()
+            network.join(operation["join"]["capacity"])
+            elapsed = perf_counter_ns() - started_at
+            latencies["join"].append(elapsed)
+        else:
+            started_at = perf_counter_ns()
+            network.leave(operation["leave"]["id"])
+            elapsed = perf_counter_ns() - started_at
+            latencies["leave"].append(elapsed)
+
+        phase_seconds[phase] += elapsed / 1e9
+        phase_operations[phase] += 1
+        if phase == "churn" and phase_operations["churn"] % info_every == 0:
+            started_at = perf_counter_ns()
+            network.info_json()
+            latencies["info"].append(perf_counter_ns() - started_at)
+
+    return {
+        "warmup_ops_per_sec": phase_operations["warmup"] / max(phase_seconds["warmup"], 1e-9),
+        "churn_ops_per_sec": phase_operations["churn"] / max(phase_seconds["churn"], 1e-9),
+        "warmup_operations": phase_operations["warmup"],
+        "churn_operations": phase_operations["churn"],
+        "latency": {key: summarize(value) for key, value in latencies.items()},
+        "nodes": len(network.nodes),
+        "trees": len(network.trees),
+        "max_height": max([network.get_height(x) for x in network.trees] + [0])
+    }
+
+
+def measure_peak_memory(workload: str, size: int, operations: int, seed: int, storage: str) -> int:
+    ''' Apply the workload again with tracemalloc, returns the peak memory in bytes '''
+
+    tracemalloc.start()
+    network = P2PNetwork(storage)
+    network.apply(x[1] for x in WORKLOADS[workload](size, operations, seed))
+    network.info_json()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def get_commit() -> Union[str, None]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    ''' Compare the results with the baseline, returns the regressions beyond the threshold '''
+
+    baseline_runs = {(x["workload"], x["size"], x["storage"]): x for x in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        old_run = baseline_runs.get((run["workload"], run["size"], run["storage"]), None)
+        if old_run is None:
+            continue
+
+        name = f"{run['workload']}/{run['size']}/{run['storage']}"
+        ratio = run["churn_ops_per_sec"] / max(old_run["churn_ops_per_sec"], 1e-9)
+        print(f"{name:40} churn ops/s x{ratio:.2f}", end="")
+        if ratio < 1 - threshold:
+            regressions.append(f"{name} churn ops/s x{ratio:.2f}")
+        for key in ["join", "leave", "info"]:
+            old_p99 = old_run["latency"][key]["p99_us"]
+            if old_p99 > 0 and run["latency"][key]["count"] > 0:
+                p99_ratio = run["latency"][key]["p99_us"] / old_p99
+                print(f", {key} p99 x{p99_ratio:.2f}", end="")
+                if p99_ratio > 1 + threshold:
+                    regressions.append(f"{name} {key} p99 x{p99_ratio:.2f}")
+        print()
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the network under churn workloads")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--operations", type=int, default=2000, help="operations of the churn")
+    parser.add_argument("--info-every", type=int, default=100, help="churn operations per info")
+    parser.add_argument("--storage", choices=["objects", "arrays"], default="objects")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-memory", action="store_true", help="don't run again for the peak memory")
+    parser.add_argument("--output", default="bench_churn.json")
+    parser.add_argument("--compare", default=None, help="results of another commit to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    results: Dict[str, object] = {
+        "commit": get_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "operations": args.operations,
+        "info_every": args.info_every,
+        "runs": []
+    }
+
+    for size in args.sizes:
+        for workload in args.workloads:
+            started_at = perf_counter()
+            run = {"workload": workload, "size": size, "storage": args.storage}
+            run.update(run_workload(workload, size, args.operations, args.seed, args.storage, args.info_every))
+            if not args.skip_memory:
+                run["peak_memory_bytes"] = measure_peak_memory(
+                    workload, size, args.operations, args.seed, args.storage)
+            results["runs"].append(run)
+
+            print(f"{workload:15} {size:>8} nodes: {run['churn_ops_per_sec']:>10.0f} churn ops/s, "
+                  f"join p99 {run['latency']['join']['p99_us']:.1f} us, "
+                  f"leave p99 {run['latency']['leave']['p99_us']:.1f} us, "
+                  f"info p99 {run['latency']['info']['p99_us']:.1f} us "
+                  f"({perf_counter() - started_at:.1f} s)")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results: {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if len(regressions) > 0:
+            print("regressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
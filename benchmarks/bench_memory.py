@@ -0,0 +1,63 @@
+'''
+Benchmark of the memory used by the nodes of the network
+
+Builds a network with each storage of the nodes, and reports the memory per node,
+both for the whole network and for the node storage alone.
+
+    $ python -m benchmarks.bench_memory --nodes 1000000
+'''
+import argparse
+import gc
+import random
+import tracemalloc
+from network.crud import P2PNetwork
+
+
+def measure(storage: str, capacities: list) -> dict:
+    ''' Build a network with the storage, returns the memory per node in bytes '''
+
+    gc.collect()
+    tracemalloc.start()
+    network = P2PNetwork(storage)
+    for capacity in capacities:
+        network.join(capacity)
+    gc.collect()
+    network_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # the node storage alone: the node list with the nodes, or the arrays with the views
+    gc.collect()
+    tracemalloc.start()
+    if storage == "arrays":
+        copy = P2PNetwork(storage)
+        for node in network.nodes:
+            copy.node_store.add(node)
+    else:
+        copy = [type(x)(x.id, x.capacity, x.parent_id, list(x.child_ids), x.depth, x.tree_id, x.remaining,
+                        x.height, x.free_depth, x.free_node) for x in network.nodes]
+    gc.collect()
+    node_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copy
+
+    return {"network": network_bytes / len(capacities), "nodes": node_bytes / len(capacities)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory per node")
+    parser.add_argument("--nodes", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    capacities = [rand.randint(0, 3) for _ in range(args.nodes)]
+
+    print(f"nodes: {args.nodes}")
+    for storage in ["objects", "arrays"]:
+        result = measure(storage, capacities)
+        print(f"{storage:8}: {result['network']:.0f} bytes/node in the network, "
+              f"{result['nodes']:.0f} bytes/node in the node storage")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+'''
+Benchmark of the durable storage of the network
+
+Builds a network with the given number of joins, then measures
+the log append (group commits), the snapshot write, the recovery from the snapshot
+and the replay of the whole log.
+
+    $ python -m benchmarks.bench_persistence --nodes 1000000
+'''
+import argparse
+import os
+import random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from network.crud import P2PNetwork
+from network.persistence import NetworkStore, read_log, replay
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the log and the snapshots")
+    parser.add_argument("--nodes", type=int, default=1000000)
+    parser.add_argument("--group", type=int, default=1000, help="operations per group commit")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    operations = [{"join": {"capacity": rand.randint(0, 3)}} for _ in range(args.nodes)]
+
+    with TemporaryDirectory() as directory:
+        store = NetworkStore(directory, snapshot_interval=len(operations) + 1)
+        network = store.recover()
+
+        started_at = perf_counter()
+        for start in range(0, len(operations), args.group):
+            for operation in operations[start:start + args.group]:
+                store.append(operation)
+                network.apply([operation])
+            store.commit()
+        apply_seconds = perf_counter() - started_at
+
+        started_at = perf_counter()
+        replayed = P2PNetwork()
+        replay(replayed, read_log(store.get_log_path(0)))
+        replay_seconds = perf_counter() - started_at
+
+        started_at = perf_counter()
+        store.snapshot(network)
+        snapshot_seconds = perf_counter() - started_at
+        snapshot_size = os.path.getsize(store.snapshot_path)
+        store.close()
+
+        started_at = perf_counter()
+        recovered = NetworkStore(directory).recover()
+        recover_seconds = perf_counter() - started_at
+        assert len(recovered.nodes) == len(network.nodes)
+
+    print(f"nodes                 : {args.nodes}")
+    print(f"apply + log (fsync/{args.group}) : {apply_seconds:.2f} s ({args.nodes / apply_seconds:.0f} ops/s)")
+    print(f"replay of the log     : {replay_seconds:.2f} s ({args.nodes / replay_seconds:.0f} ops/s)")
+    print(f"snapshot write        : {snapshot_seconds:.2f} s ({snapshot_size / args.nodes:.1f} bytes/node)")
+    print(f"recovery from snapshot: {recover_seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
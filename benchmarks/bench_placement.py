@@ -0,0 +1,92 @@
+'''
+Benchmark of the placements of the joins
+
+Runs each workload (see network.workloads) at each size with each placement (see network.crud.PLACEMENTS),
+and measures the join and leave latencies, the number of trees, and the depths of the nodes at the end,
+as the depth of a node is the number of relays between it and the root of its tree.
+With --consolidation, the trees are consolidated after each operation (see P2PNetwork.consolidate).
+
+    $ python -m benchmarks.bench_placement --workloads flash_crowd steady --sizes 1000 10000 100000
+    $ python -m benchmarks.bench_placement --workloads skewed --consolidation 0 1
+'''
+import argparse
+import json
+from array import array
+from time import perf_counter_ns
+from typing import List
+from benchmarks.bench_churn import summarize
+from network.crud import PLACEMENTS, P2PNetwork
+from network.workloads import WORKLOADS
+
+
+def get_depths(network: P2PNetwork) -> List[int]:
+    ''' The depth of every node of the network, going down from the roots '''
+
+    depths = []
+    for tree in network.trees:
+        stack = [(tree.root_id, 0)]
+        while len(stack) > 0:
+            node_id, depth = stack.pop()
+            depths.append(depth)
+            stack.extend((x, depth + 1) for x in network.get_node(node_id).child_ids)
+    return depths
+
+
+def run_placement(workload: str, size: int, operations: int, seed: int, placement: str,
+                  consolidation: int = 0) -> dict:
+    ''' Apply the workload to a new network with the placement, timing every operation '''
+
+    network = P2PNetwork(placement=placement, consolidation=consolidation)
+    latencies = {"join": array("q"), "leave": array("q")}
+    for _, operation in WORKLOADS[workload](size, operations, seed):
+        if "join" in operation:
+            started_at = perf_counter_ns()
+            network.join(operation["join"]["capacity"])
+            latencies["join"].append(perf_counter_ns() - started_at)
+        else:
+            started_at = perf_counter_ns()
+            network.leave(operation["leave"]["id"])
+            latencies["leave"].append(perf_counter_ns() - started_at)
+
+    depths = sorted(get_depths(network))
+    return {
+        "latency": {key: summarize(value) for key, value in latencies.items()},
+        "nodes": len(network.nodes),
+        "trees": len(network.trees),
+        "max_depth": depths[-1] if len(depths) > 0 else 0,
+        "mean_depth": sum(depths) / max(len(depths), 1),
+        "p99_depth": depths[int(len(depths) * 0.99)] if len(depths) > 0 else 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the placements of the joins")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=["flash_crowd", "steady"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--operations", type=int, default=10000, help="operations after the warm-up")
+    parser.add_argument("--consolidation", nargs="+", type=int, default=[0], help="trees attached per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_placement.json")
+    args = parser.parse_args()
+
+    runs = []
+    for workload in args.workloads:
+        for size in args.sizes:
+            for placement in PLACEMENTS:
+                for consolidation in args.consolidation:
+                    run = run_placement(workload, size, args.operations, args.seed, placement, consolidation)
+                    run.update({"workload": workload, "size": size, "placement": placement,
+                                "consolidation": consolidation})
+                    runs.append(run)
+                    print(f"{workload:14} {size:>8} {placement:10} {consolidation}: depth max {run['max_depth']:>6} "
+                          f"mean {run['mean_depth']:8.2f} p99 {run['p99_depth']:>6}, {run['trees']:>6} trees, "
+                          f"join p50 {run['latency']['join']['p50_us']:7.1f} us p99 {run['latency']['join']['p99_us']:7.1f} us, "
+                          f"leave p50 {run['latency']['leave']['p50_us']:7.1f} us")
+
+    with open(args.output, "w") as f:
+        json.dump({"operations": args.operations, "seed": args.seed, "runs": runs}, f, indent=2)
+    print(f"results: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
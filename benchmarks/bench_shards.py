@@ -0,0 +1,69 @@
+'''
+Benchmark of the throughput of many networks against the number of shards
+
+Each network gets the same churn workload (see network.workloads), sent in batches by concurrent clients,
+first to a registry in this process, then to registries sharded across each number of processes.
+
+    $ python -m benchmarks.bench_shards --networks 64 --size 1000 --operations 1000 --shards 1 2 4 8
+'''
+import argparse
+import asyncio
+import json
+import os
+from time import perf_counter
+from typing import List, Union
+from network.sharding import ShardedRegistry
+from network.tenancy import NetworkRegistry
+from network.workloads import WORKLOADS
+
+
+async def run_clients(registry: Union[NetworkRegistry, ShardedRegistry], network_ids: List[str],
+                      batches: List[List[dict]]) -> float:
+    ''' Create the networks and apply the batches to each of them, returns the seconds of the batches '''
+
+    await asyncio.gather(*[registry.call("create", x) for x in network_ids])
+
+    async def client(network_id: str):
+        for batch in batches:
+            await registry.call("apply", network_id, batch)
+
+    started_at = perf_counter()
+    await asyncio.gather(*[client(x) for x in network_ids])
+    return perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of many networks against the shards")
+    parser.add_argument("--networks", type=int, default=64)
+    parser.add_argument("--size", type=int, default=1000, help="nodes of each network before the churn")
+    parser.add_argument("--operations", type=int, default=1000, help="operations of the churn of each network")
+    parser.add_argument("--batch", type=int, default=100, help="operations per call")
+    parser.add_argument("--shards", nargs="+", type=int, default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_shards.json")
+    args = parser.parse_args()
+
+    operations = [x[1] for x in WORKLOADS["steady"](args.size, args.operations, args.seed)]
+    batches = [operations[x:x + args.batch] for x in range(0, len(operations), args.batch)]
+    network_ids = [f"swarm-{x}" for x in range(args.networks)]
+    total = len(operations) * args.networks
+
+    runs = []
+    for shards in [0] + sorted(set(args.shards)):
+        registry = ShardedRegistry(shards) if shards > 0 else NetworkRegistry()
+        seconds = asyncio.run(run_clients(registry, network_ids, batches))
+        if shards > 0:
+            registry.close()
+
+        runs.append({"shards": shards, "seconds": seconds, "ops_per_sec": total / seconds})
+        name = f"{shards} shards" if shards > 0 else "in process"
+        print(f"{name:>10}: {total} operations in {seconds:.2f} s, {total / seconds:.0f} ops/s")
+
+    with open(args.output, "w") as f:
+        json.dump({"networks": args.networks, "size": args.size, "operations": args.operations,
+                   "batch": args.batch, "cpu_count": os.cpu_count(), "runs": runs}, f, indent=2)
+    print(f"results: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
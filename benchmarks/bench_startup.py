@@ -0,0 +1,52 @@
+'''
+Benchmark of the startup
+
+The startup is the import time of the network and of the application, each in a new interpreter,
+compared with the import time of numpy, which the network used to import.
+
+    $ python -m benchmarks.bench_startup --repeat 10
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+IMPORT_CODE = "import time; started_at = time.perf_counter(); import {module}; print(time.perf_counter() - started_at)"
+MODULES = ["network.crud", "app.main", "numpy"]
+
+
+def measure_import(module: str, repeat: int) -> float:
+    ''' The median import time of the module in a new interpreter, in milliseconds '''
+
+    env = dict(os.environ, PROJECT_NAME=os.environ.get("PROJECT_NAME", "benchmark"))
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", IMPORT_CODE.format(module=module)],
+                                capture_output=True, text=True, check=True, env=env)
+        times.append(float(result.stdout) * 1000)
+    return median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup")
+    parser.add_argument("--repeat", type=int, default=10, help="new interpreters for each import")
+    parser.add_argument("--output", default="bench_startup.json")
+    args = parser.parse_args()
+
+    imports = {}
+    for module in MODULES:
+        try:
+            imports[module] = measure_import(module, args.repeat)
+        except subprocess.CalledProcessError:
+            continue
+        print(f"import {module:20} {imports[module]:8.1f} ms")
+
+    with open(args.output, "w") as f:
+        json.dump({"python": sys.version.split()[0], "imports_ms": imports}, f, indent=2)
+    print(f"results: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+'''
+Benchmark of the status response against the size of the network
+
+For each size, a network is built with the steady workload (see network.workloads), then measured:
+- the serialization of the status with each installed encoder, and with the generic encoder pass of FastAPI
+- the rendering of the status from scratch, with every cache dropped
+- the compression of the status with each encoding, and the compressed size
+- the response time of GET /status through the API, without and with each encoding
+
+    $ python -m benchmarks.bench_status --sizes 1000 10000 100000 --output status.json
+'''
+import argparse
+import json
+import platform
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from network.api import v1
+from network.compression import ENCODINGS, compress
+from network.crud import P2PNetwork
+from network.engine import NetworkEngine
+from network.workloads import WORKLOADS
+
+
+def get_encoders() -> Dict[str, Callable[[object], bytes]]:
+    ''' The installed encoders, all producing the same compact JSON '''
+
+    encoders: Dict[str, Callable[[object], bytes]] = {
+        "generic": lambda x: json.dumps(jsonable_encoder(x), ensure_ascii=False, allow_nan=False, indent=None,
+                                        separators=(",", ":")).encode("utf-8"),
+        "json": lambda x: json.dumps(x, ensure_ascii=False, allow_nan=False, indent=None,
+                                     separators=(",", ":")).encode("utf-8")
+    }
+    try:
+        import ujson
+        encoders["ujson"] = lambda x: ujson.dumps(x, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+    except ImportError:
+        pass
+    try:
+        import orjson
+        encoders["orjson"] = orjson.dumps
+    except ImportError:
+        pass
+    return encoders
+
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    ''' The median time of the function in milliseconds '''
+
+    times = []
+    for _ in range(repeat):
+        started_at = perf_counter()
+        function()
+        times.append(perf_counter() - started_at)
+    return median(times) * 1000
+
+
+def clear_caches(network: P2PNetwork):
+    network.tree_info_cache = {}
+    network.tree_json_cache = {}
+    network.info_json_cache = None
+
+
+def run_size(size: int, operations: int, seed: int, storage: str, repeat: int) -> dict:
+    network = P2PNetwork(storage)
+    network.apply(x[1] for x in WORKLOADS["steady"](size, operations, seed))
+    status = network.info_json()
+    info = network.info()
+
+    def render():
+        clear_caches(network)
+        network.info_json()
+
+    result: dict = {
+        "nodes": len(network.nodes),
+        "trees": len(network.trees),
+        "bytes": len(status),
+        "render_ms": measure(render, repeat),
+        "encode_ms": {name: measure(lambda: encoder(info), repeat) for name, encoder in get_encoders().items()},
+        "compress_ms": {x: measure(lambda: compress(status, x), repeat) for x in ENCODINGS},
+        "compressed_bytes": {x: len(compress(status, x)) for x in ENCODINGS},
+        "response_ms": {}
+    }
+
+    app = FastAPI()
+    app.include_router(v1.router)
+    client = TestClient(app)
+    v1.engine = NetworkEngine(network)
+    for encoding in ["identity"] + ENCODINGS:
+        # the first response compresses the status, the next ones take it from the engine
+        v1.engine.encoded = (v1.engine.snapshot, {}, v1.engine.network.seq)
+        headers = {"Accept-Encoding": encoding}
+        result["response_ms"][f"{encoding}_first"] = measure(lambda: client.get("/status", headers=headers), 1)
+        result["response_ms"][encoding] = measure(lambda: client.get("/status", headers=headers), repeat)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the status response against the size of the network")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--operations", type=int, default=1000, help="operations of the churn after the joins")
+    parser.add_argument("--storage", choices=["objects", "arrays"], default="objects")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10, help="measurements of each step, the median is kept")
+    parser.add_argument("--output", default="bench_status.json")
+    args = parser.parse_args()
+
+    runs: List[dict] = []
+    for size in args.sizes:
+        run = {"size": size}
+        run.update(run_size(size, args.operations, args.seed, args.storage, args.repeat))
+        runs.append(run)
+
+        encodes = ", ".join(f"{key} {value:.1f} ms" for key, value in run["encode_ms"].items())
+        print(f"{size:>8} nodes, {run['bytes'] / 1024:.0f} KiB: render {run['render_ms']:.1f} ms, encode {encodes}")
+        print(" " * 9 + "compress " + ", ".join(
+            f"{x} {run['compress_ms'][x]:.1f} ms to {run['compressed_bytes'][x] / 1024:.0f} KiB" for x in ENCODINGS))
+        print(" " * 9 + "response " + ", ".join(
+            f"{key} {value:.1f} ms" for key, value in run["response_ms"].items()))
+
+    with open(args.output, "w") as f:
+        json.dump({"python": platform.python_version(), "seed": args.seed, "storage": args.storage,
+                   "runs": runs}, f, indent=2)
+    print(f"results: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import asyncio
+from typing import Union
+from fastapi import APIRouter, HTTPException, Response
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from ..helper import dump_json
+from ..schemas import BatchInfo, JoinInfo, LeaveInfo, NetworkInfo
+from ..sharding import ShardedRegistry
+from ..tenancy import NetworkRegistry
+
+
+def create_registry() -> Union[NetworkRegistry, ShardedRegistry]:
+    ''' Create the registry of the networks, sharded across processes if the number of shards is set '''
+
+    if settings.SHARDS > 0:
+        return ShardedRegistry(settings.SHARDS, settings.TENANT_MEMORY_BUDGET, settings.TENANT_DIR,
+                               settings.NODE_STORAGE, settings.PLACEMENT, settings.CONSOLIDATION,
+                               settings.TENANT_IDLE_SECONDS)
+    return NetworkRegistry(settings.TENANT_MEMORY_BUDGET, settings.TENANT_DIR, settings.NODE_STORAGE,
+                           settings.PLACEMENT, settings.CONSOLIDATION, settings.TENANT_IDLE_SECONDS)
+
+
+async def evict_idle_networks(interval: float):
+    ''' Evict the networks not used for the idle time, checking them at the interval '''
+
+    while True:
+        await asyncio.sleep(interval)
+        await registry.call("evict_idle")
+
+
+router = APIRouter()
+registry = create_registry()
+
+
+@router.on_event("startup")
+async def start_idle_eviction():
+    ''' Evict the idle networks in the background, also when there are no calls, unless the idle time is 0 '''
+
+    if settings.TENANT_IDLE_SECONDS > 0:
+        asyncio.create_task(evict_idle_networks(settings.TENANT_IDLE_SECONDS / 2))
+
+
+@router.on_event("shutdown")
+async def close_registry():
+    ''' Write the loaded networks to the snapshots of TENANT_DIR, where the next start finds them '''
+
+    await run_in_threadpool(registry.close)
+
+
+@router.post("")
+async def create_network(network_info: NetworkInfo):
+    '''
+    Create a new empty network with an identifier.
+    The identifier has up to 64 letters, digits, dots, dashes and underscores.
+
+    '''
+    if not await registry.call("create", network_info.id):
+        raise HTTPException(status_code=409, detail="Network already exists")
+    return Response(content=dump_json({"id": network_info.id}), status_code=201, media_type="application/json")
+
+
+@router.get("")
+async def list_networks():
+    '''
+    Get the networks with their numbers of nodes and trees, and whether they are loaded in memory.
+
+    '''
+    networks = await registry.call("list")
+    return Response(content=dump_json(networks), media_type="application/json")
+
+
+@router.get("/registry")
+async def get_registry():
+    '''
+    Get the statistics of the networks in memory.
+
+    networks  : the number of the networks
+    loaded    : the number of the networks in memory, the others are evicted to snapshots
+    memory    : the estimated memory of the networks in memory
+    evictions : the number of the networks evicted to snapshots, for the memory budget or the idle time
+    loads     : the number of the networks loaded again from snapshots
+    shards    : the number of the processes hosting the networks, when they are sharded
+
+    '''
+    stats = await registry.call("stats")
+    return Response(content=dump_json(stats), media_type="application/json")
+
+
+@router.delete("/{network_id}")
+async def delete_network(network_id: str):
+    '''
+    Delete a network with all its nodes.
+
+    '''
+    if not await registry.call("delete", network_id):
+        raise HTTPException(status_code=404, detail="Network not found")
+    return Response(status_code=200)
+
+
+@router.post("/{network_id}/join")
+async def join(network_id: str, capacity_info: JoinInfo):
+    '''
+    Add a new node into the network, as /network/join does, and get its identifier.
+
+    '''
+    results = await registry.call("apply", network_id, [{"join": capacity_info.dict(exclude_none=True)}])
+    if results is None:
+        raise HTTPException(status_code=404, detail="Network not found")
+    return Response(content=dump_json({"id": results[0]["id"]}), media_type="application/json")
+
+
+@router.post("/{network_id}/leave")
+async def leave(network_id: str, leave_info: LeaveInfo):
+    '''
+    Remove the node from the network, as /network/leave does.
+
+    '''
+    results = await registry.call("apply", network_id, [{"leave": {"id": leave_info.id}}])
+    if results is None:
+        raise HTTPException(status_code=404, detail="Network not found")
+    if results[0]["success"]:
+        return Response(status_code=200)
+    raise HTTPException(status_code=400, detail="Node not found")
+
+
+@router.post("/{network_id}/batch")
+async def batch(network_id: str, batch_info: BatchInfo):
+    '''
+    Apply a list of joins and leaves to the network in the given order, as /network/batch does.
+
+    '''
+    operations = [x.dict(exclude_none=True) for x in batch_info.operations]
+    results = await registry.call("apply", network_id, operations)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Network not found")
+    return Response(content=dump_json(results), media_type="application/json")
+
+
+@router.get("/{network_id}/status")
+async def get_network(network_id: str):
+    '''
+    Get the current topology of the network, as /network/status does.
+
+    '''
+    status = await registry.call("status", network_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Network not found")
+    return Response(content=status, media_type="application/json")
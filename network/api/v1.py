@@ -1,9 +1,47 @@
-from fastapi import APIRouter, HTTPException, Response
+import asyncio
+from typing import Union
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
 from network.crud import P2PNetwork
-from ..schemas import JoinInfo, LeaveInfo
+from ..compression import negotiate_encoding
+from ..engine import NetworkEngine
+from ..events import EventFeed
+from ..helper import dump_json
+from ..metrics import Metrics, render_gauges
+from ..persistence import NetworkStore
+from ..rebalance import Rebalancer
+from ..schemas import BatchInfo, JoinInfo, LeaveInfo
+
+
+def create_engine() -> NetworkEngine:
+    '''
+    Create the engine, recovering the network from the data directory if it is set
+    The network is instrumented unless the sampling of the metrics is 0
+    '''
+
+    metrics = Metrics(settings.METRICS_SAMPLE_EVERY) if settings.METRICS_SAMPLE_EVERY > 0 else None
+    network = P2PNetwork(settings.NODE_STORAGE, metrics, settings.PLACEMENT, settings.CONSOLIDATION)
+    if settings.DATA_DIR == "":
+        return NetworkEngine(network)
+
+    store = NetworkStore(settings.DATA_DIR, settings.SNAPSHOT_INTERVAL, settings.SYNC_LOG)
+    return NetworkEngine(store.recover(network), store)
+
 
 router = APIRouter()
-network = P2PNetwork()
+engine = create_engine()
+event_feed = EventFeed(engine.network, settings.EVENT_BUFFER_SIZE)
+rebalancer = Rebalancer(settings.REBALANCE_MOVES, settings.REBALANCE_SLACK)
+
+
+@router.on_event("startup")
+async def start_rebalancer():
+    ''' Start the rebalancer in the background, unless its interval is 0 '''
+
+    if settings.REBALANCE_INTERVAL > 0:
+        asyncio.create_task(rebalancer.run(engine, settings.REBALANCE_INTERVAL))
 
 
 @router.post("/join")
@@ -13,9 +51,12 @@ async def join(capacity_info: JoinInfo):
     The capacity of the node is required.
 
     In this step, the network just assigns the node to the best-fitting parent (the node with the most free capacity).
+    With the "shallowest" placement, it assigns the node to the shallowest parent with a free capacity instead,
+    the one with the most free capacity among them, which keeps the trees shallow under many joins.
+    With the consolidation, the smallest trees are then attached under the free nodes of the other trees.
 
     '''
-    network.join(capacity_info.capacity)
+    await engine.execute([{"join": capacity_info.dict(exclude_none=True)}])
     return Response(status_code=200)
 
 
@@ -29,19 +70,215 @@ async def leave(leave_info: LeaveInfo):
     where the tree has the fewest number of depth levels.
 
     '''
-    if network.leave(leave_info.id):
+    results = await engine.execute([{"leave": {"id": leave_info.id}}])
+    if results[0]["success"]:
         return Response(status_code=200)
     raise HTTPException(status_code=400, detail="Node not found")
 
 
+@router.post("/batch")
+async def batch(batch_info: BatchInfo):
+    '''
+    Apply a list of joins and leaves in the given order.
+    Each operation is either {"join": {"capacity": 1}} or {"leave": {"id": 1}}.
+
+    The result has an item for each operation, with the identifier of the added or removed node.
+    A leave of an unknown node fails without stopping the batch.
+
+    '''
+    operations = [x.dict(exclude_none=True) for x in batch_info.operations]
+    results = await engine.execute(operations)
+    return Response(content=dump_json(results), media_type="application/json")
+
+
 @router.get("/status")
-async def get_network():
+async def get_network(request: Request):
     '''
     Get the current topology of the network.
 
     The result has the list of the information for each tree.
     Each tree information has the list of the nodes with capacities and the edges.
 
+    The result is compressed with brotli or gzip, if the client accepts it.
+    The X-Event-Seq header has the sequence number of the last topology change in the result (see /events).
+
+    '''
+    # the status is rendered on the first read after a change, by the writer
+    await asyncio.wrap_future(engine.refresh())
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", None))
+    if encoding is not None and encoding not in engine.encoded[1]:
+        # a large status takes a while to compress, so it is done off the event loop
+        content, encoding, seq = await run_in_threadpool(engine.get_snapshot, encoding)
+    else:
+        content, encoding, seq = engine.get_snapshot(encoding)
+
+    headers = {"Vary": "Accept-Encoding", "X-Event-Seq": str(seq)}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+@router.get("/status/trees")
+async def get_status_trees(cursor: int = Query(default=0, ge=0, description="Identifier of the last tree of the previous page"),
+                           limit: int = Query(default=100, ge=1, le=1000)):
+    '''
+    Get the statistics of a page of the trees, in the order of their identifiers.
+
+    Each tree has its size, the total remaining capacity and the number of the nodes with a remaining capacity,
+    its height, and the depth of the shallowest node with a remaining capacity (-1 for none).
+    They are kept up to date with the tree, so a page is read without visiting the nodes of the trees.
+
+    '''
+    trees, next_cursor = await engine.query(lambda network: network.get_stats(cursor, limit))
+    return Response(content=dump_json({"trees": trees, "next": next_cursor}), media_type="application/json")
+
+
+@router.get("/trees")
+async def get_trees(cursor: int = Query(default=0, ge=0, description="Identifier of the last tree of the previous page"),
+                    limit: int = Query(default=100, ge=1, le=1000),
+                    depth: Union[int, None] = Query(default=None, ge=0, description="Levels below the roots")):
+    '''
+    Get a page of the trees, in the order of their identifiers.
+
+    Each tree has its identifier, its root, and the nodes with capacities and the edges as in the status.
+    With a depth, only the nodes down to the depth below the root are included.
+    The next page starts after the cursor given in the result, which is null after the last page.
+
     '''
-    info = network.info()
-    return info
+    trees, next_cursor = await engine.query(lambda network: network.get_trees(cursor, limit, depth))
+    return Response(content=dump_json({"trees": trees, "next": next_cursor}), media_type="application/json")
+
+
+@router.get("/trees/{tree_id}")
+async def get_tree(tree_id: int, depth: Union[int, None] = Query(default=None, ge=0)):
+    '''
+    Get a tree by its identifier, down to the depth below the root if it is given.
+
+    '''
+    def view_tree(network: P2PNetwork):
+        _, tree = network.find_tree(tree_id)
+        return None if tree is None else network.get_tree_view(tree, depth)
+
+    view = await engine.query(view_tree)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Tree not found")
+    return Response(content=dump_json(view), media_type="application/json")
+
+
+@router.get("/nodes/{node_id}/tree")
+async def get_node_tree(node_id: int, depth: Union[int, None] = Query(default=None, ge=0)):
+    '''
+    Get the tree of a node, e.g. of its root, down to the depth below the root if it is given.
+
+    '''
+    def view_tree(network: P2PNetwork):
+        _, node = network.find_node(node_id)
+        if node is None:
+            return None
+        return network.get_tree_view(network.find_tree(node.tree_id)[1], depth)
+
+    view = await engine.query(view_tree)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return Response(content=dump_json(view), media_type="application/json")
+
+
+@router.get("/nodes/{node_id}/subtree")
+async def get_subtree(node_id: int, depth: Union[int, None] = Query(default=None, ge=0)):
+    '''
+    Get the subtree of a node, with the node as its root, down to the depth below the node if it is given.
+
+    '''
+    view = await engine.query(lambda network: network.get_subtree_view(node_id, depth))
+    if view is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return Response(content=dump_json(view), media_type="application/json")
+
+
+@router.get("/nodes/{node_id}/path")
+async def get_path(node_id: int):
+    '''
+    Get the path from a node to the root of its tree, starting with the node.
+
+    '''
+    path = await engine.query(lambda network: network.get_path(node_id))
+    if path is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return Response(content=dump_json({"path": path}), media_type="application/json")
+
+
+@router.get("/events")
+async def get_events():
+    '''
+    Stream the changes of the topology as server-sent events.
+
+    Each event is a JSON object with a type and a sequence number.
+    join  : a node joined under a parent (0 for a new root) in a tree
+    leave : a node left
+    move  : the subtree of a node moved under a parent (0 for the root) in a tree, also by the rebalancer
+    tree  : a tree was created
+    drop  : a tree was removed
+
+    The stream starts with a resync marker, and a consumer that falls behind gets it again.
+    After the marker, the current topology should be loaded again from the status.
+    The status is read after the marker, so its X-Event-Seq header is at least the sequence number of the marker,
+    and the events up to it are already in the status: the consumer skips them, and applies the ones after it.
+
+    '''
+    return StreamingResponse(event_feed.stream(), media_type="text/event-stream")
+
+
+@router.get("/engine")
+async def get_engine():
+    '''
+    Get the statistics of the writer applying the joins and leaves.
+
+    queue_depth        : the number of the requests waiting for the writer
+    applied_operations : the number of the applied joins and leaves
+    throughput         : the applied operations per second, in the last second
+    version            : the number of the published status snapshots
+    failed_recoveries  : the number of the logged operations that raised an error when the network was recovered
+
+    '''
+    return Response(content=dump_json(engine.stats()), media_type="application/json")
+
+
+@router.get("/rebalancer")
+async def get_rebalancer():
+    '''
+    Get the statistics of the rebalancer.
+
+    tree                            : the tree being rebalanced, 0 for none
+    ticks                           : the number of the ticks, each a batch of moves in a tree
+    moves                           : the number of the lifts and swaps, a swap moving two nodes
+    height_reduction                : the levels removed from the trees
+    cpu_seconds                     : the CPU time of the moves
+    height_reduction_per_cpu_second : the levels removed per second of the CPU time
+
+    '''
+    return Response(content=dump_json(rebalancer.stats()), media_type="application/json")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    '''
+    Get the metrics of the network in the Prometheus text format.
+
+    p2p_operation_seconds      : the latencies of the joins, leaves, infos and the steps of the leaves, sampled
+    p2p_operations_total       : the number of the operations and steps
+    p2p_*_total                : the trees created, removed and consolidated, the subtrees merged and the nodes re-parented
+    p2p_recombination_*        : the number of the subtrees and the nodes of each recombination
+    p2p_nodes, p2p_trees       : the size of the network
+    p2p_max_height             : the maximum depth of the nodes
+    p2p_rebalance_*_total      : the ticks, the moves, the height reduction and the CPU time of the rebalancer
+
+    Only the gauges are given when the metrics are disabled.
+
+    '''
+    def render(network: P2PNetwork) -> str:
+        if network.metrics is None:
+            return "\n".join(render_gauges(network)) + "\n"
+        return network.metrics.render(network)
+
+    content = await engine.query(render) + "\n".join(rebalancer.render()) + "\n"
+    return PlainTextResponse(content=content, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,321 @@
+from array import array
+from typing import Dict, Iterator, List, Union
+from .models import Node, get_node_name
+
+# the capacity of a node is at most 3, so are its children
+CHILD_SLOTS = 3
+
+
+class NodeArrays():
+    '''
+    A struct-of-arrays storage of the nodes
+    Each property of the nodes is a column of a typed array, indexed by a row,
+    and the children of a node have fixed slots in one array
+
+    views        : the view of each row, which the network uses as a node
+    child_counts : the number of the used child slots of each row
+    child_slots  : the identifiers of the children, CHILD_SLOTS for each row
+
+    A removed row is filled with the last row, so the rows have no holes.
+    '''
+
+    def __init__(self):
+        self.ids = array("i")
+        self.capacities = array("i")
+        self.parent_ids = array("i")
+        self.depths = array("i")
+        self.heights = array("i")
+        self.tree_ids = array("i")
+        self.remainings = array("i")
+        self.free_depths = array("i")
+        self.free_nodes = array("i")
+        self.child_counts = array("b")
+        self.child_slots = array("i")
+        self.views: List["NodeView"] = []
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+    def add(self, node: Node) -> "NodeView":
+        ''' Add a row with the properties of the node, returns the view of the row '''
+
+        if len(node.child_ids) > CHILD_SLOTS or node.capacity > CHILD_SLOTS:
+            raise ValueError(f"A node can't have more than {CHILD_SLOTS} children")
+
+        view = NodeView(self, len(self.views))
+        self.ids.append(node.id)
+        self.capacities.append(node.capacity)
+        self.parent_ids.append(node.parent_id)
+        self.depths.append(node.depth)
+        self.heights.append(node.height)
+        self.tree_ids.append(node.tree_id)
+        self.remainings.append(node.remaining)
+        self.free_depths.append(node.free_depth)
+        self.free_nodes.append(node.free_node)
+        self.child_counts.append(len(node.child_ids))
+        self.child_slots.extend(node.child_ids)
+        self.child_slots.extend([0] * (CHILD_SLOTS - len(node.child_ids)))
+        self.views.append(view)
+        return view
+
+    def remove(self, view: "NodeView"):
+        '''
+        Remove the row of the view, moving the last row into its place
+        The removed view keeps its properties in a storage of its own
+        '''
+
+        row = view.row
+        detached = NodeArrays()
+        detached.add(view)
+        view.store = detached
+        view.row = 0
+
+        last_view = self.views.pop()
+        last_row = len(self.views)
+        if last_row != row:
+            for column in [self.ids, self.capacities, self.parent_ids, self.depths, self.heights, self.tree_ids,
+                           self.remainings, self.free_depths, self.free_nodes, self.child_counts]:
+                column[row] = column[last_row]
+            self.child_slots[row * CHILD_SLOTS:(row + 1) * CHILD_SLOTS] = \
+                self.child_slots[last_row * CHILD_SLOTS:(last_row + 1) * CHILD_SLOTS]
+            self.views[row] = last_view
+            last_view.row = row
+
+        for column in [self.ids, self.capacities, self.parent_ids, self.depths, self.heights, self.tree_ids,
+                       self.remainings, self.free_depths, self.free_nodes, self.child_counts]:
+            del column[last_row]
+        del self.child_slots[last_row * CHILD_SLOTS:]
+
+
+class PositionArray():
+    '''
+    A map from the node identifiers to the positions, as an array indexed by identifier
+    The identifiers are given in increasing order, so it takes a few bytes per identifier
+    It supports what the network does with the positions of the nodes
+
+    positions : the positions of the identifiers from the start on, -1 for none
+    start     : the identifier of the first item of the positions
+    live      : the number of the items of the positions that are not -1
+    older     : the positions of the identifiers before the start
+
+    Once less than a quarter of the positions are used, the array is compacted. It starts again at the lowest
+    identifier after which at least half of the positions are used, and the ones before it move to the older.
+    So the memory is in proportion to the live nodes, and a compaction is paid by the removals before it.
+    '''
+
+    def __init__(self):
+        self.positions = array("i")
+        self.start = 0
+        self.live = 0
+        self.older: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self.live + len(self.older)
+
+    def __contains__(self, node_id: int) -> bool:
+        return self.get(node_id, -1) >= 0
+
+    def get(self, node_id: int, default: Union[int, None] = None) -> Union[int, None]:
+        index = node_id - self.start
+        if index < 0:
+            return self.older.get(node_id, default)
+        if index < len(self.positions) and self.positions[index] >= 0:
+            return self.positions[index]
+        return default
+
+    def __getitem__(self, node_id: int) -> int:
+        position = self.get(node_id, -1)
+        if position < 0:
+            raise KeyError(node_id)
+        return position
+
+    def __setitem__(self, node_id: int, position: int):
+        index = node_id - self.start
+        if index < 0:
+            self.older[node_id] = position
+            return
+        if index >= len(self.positions):
+            self.positions.extend([-1] * (index + 1 - len(self.positions)))
+        if self.positions[index] < 0:
+            self.live += 1
+        self.positions[index] = position
+
+    def __delitem__(self, node_id: int):
+        index = node_id - self.start
+        if index < 0:
+            del self.older[node_id]
+            return
+        self[node_id]
+        self.positions[index] = -1
+        self.live -= 1
+        if len(self.positions) > 64 and self.live * 4 < len(self.positions):
+            self.compact()
+
+    def compact(self):
+        ''' Move the sparse beginning of the positions to the older '''
+
+        used = 0
+        start = len(self.positions)
+        for index in range(len(self.positions) - 1, -1, -1):
+            if self.positions[index] >= 0:
+                used += 1
+            if used * 2 >= len(self.positions) - index:
+                start = index
+
+        for index in range(start):
+            if self.positions[index] >= 0:
+                self.older[self.start + index] = self.positions[index]
+                self.live -= 1
+        self.positions = self.positions[start:]
+        self.start += start
+
+
+class ChildSlots():
+    '''
+    A list-like view of the child slots of a node
+    It supports what the network does with the child identifiers of a node
+    '''
+
+    __slots__ = ("view",)
+
+    def __init__(self, view: "NodeView"):
+        self.view = view
+
+    def get_ids(self) -> List[int]:
+        store, row = self.view.store, self.view.row
+        start = row * CHILD_SLOTS
+        return store.child_slots[start:start + store.child_counts[row]].tolist()
+
+    def __len__(self) -> int:
+        return self.view.store.child_counts[self.view.row]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.get_ids())
+
+    def __getitem__(self, index):
+        return self.get_ids()[index]
+
+    def __contains__(self, node_id: int) -> bool:
+        return node_id in self.get_ids()
+
+    def __eq__(self, other) -> bool:
+        return self.get_ids() == list(other)
+
+    def __repr__(self) -> str:
+        return repr(self.get_ids())
+
+    def append(self, node_id: int):
+        store, row = self.view.store, self.view.row
+        count = store.child_counts[row]
+        if count == CHILD_SLOTS:
+            raise ValueError(f"A node can't have more than {CHILD_SLOTS} children")
+        store.child_slots[row * CHILD_SLOTS + count] = node_id
+        store.child_counts[row] = count + 1
+
+    def remove(self, node_id: int):
+        child_ids = self.get_ids()
+        child_ids.remove(node_id)
+        self.view.child_ids = child_ids
+
+    def copy(self) -> List[int]:
+        return self.get_ids()
+
+
+class NodeView():
+    '''
+    A node stored in a row of the NodeArrays
+    It has the same properties as the Node, read from and written to the columns
+    '''
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: NodeArrays, row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def id(self) -> int:
+        return self.store.ids[self.row]
+
+    @property
+    def capacity(self) -> int:
+        return self.store.capacities[self.row]
+
+    @property
+    def parent_id(self) -> int:
+        return self.store.parent_ids[self.row]
+
+    @parent_id.setter
+    def parent_id(self, value: int):
+        self.store.parent_ids[self.row] = value
+
+    @property
+    def child_ids(self) -> ChildSlots:
+        return ChildSlots(self)
+
+    @child_ids.setter
+    def child_ids(self, value: List[int]):
+        value = list(value)
+        if len(value) > CHILD_SLOTS:
+            raise ValueError(f"A node can't have more than {CHILD_SLOTS} children")
+        start = self.row * CHILD_SLOTS
+        self.store.child_slots[start:start + CHILD_SLOTS] = array(
+            "i", value + [0] * (CHILD_SLOTS - len(value)))
+        self.store.child_counts[self.row] = len(value)
+
+    @property
+    def depth(self) -> int:
+        return self.store.depths[self.row]
+
+    @depth.setter
+    def depth(self, value: int):
+        self.store.depths[self.row] = value
+
+    @property
+    def height(self) -> int:
+        return self.store.heights[self.row]
+
+    @height.setter
+    def height(self, value: int):
+        self.store.heights[self.row] = value
+
+    @property
+    def tree_id(self) -> int:
+        return self.store.tree_ids[self.row]
+
+    @tree_id.setter
+    def tree_id(self, value: int):
+        self.store.tree_ids[self.row] = value
+
+    @property
+    def remaining(self) -> int:
+        return self.store.remainings[self.row]
+
+    @remaining.setter
+    def remaining(self, value: int):
+        self.store.remainings[self.row] = value
+
+    @property
+    def free_depth(self) -> int:
+        return self.store.free_depths[self.row]
+
+    @free_depth.setter
+    def free_depth(self, value: int):
+        self.store.free_depths[self.row] = value
+
+    @property
+    def free_node(self) -> int:
+        return self.store.free_nodes[self.row]
+
+    @free_node.setter
+    def free_node(self, value: int):
+        self.store.free_nodes[self.row] = value
+
+    def __str__(self):
+        return f"{get_node_name(self.id)} (capacity:{self.capacity})"
+
+    def __repr__(self):
+        return (f"NodeView(id={self.id}, capacity={self.capacity}, parent_id={self.parent_id}, "
+                f"child_ids={self.child_ids!r}, depth={self.depth}, tree_id={self.tree_id}, "
+                f"remaining={self.remaining}, height={self.height}, free_depth={self.free_depth}, "
+                f"free_node={self.free_node})")
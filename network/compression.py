@@ -0,0 +1,60 @@
+'''
+Content encodings of the responses, negotiated with the Accept-Encoding of the request
+
+brotli is preferred to gzip when the client accepts both equally.
+The status is compressed once per published snapshot, see NetworkEngine.get_snapshot.
+'''
+import gzip
+from typing import Dict, List, Union
+import brotli
+
+# the supported encodings, preferred first when the client accepts several equally
+ENCODINGS: List[str] = ["br", "gzip"]
+
+# smaller contents are sent as they are, the compression would save less than the headers
+MINIMUM_SIZE = 500
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    ''' The quality of each coding of the Accept-Encoding header, e.g. {"gzip": 1.0, "br": 0.5} '''
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, *parameters = [x.strip() for x in item.split(";")]
+        if coding == "":
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            if parameter.startswith("q="):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def negotiate_encoding(accept_encoding: Union[str, None]) -> Union[str, None]:
+    ''' The best supported encoding accepted by the client, None for the identity '''
+
+    if not accept_encoding:
+        return None
+
+    qualities = parse_accept_encoding(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(content, GZIP_LEVEL, mtime=0)
+    if encoding == "br":
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    raise ValueError(f"Unsupported encoding {encoding}")
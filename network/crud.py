@@ -1,29 +1,86 @@
-from sqlite3 import connect
-from typing import List, Tuple, Union
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+from .arrays import CHILD_SLOTS, NodeArrays, PositionArray
 from .models import Node, Tree, get_node_name
-from .helper import find_edges, find_node_in_pool, find_subtree_nodes, get_max_depth, get_max_index, get_possible_nodes, sort_by_key, get_total_remaining_capacity, update_depth
-from copy import deepcopy
+from .helper import dump_json, find_best_combination, find_descendants, find_free_slots, find_node_in_pool, find_subtree_edges, find_subtree_info, mark_stale, update_subtree
+from .index import CapacityIndex, ForestIndex, HeightIndex, PlacementIndex, TreeList
+from .metrics import Metrics
+from .rebalance import rebalance_tree
+
+# the policies of the join to choose the parent of a new node
+# best-fit   : the node with the most remaining capacity, then the lowest identifier
+# shallowest : the shallowest node with a remaining capacity, then the most remaining capacity, then the lowest identifier
+PLACEMENTS = ["best-fit", "shallowest"]
 
 
 class P2PNetwork():
     '''
     A network of the system
     It has a list of all the nodes, and a list of all the trees
+    The positions of the nodes and trees in those lists are kept by identifier (see TreeList for the trees)
+    The rendered info of each tree is cached until the tree is changed
+    The remaining capacity and the attachable nodes of each tree are counted on every change of a node
+    The listeners are called with an event for each change of the topology
+    The changes are numbered by seq, even without listeners, so a status tells the last change it has
     It has the following three main methods
 
     join  :  deals with a new connection of a node
     leave :  removes the node, and rebuild the network
     info  :  returns the whole structure of the current network
+
+    apply runs a batch of joins and leaves in order, and the ticks of the rebalancer (see network.rebalance)
+
+    The nodes are Node objects by default, or views of typed arrays with the storage of "arrays"
+    The operations are instrumented only when the metrics are given (see network.metrics)
+    The joins use the placement unless another one is given with the join (see PLACEMENTS)
+    After each join and leave, at most the consolidation number of trees are attached to the others (see consolidate)
     '''
 
-    def __init__(self):
+    def __init__(self, storage: str = "objects", metrics: Union[Metrics, None] = None, placement: str = "best-fit",
+                 consolidation: int = 0):
+        if storage not in ["objects", "arrays"]:
+            raise ValueError(f"Unknown storage: {storage}")
+        if placement not in PLACEMENTS:
+            raise ValueError(f"Unknown placement: {placement}")
+
+        self.node_store: Union[NodeArrays, None] = NodeArrays() if storage == "arrays" else None
         self.nodes: List[Node] = []
-        self.trees: List[Tree] = []
+        self.trees = TreeList()
+        self.node_positions: Union[Dict[int, int], PositionArray] = {}
+        if self.node_store is not None:
+            self.node_positions = PositionArray()
         self.max_node_id = 0
         self.max_tree_id = 0
+        self.capacity_index = CapacityIndex()
+        self.placement_index = PlacementIndex()
+        if placement == "shallowest":
+            self.placement_index.rebuild([])
+        self.placement = placement
+        self.forest_index = ForestIndex()
+        if consolidation > 0:
+            self.forest_index.rebuild([])
+        self.consolidation = consolidation
+        self.height_index = HeightIndex()
+        self.tree_info_cache: Dict[int, dict] = {}
+        self.tree_json_cache: Dict[int, bytes] = {}
+        self.info_json_cache: Union[bytes, None] = None
+        self.listeners: List[Callable[[dict], None]] = []
+        self.seq = 0
+        self.metrics = metrics
+
+    def join(self, capacity: int, placement: Union[str, None] = None) -> int:
+        '''
+        Add a new node with capacity into the network, returns its identifier
+        A capacity out of 0 to CHILD_SLOTS is rejected with a ValueError before anything is changed
+        '''
+
+        if not 0 <= capacity <= CHILD_SLOTS:
+            raise ValueError(f"Invalid capacity: {capacity}")
+        if placement is None:
+            placement = self.placement
+        elif placement not in PLACEMENTS:
+            raise ValueError(f"Unknown placement: {placement}")
 
-    def join(self, capacity: int):
-        ''' Add a new node with capacity into the network '''
+        started_at = self.metrics.begin() if self.metrics is not None else 0.0
 
         # default node to be created
         new_node = Node(
@@ -33,7 +90,10 @@ class P2PNetwork():
             child_ids=[],
             depth=0,
             tree_id=self.max_tree_id + 1,
-            remaining=capacity
+            remaining=capacity,
+            height=0,
+            free_depth=0 if capacity > 0 else -1,
+            free_node=self.max_node_id + 1 if capacity > 0 else 0
         )
 
         # default tree to be created
@@ -43,17 +103,13 @@ class P2PNetwork():
             root_id=new_node.id
         )
 
+        # take the best fitting node from the index of the placement
+        best_fitting_node = self.find_free_node(placement)
+
         # if there's no node in the network, just add a new node and tree
-        if len(self.nodes) == 0:
+        if best_fitting_node is None:
             self.add_tree(new_tree)
         else:
-            # find the best fitting node
-            remainings = [node_item.remaining for node_item in self.nodes]
-            best_fitting_index = get_max_index(remainings)
-
-            # take the best fitting node
-            best_fitting_node = self.nodes[best_fitting_index]
-
             if best_fitting_node.remaining == 0:
                 # if the best fitting node has no capacity, add a new node and tree
                 self.add_tree(new_tree)
@@ -61,17 +117,26 @@ class P2PNetwork():
                 # if the best fitting node has capacity, set a new node as it's child
                 new_node.parent_id = best_fitting_node.id
                 new_node.tree_id = best_fitting_node.tree_id
-                new_node.depth = best_fitting_node.depth + 1
 
                 # update best_fitting_node
                 best_fitting_node.child_ids.append(new_node.id)
-                best_fitting_node.remaining -= 1
+                self.set_remaining(best_fitting_node,
+                                   best_fitting_node.remaining - 1)
+                mark_stale(best_fitting_node, self.get_node)
 
                 _, cur_tree = self.find_tree(new_node.tree_id)
                 cur_tree.node_ids.append(new_node.id)
 
         # add a node
         self.add_node(new_node)
+        self.emit("join", id=new_node.id, capacity=capacity,
+                  parent=new_node.parent_id, tree=new_node.tree_id)
+        if self.consolidation > 0:
+            self.consolidate(self.consolidation)
+
+        if self.metrics is not None:
+            self.metrics.end("join", started_at)
+        return new_node.id
 
     def leave(self, node_id: int) -> bool:
         ''' Remove the node from the network, rebuild '''
@@ -79,71 +144,151 @@ class P2PNetwork():
         # get the current node
         cur_node_index, cur_node = self.find_node(node_id)
         if cur_node is None:
+            if self.metrics is not None:
+                self.metrics.count("failed_leaves")
             return False
 
-        # get the number of children of the current node
-        number_of_childs = len(cur_node.child_ids)
+        started_at = self.metrics.begin() if self.metrics is not None else 0.0
 
         # get the tree that has the current node
         cur_tree_id = cur_node.tree_id
         cur_tree_index, cur_tree = self.find_tree(cur_tree_id)
 
+        self.invalidate(cur_tree_id)
+        self.emit("leave", id=node_id, tree=cur_tree_id)
+
         # check if the current node is the root or not
         is_root = node_id == cur_tree.root_id
 
-        # get all the nodes of the tree
-        cur_tree.node_ids.sort()
-        cur_tree_nodes: List[Node] = [
-            self.nodes[self.find_node(x)[0]] for x in cur_tree.node_ids]
-
         # divide the tree
-        sub_trees = self.divide_tree(cur_node, cur_tree_nodes, is_root)
+        step_started_at = self.metrics.step() if self.metrics is not None else 0.0
+        sub_trees = self.divide_tree(cur_node, is_root)
+        if self.metrics is not None:
+            self.metrics.end("divide", step_started_at)
+
+        # the parent gets back the slot of the current node
+        if not is_root:
+            _, p_node = self.find_node(cur_node.parent_id)
+            p_node.child_ids.remove(node_id)
+            self.set_remaining(p_node, p_node.remaining + 1)
+            mark_stale(p_node, self.get_node)
+
+        # remove the node from the tree
+        cur_tree.node_ids.remove(node_id)
+        self.remove_node(cur_node_index)
 
         # execute the combination
-        if is_root:
+        if len(sub_trees) == 0:
             # if the root has no child, remove the tree
-            if number_of_childs == 0:
-                self.trees.pop(cur_tree_index)
-            else:
-                # if the root has one child node
-                if number_of_childs == 1:
-                    child_node_id = cur_node.child_ids[0]
-                    _, child_node = self.find_node(child_node_id)
+            self.remove_tree(cur_tree_index)
+        else:
+            self.combine_trees(cur_tree, sub_trees)
+        if self.consolidation > 0:
+            self.consolidate(self.consolidation)
 
-                    # set the child as the root of the current tree
-                    child_node.parent_id = 0
-                    cur_tree.root_id = child_node_id
+        if self.metrics is not None:
+            self.metrics.end("leave", started_at)
+        return True
 
-                # if the root has more than one child node
-                else:
-                    self.combine_trees(cur_tree, sub_trees)
+    def find_free_node(self, placement: str) -> Union[Node, None]:
+        ''' Get the node chosen by the placement as the parent of a join, which may have no remaining capacity '''
 
-                # remove the node from the tree
-                cur_tree.node_ids.remove(node_id)
-        else:
-            # get the parent of the current node
-            _, p_node = self.find_node(cur_node.parent_id)
-            p_node.child_ids.remove(node_id)
+        if placement == "best-fit":
+            return self.capacity_index.best()
+        if not self.placement_index.active:
+            self.placement_index.rebuild(self.trees)
+        return self.placement_index.best(lambda x: self.find_tree(x)[1], self.get_node)
 
-            if number_of_childs == 0:
-                p_node.remaining += 1
-            else:
-                self.combine_trees(cur_tree, sub_trees)
+    def consolidate(self, merges: int) -> int:
+        '''
+        Attach the smallest trees under the free nodes of the other trees, at most the number of merges
+        Returns the number of the attached trees
 
-            # remove the node from the tree
-            cur_tree.node_ids.remove(node_id)
+        The free node is the one the placement of the network would give to a join, and the smallest tree
+        is taken from the forest index, so a merge takes O(log T) apart from moving the nodes to their new tree.
+        The nodes of the smaller of the two trees are moved, so without the leaves a node is moved only
+        when the size of its tree at least doubles, O(log N) times.
+        '''
 
-        self.nodes.pop(cur_node_index)
-        return True
+        if not self.forest_index.active:
+            self.forest_index.rebuild(self.trees)
+
+        attached = 0
+        while attached < merges and len(self.trees) > 1:
+            parent_node = self.find_free_node(self.placement)
+            if parent_node is None or parent_node.remaining == 0:
+                break
+            orphan_tree = self.forest_index.smallest(lambda x: self.find_tree(x)[1], parent_node.tree_id)
+            if orphan_tree is None:
+                break
+            self.attach_tree(orphan_tree, parent_node)
+            attached += 1
+        return attached
+
+    def apply(self, operations: List[dict]) -> List[dict]:
+        '''
+        Apply the operations in order, in the same format of the test cases
+        e.g. [{"join": {"capacity": 1}}, {"leave": {"id": 1}}]
+        A tick of the rebalancer moves at most the given number of nodes of the tree,
+        e.g. {"rebalance": {"tree": 1, "moves": 64}}
 
-    def info(self) -> List[dict]:
-        ''' Outputs the current network info '''
+        Returns the result of each operation, with the identifier of the node
+        The changed trees are rendered again only once, on the next info
+        '''
+
+        results = []
+        for operation in operations:
+            if "join" in operation:
+                node_id = self.join(operation["join"].get("capacity", 0), operation["join"].get("placement", None))
+                results.append({"action": "join", "id": node_id, "success": True})
+            elif "leave" in operation:
+                node_id = operation["leave"].get("id", 0)
+                if self.leave(node_id):
+                    results.append({"action": "leave", "id": node_id, "success": True})
+                else:
+                    results.append({"action": "leave", "id": node_id, "success": False,
+                                    "detail": "Node not found"})
+            elif "rebalance" in operation:
+                tree_id = operation["rebalance"].get("tree", 0)
+                _, cur_tree = self.find_tree(tree_id)
+                if cur_tree is None:
+                    results.append({"action": "rebalance", "tree": tree_id, "success": False,
+                                    "detail": "Tree not found"})
+                else:
+                    result = rebalance_tree(self, cur_tree, operation["rebalance"].get("moves", 0))
+                    results.append({"action": "rebalance", "tree": tree_id, "success": True, **result})
+        return results
 
-        network_info = []
-        trees = deepcopy(self.trees)
-        sort_by_key(trees, "root_id", False)
+    def info(self) -> List[dict]:
+        '''
+        Outputs the current network info
+        The tree infos are shared with the cache, so they must not be modified
+        '''
 
-        for tree in self.trees:
+        return [self.get_tree_info(tree) for tree in self.trees]
+
+    def info_json(self) -> bytes:
+        ''' Outputs the current network info serialized to JSON '''
+
+        if self.info_json_cache is None:
+            started_at = self.metrics.begin() if self.metrics is not None else 0.0
+            tree_jsons = []
+            for tree in self.trees:
+                tree_json = self.tree_json_cache.get(tree.id, None)
+                if tree_json is None:
+                    tree_json = dump_json(self.get_tree_info(tree))
+                    self.tree_json_cache[tree.id] = tree_json
+                tree_jsons.append(tree_json)
+            self.info_json_cache = b"[" + b",".join(tree_jsons) + b"]"
+            if self.metrics is not None:
+                self.metrics.end("info", started_at)
+        return self.info_json_cache
+
+    def get_tree_info(self, tree: Tree) -> dict:
+        ''' Get the info of the tree, rendering it only when it has changed '''
+
+        tree_info = self.tree_info_cache.get(tree.id, None)
+        if tree_info is None:
             tree_info = {}
 
             # get all nodes
@@ -152,43 +297,259 @@ class P2PNetwork():
             # get all edges
             tree_info["edges"] = self.get_all_edges(tree)
 
-            network_info.append(tree_info)
-        return network_info
+            self.tree_info_cache[tree.id] = tree_info
+        return tree_info
+
+    def get_tree_stats(self, tree: Tree) -> dict:
+        '''
+        Get the aggregates of the tree without visiting its nodes
+        The height and the free depth are computed again only for the nodes changed since the last time
+        '''
+
+        root_node = self.get_node(tree.root_id)
+        update_subtree(root_node, self.get_node)
+        return {
+            "tree": tree.id,
+            "root": get_node_name(tree.root_id),
+            "size": len(tree.node_ids),
+            "remaining": tree.remaining,
+            "attachable": tree.attachable,
+            "height": root_node.height,
+            "free_depth": root_node.free_depth
+        }
+
+    def get_stats(self, cursor: int = 0, limit: int = 100) -> Tuple[List[dict], Union[int, None]]:
+        ''' Get the aggregates of the trees with identifiers after the cursor, paged as get_trees '''
+
+        trees, more = self.trees.page(cursor, limit)
+        next_cursor = trees[-1].id if more else None
+        return [self.get_tree_stats(x) for x in trees], next_cursor
+
+    def get_trees(self, cursor: int = 0, limit: int = 100,
+                  depth: Union[int, None] = None) -> Tuple[List[dict], Union[int, None]]:
+        '''
+        Get the views of the trees with identifiers after the cursor, at most the limit of them
+        Returns the views and the cursor of the next page, None after the last page
+        '''
+
+        # the trees are kept in the order of their identifiers
+        trees, more = self.trees.page(cursor, limit)
+        next_cursor = trees[-1].id if more else None
+        return [self.get_tree_view(x, depth) for x in trees], next_cursor
+
+    def get_tree_view(self, tree: Tree, depth: Union[int, None] = None) -> dict:
+        ''' Get the nodes and the edges of the tree, down to the depth below the root if it is set '''
+
+        view = {"tree": tree.id, "root": get_node_name(tree.root_id)}
+        if depth is None:
+            view.update(self.get_tree_info(tree))
+        else:
+            view.update(find_subtree_info(self.get_node(tree.root_id), self.get_node, depth))
+        return view
+
+    def get_subtree_view(self, node_id: int, depth: Union[int, None] = None) -> Union[dict, None]:
+        ''' Get the nodes and the edges under the node, down to the depth below it if it is set '''
+
+        _, cur_node = self.find_node(node_id)
+        if cur_node is None:
+            return None
+        view = {"tree": cur_node.tree_id, "root": get_node_name(node_id)}
+        view.update(find_subtree_info(cur_node, self.get_node, depth))
+        return view
+
+    def get_path(self, node_id: int) -> Union[List[str], None]:
+        ''' Get the names of the node and its ancestors, up to the root of its tree '''
+
+        _, cur_node = self.find_node(node_id)
+        if cur_node is None:
+            return None
+        path = [get_node_name(node_id)]
+        while cur_node.parent_id != 0:
+            path.append(get_node_name(cur_node.parent_id))
+            cur_node = self.get_node(cur_node.parent_id)
+        return path
+
+    def invalidate(self, tree_id: int):
+        ''' Drop the cached info of the tree, and mark it as changed for the indexes of the trees '''
+
+        self.tree_info_cache.pop(tree_id, None)
+        self.tree_json_cache.pop(tree_id, None)
+        self.info_json_cache = None
+        self.placement_index.touch(tree_id)
+        self.forest_index.touch(tree_id)
+        self.height_index.touch(tree_id)
+
+    def restore(self, nodes: List[Node], trees: List[Tree], max_node_id: int, max_tree_id: int):
+        ''' Replace the whole state of the network, e.g. with the one of a snapshot '''
+
+        if self.node_store is not None:
+            self.node_store = NodeArrays()
+            nodes = [self.node_store.add(x) for x in nodes]
+            self.node_positions = PositionArray()
+            for index, node in enumerate(nodes):
+                self.node_positions[node.id] = index
+        else:
+            self.node_positions = {x.id: index for index, x in enumerate(nodes)}
+
+        self.nodes = nodes
+        self.trees = TreeList(trees)
+        self.max_node_id = max_node_id
+        self.max_tree_id = max_tree_id
+        self.capacity_index.rebuild(nodes)
+        if self.placement_index.active:
+            self.placement_index.rebuild(trees)
+        if self.forest_index.active:
+            self.forest_index.rebuild(trees)
+        if self.height_index.active:
+            self.height_index.rebuild(trees)
+        for tree in trees:
+            tree.remaining = tree.attachable = 0
+            tree.capacities = [0] * len(tree.capacities)
+        for node in nodes:
+            self.count_capacity(node, 1)
+        self.tree_info_cache = {}
+        self.tree_json_cache = {}
+        self.info_json_cache = None
+
+    def emit(self, event_type: str, **fields):
+        ''' Number the topology change, and send an event of it to the listeners '''
+
+        self.seq += 1
+        if len(self.listeners) == 0:
+            return
+
+        event = {"type": event_type, "seq": self.seq}
+        event.update(fields)
+        for listener in self.listeners:
+            listener(event)
 
     def add_tree(self, new_tree: Tree):
         ''' Add a new tree to the network '''
 
         self.trees.append(new_tree)
+        self.invalidate(new_tree.id)
+
+        # the nodes added before their tree are counted now
+        for node_id in new_tree.node_ids:
+            if node_id in self.node_positions:
+                self.count_capacity(self.get_node(node_id), 1)
+        self.emit("tree", tree=new_tree.id)
         self.max_tree_id += 1
+        if self.metrics is not None:
+            self.metrics.count("trees_created")
 
     def add_node(self, new_node: Node):
         ''' Add a new node to the network '''
 
+        if self.node_store is not None:
+            new_node = self.node_store.add(new_node)
+
+        self.node_positions[new_node.id] = len(self.nodes)
         self.nodes.append(new_node)
+        self.capacity_index.add(new_node)
+        self.count_capacity(new_node, 1)
+        self.invalidate(new_node.tree_id)
         self.max_node_id += 1
 
+    def remove_tree(self, index: int):
+        ''' Remove the tree at the index given by find_tree, keeping the order of the others '''
+
+        removed_tree = self.trees.pop(index)
+        self.invalidate(removed_tree.id)
+        self.placement_index.remove(removed_tree.id)
+        self.forest_index.remove(removed_tree.id)
+        self.height_index.remove(removed_tree.id)
+        self.emit("drop", tree=removed_tree.id)
+        if self.metrics is not None:
+            self.metrics.count("trees_removed")
+
+    def remove_node(self, index: int):
+        ''' Remove the node at the index, moving the last node into its place '''
+
+        removed_node = self.nodes[index]
+        last_node = self.nodes.pop()
+        if last_node is not removed_node:
+            self.nodes[index] = last_node
+            self.node_positions[last_node.id] = index
+
+        del self.node_positions[removed_node.id]
+        self.capacity_index.remove(removed_node)
+        self.count_capacity(removed_node, -1)
+        if self.node_store is not None:
+            self.node_store.remove(removed_node)
+
+    def set_remaining(self, node: Node, remaining: int):
+        ''' Update the remaining capacity of the node and keep the index in sync '''
+
+        old_remaining = node.remaining
+        node.remaining = remaining
+        self.capacity_index.update(node, old_remaining)
+
+        _, tree = self.find_tree(node.tree_id)
+        if tree is not None:
+            tree.remaining += remaining - old_remaining
+            tree.attachable += (remaining > 0) - (old_remaining > 0)
+
+    def count_capacity(self, node: Node, sign: int):
+        ''' Add the remaining capacity of the node to the aggregates of its tree, or take it away with -1 '''
+
+        _, tree = self.find_tree(node.tree_id)
+        if tree is None:
+            return
+        tree.remaining += sign * node.remaining
+        tree.attachable += sign * (node.remaining > 0)
+        tree.capacities[node.capacity] += sign
+
     def find_tree(self, tree_id: int) -> Tuple[int, Union[Tree, None]]:
         ''' Find a tree with a specific identifer '''
 
-        for index, tree_item in enumerate(self.trees):
-            if tree_item.id == tree_id:
-                return index, self.trees[index]
-        return -1, None
+        return self.trees.find(tree_id)
 
     def find_node(self, node_id: int, nodes: List[Node] = []) -> Tuple[int, Union[Node, None]]:
         ''' Find a node in the network or in the list of nodes '''
 
         if len(nodes) > 0:
             return find_node_in_pool(node_id, nodes)
-        else:
-            return find_node_in_pool(node_id, self.nodes)
 
-    def get_all_nodes(self, node_ids: List[int]) -> dict:
+        index = self.node_positions.get(node_id, -1)
+        if index < 0:
+            return -1, None
+        return index, self.nodes[index]
+
+    def get_node(self, node_id: int) -> Node:
+        ''' Get a node of the network by its identifier '''
+
+        return self.nodes[self.node_positions[node_id]]
+
+    def get_depth(self, node_id: int) -> int:
+        ''' Get the depth of the node in its tree, following its ancestors, whose depths are computed again '''
+
+        path = [self.get_node(node_id)]
+        while path[-1].parent_id != 0:
+            path.append(self.get_node(path[-1].parent_id))
+        for depth, cur_node in enumerate(reversed(path)):
+            cur_node.depth = depth
+        return path[0].depth
+
+    def get_height(self, tree: Tree) -> int:
+        ''' Get the maximum depth of the nodes of the tree '''
+
+        root_node = self.get_node(tree.root_id)
+        update_subtree(root_node, self.get_node)
+        return root_node.height
+
+    def get_max_height(self) -> int:
+        ''' Get the maximum height of the trees, counting again only the trees changed since the last time '''
+
+        if not self.height_index.active:
+            self.height_index.rebuild(self.trees)
+        return self.height_index.maximum(lambda x: self.find_tree(x)[1], self.get_node)
+
+    def get_all_nodes(self, node_ids: Iterable[int]) -> dict:
         ''' Get the information of the nodes '''
 
-        node_ids.sort()
         nodes_info = {}
-        for node_id in node_ids:
+        for node_id in sorted(node_ids):
             _, cur_node = self.find_node(node_id)
             nodes_info[get_node_name(node_id)] = cur_node.capacity
         return nodes_info
@@ -196,94 +557,183 @@ class P2PNetwork():
     def get_all_edges(self, tree: Tree) -> List[List]:
         ''' Get the list of all the direct edges in the tree '''
 
-        node_ids = tree.node_ids.copy()
-        node_ids.remove(tree.root_id)
-        remaining_nodes: List[Node] = [
-            deepcopy(self.nodes[self.find_node(x)[0]]) for x in node_ids]
-        all_edges = []
-        find_edges(tree.root_id, remaining_nodes, all_edges)
-        return all_edges
+        return find_subtree_edges(self.get_node(tree.root_id), self.get_node)
+
+    def divide_tree(self, p_node: Node, is_root: bool = True) -> List[Node]:
+        '''
+        Divide the tree after removing the specific node, returns the roots of the subtrees
+        The rest of the tree, under the root of the tree, comes first, and then the children of the node.
+        The subtrees are only given by their roots, so dividing takes O(number of children).
+        '''
+
+        sub_trees = [self.get_node(x) for x in p_node.child_ids]
+        if not is_root:
+            _, cur_tree = self.find_tree(p_node.tree_id)
+            sub_trees.insert(0, self.get_node(cur_tree.root_id))
+        return sub_trees
+
+    def combine_trees(self, cur_tree: Tree, sub_trees: List[Node]):
+        '''
+        Combine the subtrees into the fewest trees, and then the shallowest
+        The number of subtrees could be any of 1, 2, 3, and 4, each given by its root.
+        The current tree keeps the first of the combined trees, and the others are new trees.
+
+        The heights and free slots of the subtrees are read from their roots,
+        computing again only the nodes changed since the last time,
+        and the combination takes a search of at most 4! steps (see find_best_combination).
+        Attaching a subtree only marks the ancestors of its new parent,
+        and only the nodes of the subtrees moved to a new tree are visited, to change their tree.
+        '''
+
+        # a subtree that is already the whole tree stays as it is
+        if len(sub_trees) == 1 and sub_trees[0].id == cur_tree.root_id:
+            return
 
-    def divide_tree(self, p_node: Node, nodes: List[Node], is_root: bool = True) -> List[List[Node]]:
-        ''' Divide the tree after removing the specific node '''
+        self.invalidate(cur_tree.id)
+
+        started_at = self.metrics.step() if self.metrics is not None else 0.0
+        for root_node in sub_trees:
+            update_subtree(root_node, self.get_node)
+        slots = [find_free_slots(x, self.get_node, len(sub_trees) - 1) for x in sub_trees]
+        combination = find_best_combination([x.height for x in sub_trees], slots)
+        if self.metrics is not None:
+            self.metrics.end("search", started_at)
+            started_at = self.metrics.step()
+            self.metrics.count("subtrees_merged", len(combination.attachments))
+            self.metrics.count("nodes_reparented", len(combination.attachments) + sum(
+                1 for x in combination.roots if sub_trees[x].parent_id != 0))
+
+        # set the roots of the trees
+        tree_of_sub_trees: Dict[int, Tree] = {}
+        moved_nodes = 0
+        for order, sub_tree in enumerate(combination.roots):
+            root_node = sub_trees[sub_tree]
+            if order == 0:
+                sub_tree_tree = cur_tree
+                sub_tree_tree.root_id = root_node.id
+            else:
+                sub_tree_tree = Tree(
+                    id=self.max_tree_id + 1,
+                    node_ids=[],
+                    root_id=root_node.id
+                )
+                self.add_tree(sub_tree_tree)
+
+            root_node.parent_id = 0
+            tree_of_sub_trees[sub_tree] = sub_tree_tree
+            moved_nodes += self.move_subtree(cur_tree, root_node, sub_tree_tree)
+
+        # attach the other subtrees, under the nodes of the subtrees attached before,
+        # each moved to the tree of its new parent before anything is attached under it
+        sub_tree_of_slots = {node_id: index for index, x in enumerate(slots) for _, node_id in x}
+        for sub_tree, parent_node_id, _ in combination.attachments:
+            parent_node = self.get_node(parent_node_id)
+            root_node = sub_trees[sub_tree]
+            tree_of_sub_trees[sub_tree] = tree_of_sub_trees[sub_tree_of_slots[parent_node_id]]
+            moved_nodes += self.move_subtree(cur_tree, root_node, tree_of_sub_trees[sub_tree])
+
+            root_node.parent_id = parent_node_id
+            parent_node.child_ids.append(root_node.id)
+            self.set_remaining(parent_node, parent_node.remaining - 1)
+            mark_stale(parent_node, self.get_node)
+
+        for sub_tree, sub_tree_tree in sorted(tree_of_sub_trees.items()):
+            root_node = sub_trees[sub_tree]
+            self.emit("move", id=root_node.id,
+                      parent=root_node.parent_id, tree=sub_tree_tree.id)
+
+        if self.metrics is not None:
+            self.metrics.observe_recombination(len(sub_trees), moved_nodes)
+            self.metrics.end("combine", started_at)
+
+    def move_subtree(self, cur_tree: Tree, root_node: Node, new_tree: Tree) -> int:
+        '''
+        Move the nodes of the subtree from the current tree to the new tree, returns the number of the moved nodes
+        A subtree staying in the current tree is not visited.
+        '''
 
-        tree_set = []
-        all_descendants = [p_node.id]
-        for child_node_id in p_node.child_ids:
-            _, child_node = self.find_node(child_node_id, nodes)
-            temp_sub_tree = [child_node]
-            find_subtree_nodes(child_node_id, nodes, temp_sub_tree)
-            tree_set.append(temp_sub_tree)
+        if new_tree is cur_tree:
+            return 0
 
-            for sub_node in temp_sub_tree:
-                all_descendants.append(sub_node.id)
+        sub_nodes = [root_node] + find_descendants(root_node, self.get_node)
+        for sub_node in sub_nodes:
+            self.count_capacity(sub_node, -1)
+            sub_node.tree_id = new_tree.id
+            self.count_capacity(sub_node, 1)
+            cur_tree.node_ids.remove(sub_node.id)
+            new_tree.node_ids.append(sub_node.id)
+        return len(sub_nodes)
 
-        if not is_root:
-            remainings = [x for x in nodes if x.id not in all_descendants]
-            if len(remainings) > 0:
-                tree_set.insert(0, remainings)
+    def move_node(self, cur_node: Node, parent_node: Node):
+        ''' Move the node with its subtree under another node of its tree, which has a remaining capacity '''
 
-        return tree_set
+        old_parent_node = self.get_node(cur_node.parent_id)
+        old_parent_node.child_ids.remove(cur_node.id)
+        self.set_remaining(old_parent_node, old_parent_node.remaining + 1)
+        mark_stale(old_parent_node, self.get_node)
 
-    def combine_trees(self, cur_tree: Tree, sub_trees: List[List[Node]]):
+        cur_node.parent_id = parent_node.id
+        parent_node.child_ids.append(cur_node.id)
+        self.set_remaining(parent_node, parent_node.remaining - 1)
+        mark_stale(parent_node, self.get_node)
+
+        self.invalidate(cur_node.tree_id)
+        self.emit("move", id=cur_node.id, parent=parent_node.id, tree=cur_node.tree_id)
+
+    def swap_nodes(self, first_node: Node, second_node: Node):
         '''
-        Combine the subtrees
-        The number of subtrees could be either of 2, 3, and 4.
-        But for now, just consider the case that there are two subtrees.
+        Swap the places of two nodes of a tree, each with its subtree, but none of them may be under the other
+        Their parents keep the same number of children, so the same remaining capacities.
         '''
 
-        if len(sub_trees) == 1:
-            return
+        first_parent_node = self.get_node(first_node.parent_id)
+        second_parent_node = self.get_node(second_node.parent_id)
+        first_parent_node.child_ids.remove(first_node.id)
+        first_parent_node.child_ids.append(second_node.id)
+        second_parent_node.child_ids.remove(second_node.id)
+        second_parent_node.child_ids.append(first_node.id)
+        first_node.parent_id, second_node.parent_id = second_parent_node.id, first_parent_node.id
+        mark_stale(first_parent_node, self.get_node)
+        mark_stale(second_parent_node, self.get_node)
+
+        self.invalidate(first_node.tree_id)
+        self.emit("move", id=second_node.id, parent=first_parent_node.id, tree=second_node.tree_id)
+        self.emit("move", id=first_node.id, parent=second_parent_node.id, tree=first_node.tree_id)
+
+    def attach_tree(self, orphan_tree: Tree, parent_node: Node):
+        '''
+        Attach the root of the tree under a node of another tree, which has a remaining capacity
+        The merged tree keeps the identifier of the larger of the two, or of the older one with the same size,
+        and the nodes of the other are moved to it.
+        '''
+
+        _, parent_tree = self.find_tree(parent_node.tree_id)
+        root_node = self.get_node(orphan_tree.root_id)
+        self.invalidate(orphan_tree.id)
+        self.invalidate(parent_tree.id)
+
+        # the nodes are moved before the trees are joined, so only the smaller tree is visited
+        if (len(orphan_tree.node_ids), -orphan_tree.id) > (len(parent_tree.node_ids), -parent_tree.id):
+            parent_root_node = self.get_node(parent_tree.root_id)
+            self.move_subtree(parent_tree, parent_root_node, orphan_tree)
+            orphan_tree.root_id = parent_root_node.id
+            merged_tree, removed_tree = orphan_tree, parent_tree
+            self.emit("move", id=parent_root_node.id, parent=0, tree=merged_tree.id)
         else:
-            if len(sub_trees) == 2:
-                self.combine_two_trees(cur_tree, sub_trees[0], sub_trees[1])
-            else:
-                # TODO: implement the combination of 3 or 4 sub trees
-                pass
+            self.move_subtree(orphan_tree, root_node, parent_tree)
+            merged_tree, removed_tree = parent_tree, orphan_tree
+
+        root_node.parent_id = parent_node.id
+        parent_node.child_ids.append(root_node.id)
+        self.set_remaining(parent_node, parent_node.remaining - 1)
+        mark_stale(parent_node, self.get_node)
+        self.emit("move", id=root_node.id, parent=parent_node.id, tree=merged_tree.id)
+
+        self.remove_tree(self.find_tree(removed_tree.id)[0])
+        if self.metrics is not None:
+            self.metrics.count("trees_consolidated")
 
     def combine_two_trees(self, cur_tree: Tree, left: List[Node], right: List[Node]):
-        ''' Combine the two trees'''
-
-        update_depth(left, left[0].depth)
-        update_depth(right, right[0].depth)
-        left_node_ids = [x.id for x in left]
-        right_node_ids = [x.id for x in right]
-
-        # check if there are any node that has a remaining capacity
-        if get_total_remaining_capacity(left) + get_total_remaining_capacity(right) == 0:
-            # update the current tree
-            cur_tree.root_id = left[0].id
-            cur_tree.node_ids = left_node_ids
-
-            # create a new tree
-            new_tree = Tree(
-                id=self.max_tree_id + 1,
-                node_ids=right_node_ids,
-                root_id=right[0].id
-            )
-            self.add_tree(new_tree)
-        else:
-            # find the connecting node with the smallest depth after combined
-            left_connectable_nodes = get_possible_nodes(left)
-            update_depth(left_connectable_nodes, get_max_depth(right))
-            right_connectable_nodes = get_possible_nodes(right)
-            update_depth(right_connectable_nodes, get_max_depth(left))
-
-            left_connectable_nodes.extend(right_connectable_nodes)
-            sort_by_key(left_connectable_nodes, "depth", False)
-
-            connecting_node = left_connectable_nodes[0]
-
-            # combine the two
-            if connecting_node.id in left_node_ids:
-                cur_tree.root_id = left[0].id
-                left[0].parent_id = 0
-                right[0].parent_id = connecting_node.id
-                update_depth(right, connecting_node.depth)
-            else:
-                cur_tree.root_id = right[0].id
-                right[0].parent_id = 0
-                left[0].parent_id = connecting_node.id
-                update_depth(left, connecting_node.depth)
+        ''' Combine the two trees, each starting with its root '''
 
-            connecting_node.remaining -= 1
+        self.combine_trees(cur_tree, [left[0], right[0]])
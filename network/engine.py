@@ -0,0 +1,222 @@
+import asyncio
+from concurrent.futures import Future
+from queue import SimpleQueue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple, Union
+from .compression import MINIMUM_SIZE, compress
+from .crud import P2PNetwork
+from .persistence import NetworkStore
+
+# the operations to apply or the query to run, with the future of the results
+Pending = Tuple[Union[List[dict], Callable[[P2PNetwork], Any]], Future]
+
+
+class NetworkEngine():
+    '''
+    A single writer in front of a network
+    The joins and leaves are queued, and one writer thread applies them in order.
+    The status is read from the snapshot published by the writer, so the readers never see a half-applied change.
+    The snapshot is published lazily: the writer only marks it as stale after the operations,
+    and the first read of a stale status has the writer render it, behind the operations queued before.
+    So the joins and leaves never pay for the rendering, and the status is rendered at most once per change.
+
+    network      : the network, only changed by the writer thread
+    queue        : the submitted operations or queries with the futures of their results
+    snapshot     : the JSON status published last
+    stale        : whether operations were applied since the snapshot was published
+    encoded      : the snapshot with its compressed contents by encoding, made on the first request of each,
+                   and the sequence number of the last topology change in it (see P2PNetwork.emit)
+    version      : the number of the published snapshots
+    store        : the durable storage of the operations, if any
+
+    A query is a function of the network, run by the writer thread between the operations,
+    so it reads a consistent network without copying it.
+
+    With a store, the operations are logged before they are applied,
+    and the log is committed once for everything applied together, before the results are returned.
+    '''
+
+    def __init__(self, network: P2PNetwork, store: Union[NetworkStore, None] = None):
+        self.network = network
+        self.store = store
+        self.queue: SimpleQueue = SimpleQueue()
+        self.snapshot: bytes = network.info_json()
+        self.stale = False
+        self.encoded: Tuple[bytes, Dict[str, bytes], int] = (self.snapshot, {}, network.seq)
+        self.version = 0
+        self.thread: Union[Thread, None] = None
+        self.start_lock = Lock()
+
+        # statistics
+        self.applied_operations = 0
+        self.applied_batches = 0
+        self.busy_seconds = 0.0
+        self.throughput = 0.0
+        self.window_start = perf_counter()
+        self.window_operations = 0
+
+    def submit(self, operations: Union[List[dict], Callable[[P2PNetwork], Any]]) -> Future:
+        ''' Queue the operations or a query, returns the future of their results '''
+
+        if self.thread is None:
+            self.start()
+
+        future = Future()
+        self.queue.put((operations, future))
+        return future
+
+    async def execute(self, operations: List[dict]) -> List[dict]:
+        ''' Queue the operations and wait for their results '''
+
+        return await asyncio.wrap_future(self.submit(operations))
+
+    async def query(self, function: Callable[[P2PNetwork], Any]) -> Any:
+        ''' Queue a query of the network and wait for its result '''
+
+        return await asyncio.wrap_future(self.submit(function))
+
+    def start(self):
+        ''' Start the writer thread '''
+
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name="network-writer", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        ''' Apply the queued operations and run the queued queries forever '''
+
+        while True:
+            # take everything in the queue, waiting only for the first one
+            pending: List[Pending] = [self.queue.get()]
+            while not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            self.apply_pending(pending)
+
+    def apply_pending(self, pending: List[Pending]):
+        ''' Apply the operations and run the queries, mark the snapshot as stale, then resolve the futures '''
+
+        started_at = perf_counter()
+        outcomes = []
+        answers = []
+        number_of_operations = 0
+        for operations, future in pending:
+            if callable(operations):
+                # a query, which sees every operation queued before it
+                try:
+                    answers.append((future, operations(self.network), None))
+                except Exception as error:
+                    answers.append((future, None, error))
+                continue
+
+            try:
+                outcomes.append((future, self.apply_operations(operations), None))
+            except Exception as error:
+                outcomes.append((future, None, error))
+            number_of_operations += len(operations)
+            self.stale = True
+
+        if len(outcomes) > 0:
+            if self.store is not None:
+                try:
+                    self.store.commit()
+                    if self.store.should_snapshot():
+                        self.store.snapshot(self.network)
+                except Exception as error:
+                    outcomes = [(x[0], None, error) for x in outcomes]
+
+            self.update_statistics(started_at, len(outcomes), number_of_operations)
+
+        for future, results, error in outcomes + answers:
+            if error is None:
+                future.set_result(results)
+            else:
+                future.set_exception(error)
+
+    def apply_operations(self, operations: List[dict]) -> List[dict]:
+        ''' Apply the operations, logging each one right before it is applied '''
+
+        if self.store is None:
+            return self.network.apply(operations)
+
+        results = []
+        for operation in operations:
+            self.store.append(operation)
+            results.extend(self.network.apply([operation]))
+        return results
+
+    def publish(self):
+        ''' Publish the current status of the network if it is stale, as a query of the writer '''
+
+        if not self.stale:
+            return
+        # the status never shows an operation before it is in the log
+        if self.store is not None:
+            self.store.commit()
+        self.snapshot = self.network.info_json()
+        self.stale = False
+        self.version += 1
+        # the same bytes when nothing changed, so the compressed contents are kept
+        if self.encoded[0] is not self.snapshot:
+            self.encoded = (self.snapshot, {}, self.network.seq)
+
+    def refresh(self) -> Future:
+        ''' Have the writer publish the status after the queued operations, returns the future of it '''
+
+        if not self.stale:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.submit(lambda network: self.publish())
+
+    def get_snapshot(self, encoding: Union[str, None] = None) -> Tuple[bytes, Union[str, None], int]:
+        '''
+        Get the published snapshot in the encoding, with the encoding actually used and the sequence number of it
+        A small snapshot is not compressed, and the compressed contents are made once per snapshot
+        The snapshot is the one published last, after refresh it has the operations applied before
+        '''
+
+        # the snapshot and its encodings are published together by the writer, so they always match
+        snapshot, encoded, seq = self.encoded
+        if encoding is None or len(snapshot) < MINIMUM_SIZE:
+            return snapshot, None, seq
+
+        content = encoded.get(encoding, None)
+        if content is None:
+            content = compress(snapshot, encoding)
+            encoded[encoding] = content
+        return content, encoding, seq
+
+    def update_statistics(self, started_at: float, number_of_batches: int, number_of_operations: int):
+        ''' Count the applied operations and the throughput of the last second '''
+
+        finished_at = perf_counter()
+        self.applied_batches += number_of_batches
+        self.applied_operations += number_of_operations
+        self.busy_seconds += finished_at - started_at
+
+        self.window_operations += number_of_operations
+        if finished_at - self.window_start >= 1.0:
+            self.throughput = self.window_operations / (finished_at - self.window_start)
+            self.window_start = finished_at
+            self.window_operations = 0
+
+    def stats(self) -> dict:
+        ''' Get the statistics of the writer '''
+
+        # the last window is over when the writer has been idle for a while
+        throughput = self.throughput
+        elapsed = perf_counter() - self.window_start
+        if elapsed >= 2.0:
+            throughput = self.window_operations / elapsed
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "applied_operations": self.applied_operations,
+            "applied_batches": self.applied_batches,
+            "busy_seconds": self.busy_seconds,
+            "throughput": throughput,
+            "version": self.version,
+            "failed_recoveries": self.store.failed_operations if self.store is not None else 0
+        }
@@ -0,0 +1,131 @@
+import asyncio
+from collections import deque
+from threading import Lock
+from typing import AsyncIterator, Deque, List, Union
+from .crud import P2PNetwork
+from .helper import dump_json
+
+
+class Subscription():
+    '''
+    A bounded buffer of the topology events for one consumer
+
+    events     : the events not delivered yet
+    size       : the maximum number of the buffered events
+    overflowed : whether the consumer has to reload the whole status
+
+    A consumer that falls behind by more than the size loses the buffered events,
+    and gets a resync marker instead, so it can never slow down the network.
+    The marker comes alone, as the status reloaded after it already has the dropped events,
+    and the events after the marker are buffered again once it is delivered.
+    '''
+
+    def __init__(self, size: int):
+        self.events: Deque[dict] = deque()
+        self.size = size
+        self.overflowed = True
+        self.lock = Lock()
+        self.loop: Union[asyncio.AbstractEventLoop, None] = None
+        self.waiter: Union[asyncio.Event, None] = None
+
+    def push(self, event: dict):
+        ''' Buffer an event, dropping the buffer when the consumer is too slow '''
+
+        # until the marker is delivered, the events are in the status to reload
+        with self.lock:
+            if not self.overflowed:
+                if len(self.events) >= self.size:
+                    self.events.clear()
+                    self.overflowed = True
+                else:
+                    self.events.append(event)
+
+        # wake up the consumer only when it waits for the events
+        if self.waiter is not None and not self.waiter.is_set():
+            self.loop.call_soon_threadsafe(self.waiter.set)
+
+    def drain(self, seq: int) -> List[dict]:
+        ''' Take all the buffered events, or only a resync marker if the buffer was dropped '''
+
+        with self.lock:
+            if self.overflowed:
+                self.overflowed = False
+                return [{"type": "resync", "seq": seq}]
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+
+class EventFeed():
+    '''
+    A feed of the topology changes of a network
+    It listens to the network only while there are subscriptions
+    The lists of the listeners and subscriptions are replaced instead of changed,
+    so the writer of the network can go through them from another thread
+
+    network       : the network to follow
+    buffer_size   : the maximum number of the buffered events of a subscription
+    subscriptions : the subscriptions of the consumers
+
+    The events are numbered by the network, like the published status (see NetworkEngine),
+    so after a resync marker the events up to the number of the reloaded status are skipped.
+    '''
+
+    def __init__(self, network: P2PNetwork, buffer_size: int = 1024):
+        self.network = network
+        self.buffer_size = buffer_size
+        self.subscriptions: List[Subscription] = []
+
+    @property
+    def seq(self) -> int:
+        ''' The sequence number of the last change of the network '''
+
+        return self.network.seq
+
+    def publish(self, event: dict):
+        ''' Send the event to all the subscriptions '''
+
+        for subscription in self.subscriptions:
+            subscription.push(event)
+
+    def subscribe(self) -> Subscription:
+        ''' Add a subscription, which starts with a resync marker '''
+
+        subscription = Subscription(self.buffer_size)
+        if len(self.subscriptions) == 0:
+            self.network.listeners = self.network.listeners + [self.publish]
+        self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        ''' Remove the subscription '''
+
+        self.subscriptions = [x for x in self.subscriptions if x is not subscription]
+        if len(self.subscriptions) == 0:
+            self.network.listeners = [
+                x for x in self.network.listeners if x != self.publish]
+
+    async def get(self, subscription: Subscription) -> List[dict]:
+        ''' Wait for the events of the subscription '''
+
+        if subscription.waiter is None:
+            subscription.loop = asyncio.get_running_loop()
+            subscription.waiter = asyncio.Event()
+
+        while True:
+            subscription.waiter.clear()
+            events = subscription.drain(self.seq)
+            if len(events) > 0:
+                return events
+            await subscription.waiter.wait()
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        ''' Stream the events as server-sent events until the consumer disconnects '''
+
+        subscription = self.subscribe()
+        try:
+            while True:
+                events = await self.get(subscription)
+                yield b"".join(b"data: " + dump_json(x) + b"\n\n" for x in events)
+        finally:
+            self.unsubscribe(subscription)
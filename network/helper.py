@@ -1,28 +1,92 @@
-from typing import List, Union, Tuple
-from .models import Node, Tree, get_node_name
-import numpy as np
+from typing import Callable, Dict, List, Union, Tuple
+from .models import Combination, Node, Tree, get_node_name
+import heapq
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def get_child_map(nodes: List[Node]) -> Dict[int, List[int]]:
+    ''' Group the identifiers of the nodes by their parents '''
+
+    child_map: Dict[int, List[int]] = {}
+    for node in nodes:
+        child_map.setdefault(node.parent_id, []).append(node.id)
+    return child_map
 
 
 def find_edges(parent_node_id: int, remaining_nodes: List[Node], all_edges: List[List]):
     ''' Find all the edges from the tree '''
 
-    if len(remaining_nodes) == 0:
-        return
-    else:
-        # get child nodes
-        child_nodes = [
-            x.id for x in remaining_nodes if x.parent_id == parent_node_id]
-        child_nodes.sort()
+    child_map = get_child_map(remaining_nodes)
+
+    # visit the children in the order of the identifiers, depth first
+    stack = [(parent_node_id, x) for x in sorted(
+        child_map.get(parent_node_id, []), reverse=True)]
+    while len(stack) > 0:
+        cur_parent_id, child_node_id = stack.pop()
+        all_edges.append([get_node_name(cur_parent_id),
+                         get_node_name(child_node_id)])
+        stack.extend((child_node_id, x) for x in sorted(
+            child_map.pop(child_node_id, []), reverse=True))
+
+
+def find_subtree_edges(root_node: Node, get_node: Callable[[int], Node]) -> List[List]:
+    ''' Find all the edges of the subtree using the child identifiers of the nodes '''
 
-        # update remaining nodes
-        updated_remaining_nodes = [
-            x for x in remaining_nodes if x.id not in child_nodes]
+    all_edges = []
+    stack = [(root_node.id, x) for x in sorted(root_node.child_ids, reverse=True)]
+    while len(stack) > 0:
+        cur_parent_id, child_node_id = stack.pop()
+        all_edges.append([get_node_name(cur_parent_id),
+                         get_node_name(child_node_id)])
+        stack.extend((child_node_id, x) for x in sorted(
+            get_node(child_node_id).child_ids, reverse=True))
+    return all_edges
 
-        # loop over the child nodes, call the function recursively
-        for child_node_id in child_nodes:
-            all_edges.append([get_node_name(parent_node_id),
-                             get_node_name(child_node_id)])
-            find_edges(child_node_id, updated_remaining_nodes, all_edges)
+
+def find_subtree_info(root_node: Node, get_node: Callable[[int], Node], depth: Union[int, None] = None) -> dict:
+    '''
+    Find the nodes with their capacities and the edges of the subtree, down to the depth below the root if it is set
+    The edges are in the same order as find_subtree_edges, and the nodes are sorted by their identifiers
+    '''
+
+    capacities = {root_node.id: root_node.capacity}
+    all_edges = []
+    stack = []
+    if depth is None or depth > 0:
+        stack = [(root_node.id, x, 1) for x in sorted(root_node.child_ids, reverse=True)]
+    while len(stack) > 0:
+        cur_parent_id, child_node_id, child_depth = stack.pop()
+        child_node = get_node(child_node_id)
+        capacities[child_node_id] = child_node.capacity
+        all_edges.append([get_node_name(cur_parent_id), get_node_name(child_node_id)])
+        if depth is None or child_depth < depth:
+            stack.extend((child_node_id, x, child_depth + 1) for x in sorted(child_node.child_ids, reverse=True))
+
+    nodes_info = {get_node_name(x): capacities[x] for x in sorted(capacities)}
+    return {"nodes": nodes_info, "edges": all_edges}
+
+
+def find_tree_position(trees: List[Tree], tree_id: int) -> int:
+    ''' The position of the first tree with an identifier greater than the one, in the trees sorted by identifier '''
+
+    low, high = 0, len(trees)
+    while low < high:
+        middle = (low + high) // 2
+        if trees[middle].id <= tree_id:
+            low = middle + 1
+        else:
+            high = middle
+    return low
 
 
 def find_node_in_pool(node_id: int, pool: List[Node]) -> Tuple[int, Union[Node, None]]:
@@ -35,39 +99,154 @@ def find_node_in_pool(node_id: int, pool: List[Node]) -> Tuple[int, Union[Node,
 def find_subtree_nodes(root_node_id: int, remaining_nodes: List[Node], all_nodes: List[Node]):
     ''' Find all the nodes of the subtree '''
 
-    if len(remaining_nodes) == 0:
-        return
-    else:
-        # get child nodes
-        child_nodes = [
-            x.id for x in remaining_nodes if x.parent_id == root_node_id]
-        child_nodes.sort()
+    child_map = get_child_map(remaining_nodes)
+    node_map = {x.id: x for x in remaining_nodes}
+
+    # visit the children in the order of the identifiers, depth first
+    stack = sorted(child_map.get(root_node_id, []), reverse=True)
+    while len(stack) > 0:
+        child_node_id = stack.pop()
+        all_nodes.append(node_map[child_node_id])
+        stack.extend(sorted(child_map.pop(child_node_id, []), reverse=True))
+
 
-        if len(child_nodes) == 0:
+def find_descendants(root_node: Node, get_node: Callable[[int], Node]) -> List[Node]:
+    ''' Find all the nodes under the root node using the child identifiers of the nodes '''
+
+    all_nodes = []
+    stack = sorted(root_node.child_ids, reverse=True)
+    while len(stack) > 0:
+        child_node = get_node(stack.pop())
+        all_nodes.append(child_node)
+        stack.extend(sorted(child_node.child_ids, reverse=True))
+    return all_nodes
+
+
+def mark_stale(node: Node, get_node: Callable[[int], Node]):
+    '''
+    Mark the height and free depth of the node and its ancestors to be computed again
+    The ancestors of a stale node are stale, so it stops at the first stale one
+    '''
+
+    while node.height >= 0:
+        node.height = -1
+        if node.parent_id == 0:
             return
+        node = get_node(node.parent_id)
+
+
+def update_subtree(root_node: Node, get_node: Callable[[int], Node]):
+    ''' Compute the height, free depth and free node of the stale nodes of the subtree '''
+
+    # the nodes under a computed node are all computed
+    stale_nodes = []
+    stack = [root_node] if root_node.height < 0 else []
+    while len(stack) > 0:
+        cur_node = stack.pop()
+        stale_nodes.append(cur_node)
+        stack.extend(x for x in map(get_node, cur_node.child_ids) if x.height < 0)
+
+    # the children come before their parents
+    for cur_node in reversed(stale_nodes):
+        height = 0
+        free_depth, free_node, free_remaining = -1, 0, 0
+        if cur_node.remaining > 0:
+            free_depth, free_node, free_remaining = 0, cur_node.id, cur_node.remaining
+        for child_node in map(get_node, cur_node.child_ids):
+            height = max(height, child_node.height + 1)
+            if child_node.free_depth < 0 or (free_depth >= 0 and child_node.free_depth + 1 > free_depth):
+                continue
 
-        # update remaining nodes
-        updated_remaining_nodes = [
-            x for x in remaining_nodes if x.id not in child_nodes]
+            # the same depth goes to the most remaining capacity, then to the lowest identifier
+            child_remaining = get_node(child_node.free_node).remaining
+            if child_node.free_depth + 1 == free_depth and \
+                    (child_remaining, -child_node.free_node) <= (free_remaining, -free_node):
+                continue
+            free_depth, free_node, free_remaining = child_node.free_depth + 1, child_node.free_node, child_remaining
+        cur_node.height = height
+        cur_node.free_depth = free_depth
+        cur_node.free_node = free_node
 
-        for child_node_id in child_nodes:
-            _, child_node = find_node_in_pool(child_node_id, remaining_nodes)
-            all_nodes.append(child_node)
-            find_subtree_nodes(
-                child_node_id, updated_remaining_nodes, all_nodes)
 
+def find_free_slots(root_node: Node, get_node: Callable[[int], Node], limit: int) -> List[Tuple[int, int]]:
+    '''
+    Find the shallowest free slots of the subtree, as (depth, node identifier)
+    A node has as many slots as its remaining capacity.
+    It goes down only to the subtrees with the shallowest free depths,
+    so it takes O(limit * depth) for a computed subtree.
+    '''
 
-def get_max_index(values: List[int]):
-    return np.argmax(values)
+    slots = []
+    queue = []
+    if root_node.free_depth >= 0:
+        queue.append((root_node.free_depth, 1, root_node.id, 0))
+    while len(queue) > 0 and len(slots) < limit:
+        _, kind, node_id, depth = heapq.heappop(queue)
+        if kind == 0:
+            slots.append((depth, node_id))
+            continue
 
+        cur_node = get_node(node_id)
+        for _ in range(min(cur_node.remaining, limit)):
+            heapq.heappush(queue, (depth, 0, node_id, depth))
+        for child_node in map(get_node, cur_node.child_ids):
+            if child_node.free_depth >= 0:
+                heapq.heappush(queue, (depth + 1 + child_node.free_depth, 1, child_node.id, depth + 1))
+    return slots
 
-def sort_by_key(dict_array: Union[Node, Tree], key_name: str, reverse: bool):
-    dict_array.sort(key=lambda x: getattr(x, key_name), reverse=reverse)
 
+def find_best_combination(heights: List[int], slots: List[List[Tuple[int, int]]]) -> Combination:
+    '''
+    Find how to combine the subtrees into the fewest trees, and then the shallowest
+    heights : the height of each subtree
+    slots   : the free slots of each subtree, as (depth under its root, node identifier)
 
-def get_total_remaining_capacity(nodes: List[Node]) -> bool:
-    remainings = [x.remaining for x in nodes]
-    return np.sum(remainings)
+    A subtree starts a tree only when no free slot is left. Otherwise the shallowest free slot
+    takes one of the subtrees left, since moving a subtree up to a free slot never makes it deeper.
+    The partial combinations are searched best first by a lower bound of their cost,
+    so the first complete one is the best, and the one with the lowest subtree order among ties.
+    The search stops there, without expanding the other partial combinations: when the shallowest slots
+    take the subtrees without making the trees deeper, it expands one partial combination per subtree.
+    Each partial combination is expanded at most once, and the subtrees are at most 4,
+    so it takes at most 1 + 4 + 12 + 24 + 24 = 65 steps of O(k log k).
+    '''
+
+    all_sub_trees = range(len(heights))
+    queue = []
+
+    def push(order: Tuple[int, ...], roots: Tuple[int, ...], attachments: tuple,
+             free_slots: List[Tuple[int, int]], height: int):
+        left = [x for x in all_sub_trees if x not in order]
+        if len(left) == 0:
+            cost, done = (len(roots), height), True
+        elif len(free_slots) == 0:
+            cost, done = (len(roots) + 1, max([height] + [heights[x] for x in left])), False
+        else:
+            # the subtrees left are either attached under a slot at least as deep as
+            # the shallowest one, or start more trees
+            cost, done = (len(roots), max(height, free_slots[0][0] + 1 + max(heights[x] for x in left))), False
+        heapq.heappush(queue, (cost, order, done, roots, attachments, free_slots, height, left))
+
+    push((), (), (), [], 0)
+    while True:
+        _, order, done, roots, attachments, free_slots, height, left = heapq.heappop(queue)
+        if done:
+            return Combination(list(roots), list(attachments), len(roots), height)
+
+        if len(free_slots) == 0:
+            # start a new tree with one of the subtrees left
+            for sub_tree in left:
+                push(order + (sub_tree,), roots + (sub_tree,), attachments,
+                     sorted(slots[sub_tree]), max(height, heights[sub_tree]))
+            continue
+
+        slot_depth, slot_node_id = free_slots[0]
+        for sub_tree in left:
+            next_slots = free_slots[1:]
+            next_slots.extend((slot_depth + 1 + depth, node_id) for depth, node_id in slots[sub_tree])
+            next_slots.sort()
+            push(order + (sub_tree,), roots, attachments + ((sub_tree, slot_node_id, slot_depth + 1),),
+                 next_slots, max(height, slot_depth + 1 + heights[sub_tree]))
 
 
 def update_depth(nodes: List[Node], offset: int):
@@ -75,10 +254,19 @@ def update_depth(nodes: List[Node], offset: int):
         node.depth += offset
 
 
-def get_possible_nodes(nodes: List[Node]) -> List[Node]:
-    return [x for x in nodes if x.remaining > 0]
+def get_max_depth(nodes: List[Node]) -> int:
+    return max(x.depth for x in nodes)
+
 
+def dump_json(value) -> bytes:
+    '''
+    Serialize the value to compact JSON, in the same format of the API responses
+    orjson is used if it is installed, then ujson, then the standard library
+    '''
 
-def get_max_depth(nodes: List[Node]) -> int:
-    depths = [x.depth for x in nodes]
-    return np.max(depths)
+    if orjson is not None:
+        return orjson.dumps(value)
+    if ujson is not None:
+        return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,365 @@
+from heapq import heapify, heappop, heappush
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple, Union
+from .helper import find_tree_position, update_subtree
+from .models import Node, Tree
+
+
+class TreeList():
+    '''
+    The trees of the network in the order of their identifiers, with the position of each tree by identifier
+    It supports what the network does with a list of the trees
+
+    items     : the trees and the removed ones, in the order of their identifiers
+    positions : the position in the items of each tree, by identifier
+
+    A removed tree is left in the items as a tombstone, so a removal takes O(1) and moves no other tree.
+    The tombstones are dropped once they are more than the trees, which is O(1) amortized for each removal.
+    Iterating and paging skip the tombstones, and indexing drops them first, so it takes the position among the trees.
+    '''
+
+    def __init__(self, trees: Iterable[Tree] = ()):
+        self.items: List[Tree] = list(trees)
+        self.positions: Dict[int, int] = {x.id: index for index, x in enumerate(self.items)}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __iter__(self) -> Iterator[Tree]:
+        if len(self.items) == len(self.positions):
+            return iter(self.items)
+        return (x for x in self.items if x.id in self.positions)
+
+    def __getitem__(self, index):
+        self.compact()
+        return self.items[index]
+
+    def append(self, tree: Tree):
+        ''' Add a tree with an identifier greater than the ones of the others '''
+
+        self.positions[tree.id] = len(self.items)
+        self.items.append(tree)
+
+    def find(self, tree_id: int) -> Tuple[int, Union[Tree, None]]:
+        ''' The position of the tree in the items, with the tree, -1 and None if it is not in the list '''
+
+        index = self.positions.get(tree_id, -1)
+        if index < 0:
+            return -1, None
+        return index, self.items[index]
+
+    def pop(self, index: int) -> Tree:
+        ''' Remove the tree at the position in the items given by find '''
+
+        tree = self.items[index]
+        del self.positions[tree.id]
+        if len(self.items) > 2 * len(self.positions) + 8:
+            self.compact()
+        return tree
+
+    def compact(self):
+        ''' Drop the tombstones '''
+
+        if len(self.items) == len(self.positions):
+            return
+        self.items = [x for x in self.items if x.id in self.positions]
+        self.positions = {x.id: index for index, x in enumerate(self.items)}
+
+    def page(self, cursor: int = 0, limit: int = 100) -> Tuple[List[Tree], bool]:
+        ''' The trees with identifiers after the cursor, at most the limit of them, and whether there are more '''
+
+        trees = []
+        for index in range(find_tree_position(self.items, cursor), len(self.items)):
+            tree = self.items[index]
+            if tree.id not in self.positions:
+                continue
+            if len(trees) == limit:
+                return trees, True
+            trees.append(tree)
+        return trees, False
+
+
+class CapacityIndex():
+    '''
+    A bucket queue of the nodes keyed by the remaining capacity
+    The join uses it to take the best fitting node without scanning the network
+
+    buckets : a min-heap of node identifiers for each remaining capacity
+    members : the nodes that are currently valid in each bucket, by identifier
+
+    The heap entries are removed lazily, so an identifier in a heap is valid
+    only while it is also in the members of the same bucket.
+    Among the nodes with the same remaining capacity, the lowest identifier wins.
+    '''
+
+    def __init__(self):
+        self.buckets: Dict[int, List[int]] = {}
+        self.members: Dict[int, Dict[int, Node]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self.members.values())
+
+    def rebuild(self, nodes: List[Node]):
+        ''' Build the buckets from scratch for all the nodes '''
+
+        self.members = {}
+        for node in nodes:
+            self.members.setdefault(node.remaining, {})[node.id] = node
+
+        self.buckets = {}
+        for remaining, members in self.members.items():
+            heap = list(members)
+            heapify(heap)
+            self.buckets[remaining] = heap
+
+    def add(self, node: Node):
+        ''' Add a node into the bucket of its remaining capacity '''
+
+        members = self.members.setdefault(node.remaining, {})
+        if node.id in members:
+            return
+        members[node.id] = node
+
+        heap = self.buckets.setdefault(node.remaining, [])
+        heappush(heap, node.id)
+
+        # drop the stale entries when the heap gets too large
+        if len(heap) > 2 * len(members) + 8:
+            heap[:] = list(members)
+            heapify(heap)
+
+    def remove(self, node: Node, remaining: Union[int, None] = None):
+        ''' Remove a node from the bucket of the remaining capacity '''
+
+        if remaining is None:
+            remaining = node.remaining
+
+        members = self.members.get(remaining, None)
+        if members is None:
+            return
+        members.pop(node.id, None)
+        if len(members) == 0:
+            del self.members[remaining]
+            del self.buckets[remaining]
+
+    def update(self, node: Node, old_remaining: int):
+        ''' Move a node from the bucket of the old remaining capacity to the current one '''
+
+        if old_remaining == node.remaining:
+            return
+        self.remove(node, old_remaining)
+        self.add(node)
+
+    def best(self) -> Union[Node, None]:
+        ''' Get the node with the most remaining capacity '''
+
+        if len(self.members) == 0:
+            return None
+
+        remaining = max(self.members)
+        heap = self.buckets[remaining]
+        members = self.members[remaining]
+        while heap[0] not in members:
+            heappop(heap)
+        return members[heap[0]]
+
+
+class TreeIndex():
+    '''
+    An index of the trees keyed by a value of each of them, computed again only for the changed trees
+    The subclasses supply the key of a tree and their query, which refreshes the index first
+
+    entries : the key of each tree that is currently in the index, by tree identifier
+    changed : the trees changed since their keys were computed, whose keys are computed again on the next query
+    active  : whether the changes are kept, only once the index is built
+
+    A network that never queries an index doesn't build it, so the changes aren't kept,
+    and the removed trees are dropped from the changed ones, so there are never more of them than the trees.
+    '''
+
+    def __init__(self):
+        self.entries: Dict[int, tuple] = {}
+        self.changed: Set[int] = set()
+        self.active = False
+
+    def rebuild(self, trees: Iterable[Tree]):
+        ''' Mark all the trees as changed, and keep the changes from now on '''
+
+        self.clear()
+        self.changed = {x.id for x in trees}
+        self.active = True
+
+    def touch(self, tree_id: int):
+        ''' Mark the tree as changed '''
+
+        if self.active:
+            self.changed.add(tree_id)
+
+    def remove(self, tree_id: int):
+        ''' Forget the removed tree '''
+
+        self.changed.discard(tree_id)
+        self.discard(tree_id)
+
+    def refresh(self, find_tree: Callable[[int], Union[Tree, None]],
+                get_node: Union[Callable[[int], Node], None] = None):
+        ''' Compute again the keys of the changed trees '''
+
+        for tree_id in self.changed:
+            tree = find_tree(tree_id)
+            key = self.key(tree, get_node) if tree is not None else None
+            if self.entries.get(tree_id, None) != key:
+                self.discard(tree_id)
+                if key is not None:
+                    self.add(tree_id, key)
+        self.changed.clear()
+
+    def key(self, tree: Tree, get_node: Union[Callable[[int], Node], None]) -> Union[tuple, None]:
+        ''' Get the key of the tree, None to leave it out of the index '''
+
+        raise NotImplementedError
+
+    def clear(self):
+        self.entries = {}
+
+    def add(self, tree_id: int, key: tuple):
+        self.entries[tree_id] = key
+
+    def discard(self, tree_id: int):
+        self.entries.pop(tree_id, None)
+
+
+class HeapIndex(TreeIndex):
+    '''
+    A min-heap of the trees by their keys
+
+    heap : a min-heap of (key, tree identifier)
+
+    The heap entries are removed lazily, so an entry is valid only while its key is also in the entries,
+    and the stale ones are dropped all at once when they outnumber the valid ones.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.heap: List[Tuple[tuple, int]] = []
+
+    def refresh(self, find_tree: Callable[[int], Union[Tree, None]],
+                get_node: Union[Callable[[int], Node], None] = None):
+        super().refresh(find_tree, get_node)
+        if len(self.heap) > 2 * len(self.entries) + 8:
+            self.heap = [(key, tree_id) for tree_id, key in self.entries.items()]
+            heapify(self.heap)
+
+    def top(self) -> Union[int, None]:
+        ''' Get the tree with the smallest key, None if there is none '''
+
+        while len(self.heap) > 0 and self.entries.get(self.heap[0][1], None) != self.heap[0][0]:
+            heappop(self.heap)
+        if len(self.heap) == 0:
+            return None
+        return self.heap[0][1]
+
+    def clear(self):
+        super().clear()
+        self.heap = []
+
+    def add(self, tree_id: int, key: tuple):
+        super().add(tree_id, key)
+        heappush(self.heap, (key, tree_id))
+
+
+class PlacementIndex(HeapIndex):
+    '''
+    A heap of the trees keyed by the node to attach to in each of them, the shallowest one
+    The depth-aware join uses it to take the shallowest node with a remaining capacity in the network
+
+    The key of a tree is (free depth, -remaining capacity, identifier of the free node).
+    The free node of a tree is the one of its root (see update_subtree), so a key takes O(log T) to push,
+    with the free nodes computed again only along the changed paths of the tree.
+    '''
+
+    def key(self, tree: Tree, get_node: Callable[[int], Node]) -> Union[tuple, None]:
+        root_node = get_node(tree.root_id)
+        update_subtree(root_node, get_node)
+        if root_node.free_depth < 0:
+            return None
+        return (root_node.free_depth, -get_node(root_node.free_node).remaining, root_node.free_node)
+
+    def best(self, find_tree: Callable[[int], Union[Tree, None]],
+             get_node: Callable[[int], Node]) -> Union[Node, None]:
+        ''' Get the shallowest node with a remaining capacity, None if there is none '''
+
+        self.refresh(find_tree, get_node)
+        tree_id = self.top()
+        if tree_id is None:
+            return None
+        return get_node(self.entries[tree_id][2])
+
+
+class ForestIndex(HeapIndex):
+    '''
+    A heap of the trees keyed by their size
+    The consolidation uses it to take the smallest tree, to attach it under a free node of another tree
+
+    The key of a tree is (size, -tree identifier),
+    so among the trees with the same size, the newest one wins, which is the cheapest to remove from the network.
+    '''
+
+    def key(self, tree: Tree, get_node: Union[Callable[[int], Node], None]) -> Union[tuple, None]:
+        return (len(tree.node_ids), -tree.id)
+
+    def smallest(self, find_tree: Callable[[int], Union[Tree, None]], exclude: int = 0) -> Union[Tree, None]:
+        ''' Get the smallest tree but the excluded one, None if there is none '''
+
+        self.refresh(find_tree)
+        tree_id = self.top()
+        if tree_id is not None and tree_id == exclude:
+            # the excluded tree is put back once the next one is found,
+            # with its copies, as a stale entry is valid again when the tree gets back to the same size
+            excluded_entry = heappop(self.heap)
+            while len(self.heap) > 0 and self.heap[0] == excluded_entry:
+                heappop(self.heap)
+            tree_id = self.top()
+            heappush(self.heap, excluded_entry)
+        return find_tree(tree_id) if tree_id is not None else None
+
+
+class HeightIndex(TreeIndex):
+    '''
+    The number of the trees of each height, for the gauge of the maximum height
+
+    counts : the number of the trees of each height
+
+    The key of a tree is its height, computed again only along the changed paths of the tree,
+    so reading the maximum height doesn't go through all the trees.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.counts: Dict[int, int] = {}
+
+    def key(self, tree: Tree, get_node: Callable[[int], Node]) -> Union[tuple, None]:
+        root_node = get_node(tree.root_id)
+        update_subtree(root_node, get_node)
+        return (root_node.height,)
+
+    def maximum(self, find_tree: Callable[[int], Union[Tree, None]], get_node: Callable[[int], Node]) -> int:
+        ''' Get the maximum height of the trees, 0 if there is none '''
+
+        self.refresh(find_tree, get_node)
+        return max(self.counts, default=0)
+
+    def clear(self):
+        super().clear()
+        self.counts = {}
+
+    def add(self, tree_id: int, key: tuple):
+        super().add(tree_id, key)
+        self.counts[key[0]] = self.counts.get(key[0], 0) + 1
+
+    def discard(self, tree_id: int):
+        key = self.entries.pop(tree_id, None)
+        if key is None:
+            return
+        self.counts[key[0]] -= 1
+        if self.counts[key[0]] == 0:
+            del self.counts[key[0]]
@@ -0,0 +1,153 @@
+'''
+Instrumentation of the network: latency histograms, counters and gauges, in the Prometheus text format
+
+One of every sample_every joins, leaves and infos is timed, along with its steps (divide, search, combine),
+and the counters count every operation. A network without metrics, the default, only checks that they are None.
+'''
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict, List
+
+# upper bounds of the buckets, in seconds for the latencies
+LATENCY_BUCKETS = [0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SUBTREE_BUCKETS = [1, 2, 3, 4, 6, 8, 16]
+NODE_BUCKETS = [1, 10, 100, 1000, 10000, 100000, 1000000]
+
+OPERATIONS = ["join", "leave", "info", "divide", "search", "combine"]
+COUNTERS = {
+    "failed_leaves": "Leaves of nodes not in the network",
+    "trees_created": "Trees created, by joins and by recombinations",
+    "trees_removed": "Trees removed, when their last node left or they were consolidated",
+    "trees_consolidated": "Trees attached under a node of another tree by the consolidation",
+    "subtrees_merged": "Subtrees attached under another subtree by a recombination",
+    "nodes_reparented": "Subtree roots moved under another parent or made roots by a recombination"
+}
+
+
+class Histogram():
+    '''
+    A histogram with fixed buckets
+
+    bounds : the upper bounds of the buckets, the last bucket has no bound
+    counts : the number of the values in each bucket, not cumulative
+    '''
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        ''' The lines of the histogram, with cumulative buckets '''
+
+        separator = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + [float("inf")], self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{le}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.9g}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class Metrics():
+    '''
+    The metrics of a network, only updated by its writer
+
+    sample_every : one of this many operations is timed
+    sampled      : whether the current operation is timed, so are its steps
+    operations   : the number of each operation and step
+    latencies    : the sampled latencies of each operation and step
+    counters     : the counters of the changes of the topology
+    subtrees     : the number of the subtrees of each recombination
+    moved_nodes  : the number of the nodes moved to another tree by each recombination
+    '''
+
+    def __init__(self, sample_every: int = 1):
+        self.sample_every = max(sample_every, 1)
+        self.ticks = 0
+        self.sampled = False
+        self.operations: Dict[str, int] = dict.fromkeys(OPERATIONS, 0)
+        self.latencies: Dict[str, Histogram] = {x: Histogram(LATENCY_BUCKETS) for x in OPERATIONS}
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.subtrees = Histogram(SUBTREE_BUCKETS)
+        self.moved_nodes = Histogram(NODE_BUCKETS)
+
+    def begin(self) -> float:
+        ''' Start an operation, returns its start time if it is timed, otherwise 0 '''
+
+        self.ticks += 1
+        self.sampled = self.ticks % self.sample_every == 0
+        return perf_counter() if self.sampled else 0.0
+
+    def step(self) -> float:
+        ''' Start a step of the current operation, returns its start time if it is timed, otherwise 0 '''
+
+        return perf_counter() if self.sampled else 0.0
+
+    def end(self, operation: str, started_at: float):
+        ''' Count the operation or step, and record its latency if it was timed '''
+
+        self.operations[operation] += 1
+        if started_at > 0:
+            self.latencies[operation].observe(perf_counter() - started_at)
+
+    def count(self, counter: str, value: int = 1):
+        self.counters[counter] += value
+
+    def observe_recombination(self, subtrees: int, nodes: int):
+        self.subtrees.observe(subtrees)
+        self.moved_nodes.observe(nodes)
+
+    def render(self, network) -> str:
+        ''' The metrics with the gauges of the network, in the Prometheus text format '''
+
+        lines = ["# HELP p2p_operations_total Operations and their steps",
+                 "# TYPE p2p_operations_total counter"]
+        lines.extend(f'p2p_operations_total{{operation="{key}"}} {value}' for key, value in self.operations.items())
+
+        lines.extend([f"# HELP p2p_operation_seconds Latencies of one of every {self.sample_every} operations",
+                      "# TYPE p2p_operation_seconds histogram"])
+        for operation, histogram in self.latencies.items():
+            lines.extend(histogram.render("p2p_operation_seconds", f'operation="{operation}"'))
+
+        for counter, description in COUNTERS.items():
+            lines.extend([f"# HELP p2p_{counter}_total {description}", f"# TYPE p2p_{counter}_total counter",
+                          f"p2p_{counter}_total {self.counters[counter]}"])
+
+        lines.extend(["# HELP p2p_recombination_subtrees Subtrees of each recombination",
+                      "# TYPE p2p_recombination_subtrees histogram"])
+        lines.extend(self.subtrees.render("p2p_recombination_subtrees"))
+        lines.extend(["# HELP p2p_recombination_nodes Nodes moved to another tree by each recombination",
+                      "# TYPE p2p_recombination_nodes histogram"])
+        lines.extend(self.moved_nodes.render("p2p_recombination_nodes"))
+
+        lines.extend(render_gauges(network))
+        return "\n".join(lines) + "\n"
+
+
+def render_gauges(network) -> List[str]:
+    '''
+    The gauges of the size of the network, which are read when the metrics are scraped
+    The maximum height counts again only the trees changed since the last scrape (see HeightIndex).
+    '''
+
+    gauges = {
+        "nodes": ("Nodes in the network", len(network.nodes)),
+        "trees": ("Trees in the network", len(network.trees)),
+        "max_height": ("Maximum depth of the nodes", network.get_max_height())
+    }
+    lines = []
+    for gauge, (description, value) in gauges.items():
+        lines.extend([f"# HELP p2p_{gauge} {description}", f"# TYPE p2p_{gauge} gauge", f"p2p_{gauge} {value}"])
+    return lines
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Iterable, List, Tuple
 
 
 def get_node_name(node_id: int) -> str:
@@ -16,8 +16,17 @@ class Node:
     capacity  : a maximum number of child nodes, less than 3
     parent_id : an identifier of the parent node
     child_ids : a list of the identifiers of the child nodes
+    depth     : a depth of the node in its tree, as last computed from its ancestors (see P2PNetwork.get_depth)
     tree_id   : an identifier of the tree it belongs to
     remaining : a number of nodes that can be further connected as a child
+    height    : a maximum depth of the nodes under it, -1 until it is computed again
+    free_depth: a depth of the shallowest node under it with a remaining capacity, -1 for none
+    free_node : an identifier of the node to attach to under it, 0 for none, the shallowest one
+                with a remaining capacity, then with the most remaining capacity, then with the lowest identifier
+
+    The depth, height, free_depth and free_node are computed lazily, so moving a subtree doesn't visit its nodes.
+    The depth is computed again when it is read from the network, and so are the ones of the ancestors,
+    while the height, free_depth and free_node are computed again for the node and its changed descendants.
     '''
 
     id: int
@@ -27,11 +36,44 @@ class Node:
     depth: int
     tree_id: int
     remaining: int
+    height: int = -1
+    free_depth: int = -1
+    free_node: int = 0
 
     def __str__(self):
         return f"{get_node_name(self.id)} (capacity:{self.capacity})"
 
 
+class NodeIds(dict):
+    '''
+    The identifiers of the nodes of a tree, an ordered set with the methods of a list
+    Appending, removing and checking an identifier take O(1), and it equals the list of the same identifiers
+    '''
+
+    def __init__(self, node_ids: Iterable[int] = ()):
+        super().__init__(dict.fromkeys(node_ids))
+
+    def append(self, node_id: int):
+        self[node_id] = None
+
+    def extend(self, node_ids: Iterable[int]):
+        self.update(dict.fromkeys(node_ids))
+
+    def remove(self, node_id: int):
+        del self[node_id]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and list(self) == list(other)
+        return super().__eq__(other)
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
 @dataclass
 class Tree:
     '''
@@ -39,10 +81,42 @@ class Tree:
     The whold network has several trees, each of which has several nodes
 
     id         : an identifier of the trees
-    node_ids   : identifiers of the nodes the tree has
+    node_ids   : identifiers of the nodes the tree has, a list is taken as the NodeIds of it
     root_id    : an identifier of the root node of the tree
+    remaining  : a total remaining capacity of the nodes of the tree
+    attachable : a number of the nodes of the tree with a remaining capacity
+    capacities : a number of the nodes of the tree with each capacity, from 0 to 3
+
+    The remaining, attachable and capacities are kept up to date by the network on every change of a node,
+    and the height and the depth of the shallowest attachable node are the ones of the root.
     '''
 
     id: int
-    node_ids: List[int]
+    node_ids: NodeIds
     root_id: int
+    remaining: int = 0
+    attachable: int = 0
+    capacities: List[int] = field(default_factory=lambda: [0, 0, 0, 0])
+
+    def __post_init__(self):
+        if not isinstance(self.node_ids, NodeIds):
+            self.node_ids = NodeIds(self.node_ids)
+
+
+@dataclass
+class Combination:
+    '''
+    A class describing how to combine the subtrees left by a node
+
+    roots           : indexes of the subtrees whose roots become the roots of the trees,
+                      the first one keeps the current tree
+    attachments     : (index of a subtree, identifier of its new parent, depth of its root)
+                      for each attached subtree, in the order they are attached
+    number_of_trees : a number of the resulting trees
+    height          : a maximum depth of the resulting trees
+    '''
+
+    roots: List[int]
+    attachments: List[Tuple[int, int, int]]
+    number_of_trees: int
+    height: int
@@ -0,0 +1,151 @@
+'''
+Monte-Carlo runner, which runs many independent seeded simulations over the CPU cores
+
+Each run applies a workload (see network.workloads) to a new network with its own seed,
+the base seed plus the index of the run, and reports the final topology.
+The runs are spread over a pool of processes and their statistics are streamed back as they finish,
+then aggregated in the order of the seeds, so the same seeds give the same aggregates
+with any number of workers.
+
+    $ python -m network.montecarlo --runs 1000 --size 1000 --operations 5000 --mix 45,40,10,5
+'''
+import argparse
+import json
+import multiprocessing
+import os
+from collections import Counter
+from time import perf_counter
+from typing import Callable, List, Tuple, Union
+from .simulate import Simulation
+from .workloads import WORKLOADS
+
+# the statistics of each run that are aggregated into percentiles and histograms
+METRICS = ["trees", "max_height", "largest_tree", "nodes"]
+PERCENTILES = [50, 90, 99]
+
+Task = Tuple[str, int, int, Union[str, List[float]], int]
+
+
+def run_simulation(task: Task) -> dict:
+    ''' Run a workload with a seed, returns the statistics of the final network '''
+
+    workload, size, operations, mix, seed = task
+    simulation = Simulation()
+    for _, operation in WORKLOADS[workload](size, operations, seed, mix):
+        simulation.apply(operation)
+
+    network = simulation.network
+    tree_heights = Counter(network.get_height(x) for x in network.trees)
+    return {
+        "seed": seed,
+        "trees": len(network.trees),
+        "max_height": max(tree_heights, default=0),
+        "largest_tree": max([len(x.node_ids) for x in network.trees] + [0]),
+        "nodes": len(network.nodes),
+        "failed_leaves": simulation.failed_leaves,
+        "tree_heights": dict(tree_heights)
+    }
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    ''' The nearest-rank percentile of the sorted values '''
+
+    if len(values) == 0:
+        return 0
+    rank = max(0, min(len(values) - 1, -(-len(values) * percentile // 100) - 1))
+    return values[int(rank)]
+
+
+def aggregate(results: List[dict]) -> dict:
+    '''
+    Aggregate the statistics of the runs into percentiles and histograms
+    The runs are taken in the order of their seeds, whatever order they finished in
+    '''
+
+    results = sorted(results, key=lambda x: x["seed"])
+    metrics = {}
+    histograms = {}
+    for metric in METRICS:
+        values = sorted(x[metric] for x in results)
+        metrics[metric] = {"min": values[0] if values else 0, "max": values[-1] if values else 0,
+                           "mean": sum(values) / max(len(values), 1)}
+        metrics[metric].update({f"p{x}": get_percentile(values, x) for x in PERCENTILES})
+        histograms[metric] = dict(sorted(Counter(values).items()))
+
+    # the heights of all the trees of all the runs
+    tree_heights: Counter = Counter()
+    for result in results:
+        tree_heights.update({int(height): count for height, count in result["tree_heights"].items()})
+    histograms["tree_heights"] = dict(sorted(tree_heights.items()))
+
+    return {"runs": len(results), "metrics": metrics, "histograms": histograms}
+
+
+def run_monte_carlo(workload: str, size: int, operations: int, mix: Union[str, List[float]],
+                    runs: int, seed: int = 0, workers: Union[int, None] = None,
+                    callback: Union[Callable[[dict], None], None] = None) -> dict:
+    '''
+    Run the simulations with the seeds from seed to seed + runs - 1, returns the aggregates
+    The callback is called with the statistics of each run as soon as it finishes
+    '''
+
+    tasks: List[Task] = [(workload, size, operations, mix, seed + x) for x in range(runs)]
+    workers = workers or os.cpu_count() or 1
+
+    results = []
+    if workers == 1:
+        for task in tasks:
+            results.append(run_simulation(task))
+            if callback is not None:
+                callback(results[-1])
+    else:
+        # a few tasks per message, so the workers are kept busy with little overhead
+        chunk_size = max(1, min(16, runs // (workers * 8)))
+        with multiprocessing.Pool(workers) as pool:
+            for result in pool.imap_unordered(run_simulation, tasks, chunk_size):
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+
+    return aggregate(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run seeded simulations in parallel and aggregate them")
+    parser.add_argument("--workload", choices=list(WORKLOADS), default="steady")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--size", type=int, default=1000, help="nodes before the churn")
+    parser.add_argument("--operations", type=int, default=1000, help="operations of the churn")
+    parser.add_argument("--mix", default="uniform",
+                        help="a capacity mix (uniform, skewed) or the weights of the capacities 0 to 3, e.g. 45,40,10,5")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the first run")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes, the CPU count by default")
+    parser.add_argument("--output", default=None, help="write the aggregates to a JSON file")
+    parser.add_argument("--progress", action="store_true", help="print the statistics of each run")
+    args = parser.parse_args()
+
+    mix: Union[str, List[float]] = args.mix
+    if "," in args.mix:
+        mix = [float(x) for x in args.mix.split(",")]
+
+    def print_run(result: dict):
+        if args.progress:
+            print(json.dumps(result), flush=True)
+
+    started_at = perf_counter()
+    aggregates = run_monte_carlo(args.workload, args.size, args.operations, mix,
+                                 args.runs, args.seed, args.workers, print_run)
+    aggregates["seconds"] = round(perf_counter() - started_at, 3)
+    aggregates["parameters"] = {"workload": args.workload, "size": args.size, "operations": args.operations,
+                                "mix": mix, "seed": args.seed, "runs": args.runs}
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(aggregates, f, indent=2)
+    for metric, values in aggregates["metrics"].items():
+        print(f"{metric:12}: " + ", ".join(f"{key} {value:g}" for key, value in values.items()))
+    print(f"{aggregates['runs']} runs in {aggregates['seconds']} s")
+
+
+if __name__ == "__main__":
+    main()
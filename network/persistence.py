@@ -0,0 +1,346 @@
+import io
+import logging
+import os
+import struct
+from array import array
+from typing import BinaryIO, Iterator, List, Tuple, Union
+from .crud import P2PNetwork
+from .models import Node, Tree
+
+logger = logging.getLogger(__name__)
+
+# a record of the log is an operation code and its value (capacity or identifier)
+# a join with a placement of its own has the code of the placement, the others use the one of the network
+# a tick of the rebalancer is two records, the tree and the number of the moves
+RECORD = struct.Struct("<Bi")
+JOIN_CODE = 1
+LEAVE_CODE = 2
+PLACEMENT_CODES = {"best-fit": 3, "shallowest": 4}
+PLACEMENT_NAMES = {code: name for name, code in PLACEMENT_CODES.items()}
+REBALANCE_CODE = 5
+MOVES_CODE = 6
+
+# a snapshot starts with its format, generation, the maximum identifiers and the sizes
+SNAPSHOT_MAGIC = b"P2PS"
+SNAPSHOT_HEADER = struct.Struct("<4sIqqqqq")
+SNAPSHOT_VERSION = 3
+SECTION_SIZE = struct.Struct("<q")
+
+
+def encode_operation(operation: dict) -> bytes:
+    ''' Encode an operation in the format of the test cases to a log record '''
+
+    if "join" in operation:
+        code = PLACEMENT_CODES[operation["join"]["placement"]] if "placement" in operation["join"] else JOIN_CODE
+        return RECORD.pack(code, operation["join"].get("capacity", 0))
+    if "rebalance" in operation:
+        return RECORD.pack(REBALANCE_CODE, operation["rebalance"]["tree"]) + \
+            RECORD.pack(MOVES_CODE, operation["rebalance"]["moves"])
+    return RECORD.pack(LEAVE_CODE, operation["leave"].get("id", 0))
+
+
+def decode_operations(data: bytes) -> Iterator[dict]:
+    '''
+    Decode the log records, ignoring an incomplete record at the end
+    A tick whose moves are missing is ignored too, as the second record of an operation is never written alone.
+    '''
+
+    end = len(data) - len(data) % RECORD.size
+    tree_id = None
+    for code, value in RECORD.iter_unpack(memoryview(data)[:end]):
+        if code == MOVES_CODE:
+            if tree_id is not None:
+                yield {"rebalance": {"tree": tree_id, "moves": value}}
+        elif code == JOIN_CODE:
+            yield {"join": {"capacity": value}}
+        elif code == LEAVE_CODE:
+            yield {"leave": {"id": value}}
+        elif code != REBALANCE_CODE:
+            yield {"join": {"capacity": value, "placement": PLACEMENT_NAMES[code]}}
+        tree_id = value if code == REBALANCE_CODE else None
+
+
+def read_log(path: str) -> Iterator[dict]:
+    ''' Read the operations of a log file '''
+
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        data = b""
+        while True:
+            chunk = f.read(RECORD.size * 65536)
+            if len(chunk) == 0:
+                yield from decode_operations(data)
+                return
+
+            # the first record of a tick waits for the second one, in the next chunk
+            data += chunk
+            end = len(data) - len(data) % RECORD.size
+            if end > 0 and data[end - RECORD.size] == REBALANCE_CODE:
+                end -= RECORD.size
+            yield from decode_operations(data[:end])
+            data = data[end:]
+
+
+def get_log_size(operations: Iterator[dict]) -> int:
+    ''' The size of the complete records of the operations of a log '''
+
+    return sum(RECORD.size * (2 if "rebalance" in x else 1) for x in operations)
+
+
+def replay(network: P2PNetwork, operations: Iterator[dict]) -> Tuple[int, int]:
+    '''
+    Apply the operations one by one, as the writer applied them
+    An unknown node or tree only fails the result of its operation, as it did when it was logged.
+    An operation raising an error is logged and counted, and the replay goes on with the next one.
+    Returns the number of the operations and the number of the failed ones.
+    '''
+
+    count = 0
+    failures = 0
+    for operation in operations:
+        try:
+            network.apply([operation])
+        except Exception:
+            logger.exception("Operation %d of the log failed: %r", count, operation)
+            failures += 1
+        count += 1
+    return count, failures
+
+
+def write_section(f: BinaryIO, values: array):
+    f.write(SECTION_SIZE.pack(len(values) * values.itemsize))
+    values.tofile(f)
+
+
+def read_section(f: BinaryIO) -> array:
+    size, = SECTION_SIZE.unpack(f.read(SECTION_SIZE.size))
+    values = array("i")
+    values.frombytes(f.read(size))
+    return values
+
+
+def encode_snapshot(network: P2PNetwork, generation: int) -> bytes:
+    ''' Encode the whole state of the network in the compact binary format of the snapshots '''
+
+    node_columns = array("i")
+    child_counts = array("i")
+    child_ids = array("i")
+    for node in network.nodes:
+        node_columns.extend((node.id, node.capacity, node.parent_id, node.height,
+                             node.tree_id, node.remaining, node.free_depth, node.free_node))
+        child_counts.append(len(node.child_ids))
+        child_ids.extend(node.child_ids)
+
+    tree_columns = array("i")
+    tree_node_ids = array("i")
+    for tree in network.trees:
+        tree_columns.extend((tree.id, tree.root_id, len(tree.node_ids)))
+        tree_node_ids.extend(tree.node_ids)
+
+    f = io.BytesIO()
+    f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, generation,
+                                 network.max_node_id, network.max_tree_id,
+                                 len(network.nodes), len(network.trees)))
+    for section in [node_columns, child_counts, child_ids, tree_columns, tree_node_ids]:
+        write_section(f, section)
+    return f.getvalue()
+
+
+def write_snapshot(network: P2PNetwork, path: str, generation: int):
+    '''
+    Write the whole state of the network into a compact binary file
+    The file is replaced atomically, so a crash leaves either the old or the new snapshot
+    '''
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(encode_snapshot(network, generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    sync_directory(os.path.dirname(path))
+
+
+def read_snapshot(path: str, network: Union[P2PNetwork, None] = None) -> Tuple[P2PNetwork, int]:
+    '''
+    Read a network from a snapshot file, returns it with the generation of the snapshot
+    The state is loaded into the given network if any, keeping its storage
+    '''
+
+    with open(path, "rb") as f:
+        try:
+            return decode_snapshot(f.read(), network)
+        except ValueError:
+            raise ValueError(f"Unknown snapshot format: {path}")
+
+
+def read_snapshot_size(path: str) -> Tuple[int, int]:
+    ''' Read the number of the nodes and of the trees of a snapshot file, without loading the network '''
+
+    with open(path, "rb") as f:
+        magic, version, _, _, _, nodes, trees = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+    if magic != SNAPSHOT_MAGIC or version not in [1, 2, SNAPSHOT_VERSION]:
+        raise ValueError(f"Unknown snapshot format: {path}")
+    return nodes, trees
+
+
+def decode_snapshot(data: bytes, network: Union[P2PNetwork, None] = None) -> Tuple[P2PNetwork, int]:
+    ''' Decode a network from a snapshot, returns it with the generation of the snapshot '''
+
+    f = io.BytesIO(data)
+    magic, version, generation, max_node_id, max_tree_id, _, _ = SNAPSHOT_HEADER.unpack(
+        f.read(SNAPSHOT_HEADER.size))
+    if magic != SNAPSHOT_MAGIC or version not in [1, 2, SNAPSHOT_VERSION]:
+        raise ValueError("Unknown snapshot format")
+
+    node_columns = read_section(f).tolist()
+    child_counts = read_section(f).tolist()
+    child_ids = read_section(f).tolist()
+    tree_columns = read_section(f).tolist()
+    tree_node_ids = read_section(f).tolist()
+
+    # the first version has the depths instead of the heights and free depths, and the second has no free nodes,
+    # so they are computed again when they are needed
+    number_of_columns = {1: 6, 2: 7, SNAPSHOT_VERSION: 8}[version]
+    nodes: List[Node] = []
+    child_start = 0
+    for index, child_count in enumerate(child_counts):
+        node_id, capacity, parent_id, height, tree_id, remaining, *free = node_columns[
+            index * number_of_columns:(index + 1) * number_of_columns]
+        # the depths of version 1 are kept, they are computed again when they are read
+        depth = height if version == 1 else -1
+        if version < SNAPSHOT_VERSION:
+            height, free = -1, [-1, 0]
+        nodes.append(Node(node_id, capacity, parent_id, child_ids[child_start:child_start + child_count],
+                          depth, tree_id, remaining, height, *free))
+        child_start += child_count
+
+    trees: List[Tree] = []
+    node_start = 0
+    for index in range(0, len(tree_columns), 3):
+        tree_id, root_id, node_count = tree_columns[index:index + 3]
+        trees.append(Tree(tree_id, tree_node_ids[node_start:node_start + node_count], root_id))
+        node_start += node_count
+
+    if network is None:
+        network = P2PNetwork()
+    network.restore(nodes, trees, max_node_id, max_tree_id)
+    return network, generation
+
+
+def sync_directory(path: str):
+    ''' Make a rename in the directory durable, where the platform supports it '''
+
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class NetworkStore():
+    '''
+    A durable storage of a network in a directory
+    It has the latest snapshot, and the log of the operations applied after it
+
+    directory         : the directory of the files
+    generation        : the generation of the latest snapshot, which names the current log
+    snapshot_interval : the number of the logged operations that triggers a new snapshot
+    sync              : whether a commit waits for the log to be on the disk
+    failed_operations : the number of the operations of the log that raised an error on the last recovery
+
+    The operations are appended to the log before they are applied,
+    and a commit writes all the appended ones at once (group commit).
+    '''
+
+    def __init__(self, directory: str, snapshot_interval: int = 100000, sync: bool = True):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.sync = sync
+        self.generation = 0
+        self.logged_operations = 0
+        self.failed_operations = 0
+        self.log_file: Union[BinaryIO, None] = None
+        self.buffer = bytearray()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, "snapshot.bin")
+
+    def get_log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"operations.{generation}.log")
+
+    def recover(self, network: Union[P2PNetwork, None] = None) -> P2PNetwork:
+        '''
+        Load the latest snapshot and replay the log written after it
+        The state is loaded into the given empty network if any
+        '''
+
+        if network is None:
+            network = P2PNetwork()
+
+        if os.path.exists(self.snapshot_path):
+            network, self.generation = read_snapshot(self.snapshot_path, network)
+        else:
+            self.generation = 0
+
+        log_path = self.get_log_path(self.generation)
+        self.logged_operations, self.failed_operations = replay(network, read_log(log_path))
+
+        # drop an incomplete record at the end, then keep appending to the log
+        if os.path.exists(log_path):
+            with open(log_path, "r+b") as f:
+                f.truncate(get_log_size(read_log(log_path)))
+        self.log_file = open(log_path, "ab")
+        return network
+
+    def append(self, operation: dict):
+        ''' Append an operation to the log, it is written on the next commit '''
+
+        self.buffer += encode_operation(operation)
+        self.logged_operations += 1
+
+    def commit(self):
+        ''' Write the appended operations to the log '''
+
+        if len(self.buffer) == 0:
+            return
+        self.log_file.write(self.buffer)
+        self.log_file.flush()
+        if self.sync:
+            os.fsync(self.log_file.fileno())
+        self.buffer = bytearray()
+
+    def should_snapshot(self) -> bool:
+        return self.logged_operations >= self.snapshot_interval
+
+    def snapshot(self, network: P2PNetwork):
+        '''
+        Write a snapshot of the network and start a new log
+        The new snapshot is in place before anything is appended to the new log,
+        so a crash at any point recovers either the old snapshot with the old log,
+        or the new snapshot with the new log.
+        '''
+
+        self.commit()
+        write_snapshot(network, self.snapshot_path, self.generation + 1)
+
+        old_log_path = self.get_log_path(self.generation)
+        self.log_file.close()
+        self.generation += 1
+        self.log_file = open(self.get_log_path(self.generation), "ab")
+        self.logged_operations = 0
+        os.remove(old_log_path)
+
+    def close(self):
+        self.commit()
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
@@ -0,0 +1,238 @@
+'''
+Rebalancing of the trees toward their minimum height, in the background
+
+After a long churn a tree can be much deeper than the capacities of its nodes need, as a leave only repairs
+the tree of the node and a join never moves the others. The rebalancer finds such trees and reshapes them a few moves
+at a time, each batch a tick that the writer applies between the joins and leaves, so the API never waits for long.
+
+lift : the deepest leaf moves under the shallowest node with a remaining capacity, if that is higher up
+swap : a shallow leaf with no capacity swaps places with a deeper node with a capacity, on the path of the deepest leaf
+
+Both moves lower the sum of the depths of the nodes, so a tree settles after a finite number of moves.
+A tick is an operation of the network, e.g. {"rebalance": {"tree": 1, "moves": 64}}, which is logged as the joins
+and leaves are, and makes the same moves when it is replayed.
+'''
+import asyncio
+from collections import deque
+from time import thread_time
+from typing import Callable, Dict, List, Tuple, Union
+from .helper import update_subtree
+from .models import Node, Tree
+
+# the nodes visited to find a shallow leaf, for each move of a tick
+VISITS_PER_MOVE = 256
+
+
+def get_minimum_height(capacities: List[int]) -> int:
+    '''
+    Get the height of the shallowest tree of the nodes, given the number of the nodes with each capacity
+    The nodes with the most capacity go first, so each level has the most slots for the next one.
+    '''
+
+    counts = list(capacities)
+    remaining_nodes = sum(counts)
+    if remaining_nodes == 0:
+        return 0
+
+    def take(number_of_nodes: int) -> int:
+        ''' Take the nodes with the most capacity, returns their total capacity '''
+
+        total_capacity = 0
+        for capacity in range(len(counts) - 1, -1, -1):
+            taken = min(number_of_nodes, counts[capacity])
+            counts[capacity] -= taken
+            number_of_nodes -= taken
+            total_capacity += taken * capacity
+        return total_capacity
+
+    height = 0
+    slots = take(1)
+    remaining_nodes -= 1
+    while remaining_nodes > 0 and slots > 0:
+        level = min(slots, remaining_nodes)
+        slots = take(level)
+        remaining_nodes -= level
+        height += 1
+    return height
+
+
+def find_deepest_path(root_node: Node, get_node: Callable[[int], Node]) -> List[Node]:
+    ''' Find the path from the root down to a deepest leaf of the computed subtree, the root first '''
+
+    path = [root_node]
+    while len(path[-1].child_ids) > 0:
+        path.append(max(map(get_node, path[-1].child_ids), key=lambda x: x.height))
+    return path
+
+
+def find_shallow_leaf(root_node: Node, get_node: Callable[[int], Node], max_depth: int,
+                      visits: int) -> Tuple[Union[Node, None], int, int]:
+    '''
+    Find the shallowest leaf with no capacity under the root, down to the maximum depth
+    Returns the leaf or None, its depth, and the number of the visited nodes, which is at most the visits
+    '''
+
+    queue = deque([(root_node, 0)])
+    visited = 0
+    while len(queue) > 0 and visited < visits:
+        cur_node, depth = queue.popleft()
+        visited += 1
+        if depth > max_depth:
+            break
+        if depth > 0 and cur_node.capacity == 0:
+            return cur_node, depth, visited
+        queue.extend((x, depth + 1) for x in map(get_node, cur_node.child_ids))
+    return None, -1, visited
+
+
+def rebalance_tree(network, tree: Tree, moves: int) -> dict:
+    '''
+    Make at most the number of moves in the tree to lower its height, lifts first
+    Returns the number of the moves of each kind, the size of the tree, its height before and after,
+    and the CPU time taken
+    '''
+
+    started_at = thread_time()
+    get_node = network.get_node
+    root_node = get_node(tree.root_id)
+    update_subtree(root_node, get_node)
+    height = root_node.height
+
+    lifts, swaps = 0, 0
+    visits = moves * VISITS_PER_MOVE
+    while lifts + swaps < moves:
+        update_subtree(root_node, get_node)
+        path = find_deepest_path(root_node, get_node)
+        if 0 <= root_node.free_depth < len(path) - 2:
+            network.move_node(path[-1], get_node(root_node.free_node))
+            lifts += 1
+            continue
+
+        # the deeper node has a subtree, so the sum of the depths goes down
+        shallow_node, shallow_depth, visited = find_shallow_leaf(root_node, get_node, len(path) - 4, visits)
+        visits -= visited
+        if shallow_node is None:
+            break
+        deep_node = next((x for x in path[shallow_depth + 2:-1] if x.capacity > 0), None)
+        if deep_node is None:
+            break
+        network.swap_nodes(shallow_node, deep_node)
+        swaps += 1
+
+    update_subtree(root_node, get_node)
+    return {
+        "moves": lifts + swaps,
+        "lifts": lifts,
+        "swaps": swaps,
+        "size": len(tree.node_ids),
+        "height": height,
+        "new_height": root_node.height,
+        "cpu_seconds": thread_time() - started_at
+    }
+
+
+class Rebalancer():
+    '''
+    The background task choosing the trees to rebalance and sending their ticks to the writer
+
+    moves   : the maximum number of the moves of a tick
+    slack   : a tree is rebalanced when its height is at least this much above its minimum height
+    scan    : the number of the trees checked for a tick, from the one after the last checked
+    tree_id : the tree being rebalanced, 0 for none
+    cursor  : the identifier of the last checked tree
+    settled : the trees left with no move to make, with their size and height then, skipped until they change
+
+    The totals of the ticks are kept for the metrics, with the height reduction and the CPU time of the moves.
+    '''
+
+    def __init__(self, moves: int = 64, slack: int = 2, scan: int = 256):
+        self.moves = moves
+        self.slack = slack
+        self.scan = scan
+        self.tree_id = 0
+        self.cursor = 0
+        self.settled: Dict[int, Tuple[int, int]] = {}
+        self.ticks = 0
+        self.total_moves = 0
+        self.height_reduction = 0
+        self.cpu_seconds = 0.0
+
+    def is_unbalanced(self, network, tree: Tree) -> bool:
+        root_node = network.get_node(tree.root_id)
+        update_subtree(root_node, network.get_node)
+        if tree.id in self.settled:
+            if self.settled[tree.id] == (len(tree.node_ids), root_node.height):
+                return False
+            del self.settled[tree.id]
+        return root_node.height - get_minimum_height(tree.capacities) >= self.slack
+
+    def find_tree(self, network) -> int:
+        ''' Find the tree of the next tick, 0 for none, in the writer as a query of the network '''
+
+        _, tree = network.find_tree(self.tree_id)
+        if tree is not None and self.is_unbalanced(network, tree):
+            return tree.id
+
+        self.tree_id = 0
+        for _ in range(min(self.scan, len(network.trees))):
+            trees, _ = network.trees.page(self.cursor, 1)
+            if len(trees) == 0:
+                # once a round, the removed trees are forgotten
+                trees, _ = network.trees.page(0, 1)
+                self.settled = {x: y for x, y in self.settled.items() if network.find_tree(x)[1] is not None}
+
+            tree = trees[0]
+            self.cursor = tree.id
+            if self.is_unbalanced(network, tree):
+                self.tree_id = tree.id
+                return tree.id
+        return 0
+
+    def record(self, result: dict):
+        ''' Add the result of a tick to the totals, and settle the tree if it has no more moves to make '''
+
+        if not result["success"]:
+            self.tree_id = 0
+            return
+
+        self.ticks += 1
+        self.total_moves += result["moves"]
+        self.height_reduction += result["height"] - result["new_height"]
+        self.cpu_seconds += result["cpu_seconds"]
+        if result["moves"] < self.moves:
+            self.settled[result["tree"]] = (result["size"], result["new_height"])
+            self.tree_id = 0
+
+    async def run(self, engine, interval: float):
+        ''' Send a tick to the writer every interval, forever '''
+
+        while True:
+            tree_id = await engine.query(self.find_tree)
+            if tree_id != 0:
+                results = await engine.execute([{"rebalance": {"tree": tree_id, "moves": self.moves}}])
+                self.record(results[0])
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "tree": self.tree_id,
+            "ticks": self.ticks,
+            "moves": self.total_moves,
+            "height_reduction": self.height_reduction,
+            "cpu_seconds": self.cpu_seconds,
+            "height_reduction_per_cpu_second": self.height_reduction / self.cpu_seconds if self.cpu_seconds > 0 else 0.0
+        }
+
+    def render(self) -> List[str]:
+        ''' The totals of the ticks in the Prometheus text format '''
+
+        lines = []
+        for name, value, description in [
+                ("ticks", self.ticks, "Ticks of the rebalancer"),
+                ("moves", self.total_moves, "Lifts and swaps of the rebalancer"),
+                ("height_reduction", self.height_reduction, "Levels removed from the trees by the rebalancer"),
+                ("cpu_seconds", self.cpu_seconds, "CPU time of the moves of the rebalancer")]:
+            lines.extend([f"# HELP p2p_rebalance_{name}_total {description}",
+                          f"# TYPE p2p_rebalance_{name}_total counter",
+                          f"p2p_rebalance_{name}_total {value:.9g}"])
+        return lines
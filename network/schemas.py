@@ -1,9 +1,31 @@
-from pydantic import BaseModel, Field
+from typing import List, Literal, Union
+from pydantic import BaseModel, Field, root_validator
 
 
 class JoinInfo(BaseModel):
     capacity: int = Field(default=0, title="Capacity of the node", le=3, ge=0)
+    placement: Union[Literal["best-fit", "shallowest"], None] = Field(
+        default=None, title="Policy to choose the parent, the one of the network if it is not given")
 
 
 class LeaveInfo(BaseModel):
     id: int = Field(title="Identifier of the node to remove", gt=0)
+
+
+class OperationInfo(BaseModel):
+    join: Union[JoinInfo, None] = Field(default=None, title="Node to add")
+    leave: Union[LeaveInfo, None] = Field(default=None, title="Node to remove")
+
+    @root_validator(skip_on_failure=True)
+    def check_single_action(cls, values):
+        if (values.get("join") is None) == (values.get("leave") is None):
+            raise ValueError("Either of join or leave is required")
+        return values
+
+
+class BatchInfo(BaseModel):
+    operations: List[OperationInfo] = Field(title="Operations to apply in order")
+
+
+class NetworkInfo(BaseModel):
+    id: str = Field(title="Identifier of the network", regex=r"^[A-Za-z0-9_.-]{1,64}$")
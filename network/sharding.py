@@ -0,0 +1,193 @@
+'''
+Networks sharded across worker processes, so the joins and leaves of different networks run on different cores
+
+Each shard is a process with its own registry of networks (see network.tenancy), and a network lives in the shard
+given by a consistent hash of its identifier, so adding a shard moves only about 1 / shards of the networks.
+The calls are sent to the shards through pipes, and the listing and the statistics of the networks are gathered
+from all the shards.
+'''
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from bisect import bisect_right
+from concurrent.futures import Future
+from itertools import count
+from threading import Lock, Thread
+from typing import Any, Dict, List, Tuple, Union
+from .tenancy import NetworkRegistry
+
+# the calls answered by every shard, the others go to the shard of the network in their first argument
+GATHERED_METHODS = ["list", "stats", "evict_idle"]
+
+
+def get_hash(key: str) -> int:
+    ''' A hash of the key, the same in every process unlike the built-in hash '''
+
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing():
+    '''
+    A consistent hash ring of the shards
+
+    points : the hashes of the virtual points of the shards, sorted
+    shards : the shard of each point
+    '''
+
+    def __init__(self, number_of_shards: int, replicas: int = 64):
+        points = sorted((get_hash(f"shard-{shard}-{replica}"), shard)
+                        for shard in range(number_of_shards) for replica in range(replicas))
+        self.points = [x[0] for x in points]
+        self.shards = [x[1] for x in points]
+
+    def get_shard(self, key: str) -> int:
+        ''' The shard of the first point after the hash of the key, going around the ring '''
+
+        index = bisect_right(self.points, get_hash(key))
+        return self.shards[index % len(self.shards)]
+
+
+def serve_shard(connection, memory_budget: int, directory: str, storage: str, placement: str = "best-fit",
+                consolidation: int = 0, idle_seconds: float = 0):
+    ''' Run the calls of a shard in order until it is stopped, then persist its loaded networks '''
+
+    registry = NetworkRegistry(memory_budget, directory, storage, placement, consolidation, idle_seconds)
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            message = None
+        if message is None:
+            registry.persist()
+            return
+
+        call_id, method, args = message
+        try:
+            connection.send((call_id, getattr(registry, method)(*args), None))
+        except Exception as error:
+            connection.send((call_id, None, error))
+
+
+class Shard():
+    '''
+    The connection to the process of a shard
+
+    futures : the futures of the calls sent and not answered yet, by call identifier
+    '''
+
+    def __init__(self, process: multiprocessing.Process, connection):
+        self.process = process
+        self.connection = connection
+        self.futures: Dict[int, Future] = {}
+        self.send_lock = Lock()
+        self.receiver = Thread(target=self.receive, name="shard-receiver", daemon=True)
+        self.receiver.start()
+
+    def send(self, call_id: int, method: str, args: Tuple) -> Future:
+        future = Future()
+        with self.send_lock:
+            self.futures[call_id] = future
+            self.connection.send((call_id, method, args))
+        return future
+
+    def receive(self):
+        ''' Resolve the futures with the answers of the shard, until it is closed '''
+
+        while True:
+            try:
+                call_id, result, error = self.connection.recv()
+            except (EOFError, OSError):
+                error = ConnectionError("The shard is closed")
+                for future in list(self.futures.values()):
+                    future.set_exception(error)
+                self.futures.clear()
+                return
+
+            future = self.futures.pop(call_id)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class ShardedRegistry():
+    '''
+    The registries of the shards, with the interface of one registry
+    The processes are started on the first call, each with an equal part of the memory budget,
+    and the snapshots of each shard in a subdirectory of the directory if it is set.
+    '''
+
+    def __init__(self, number_of_shards: int, memory_budget: int = 256 * 1024 * 1024,
+                 directory: str = "", storage: str = "objects", placement: str = "best-fit",
+                 consolidation: int = 0, idle_seconds: float = 0):
+        self.number_of_shards = number_of_shards
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.storage = storage
+        self.placement = placement
+        self.consolidation = consolidation
+        self.idle_seconds = idle_seconds
+        self.ring = HashRing(number_of_shards)
+        self.shards: List[Shard] = []
+        self.call_ids = count()
+        self.start_lock = Lock()
+
+    def start(self):
+        ''' Start the processes of the shards '''
+
+        # a new interpreter for each shard, as the threads of the server don't survive a fork
+        context = multiprocessing.get_context("spawn")
+        shards = []
+        for shard in range(self.number_of_shards):
+            directory = os.path.join(self.directory, f"shard-{shard}") if self.directory != "" else ""
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=serve_shard, name=f"network-shard-{shard}", daemon=True,
+                args=(child_connection, self.memory_budget // self.number_of_shards, directory,
+                      self.storage, self.placement, self.consolidation, self.idle_seconds))
+            process.start()
+            child_connection.close()
+            shards.append(Shard(process, connection))
+        self.shards = shards
+
+    def submit(self, method: str, *args) -> Union[Future, List[Future]]:
+        ''' Send a call to the shard of its network, or to every shard for the gathered calls '''
+
+        if len(self.shards) == 0:
+            with self.start_lock:
+                if len(self.shards) == 0:
+                    self.start()
+
+        if method in GATHERED_METHODS:
+            return [x.send(next(self.call_ids), method, args) for x in self.shards]
+        return self.shards[self.ring.get_shard(args[0])].send(next(self.call_ids), method, args)
+
+    async def call(self, method: str, *args) -> Any:
+        ''' Run a method of the registry of the shard of the network, or gather it from every shard '''
+
+        futures = self.submit(method, *args)
+        if not isinstance(futures, list):
+            return await asyncio.wrap_future(futures)
+
+        results = await asyncio.gather(*[asyncio.wrap_future(x) for x in futures])
+        if method == "list":
+            return sorted((x for result in results for x in result), key=lambda x: x["id"])
+        if method == "evict_idle":
+            return sum(results)
+        stats = {key: sum(x[key] for x in results) for key in results[0]}
+        stats["shards"] = self.number_of_shards
+        return stats
+
+    def close(self):
+        ''' Stop the processes of the shards, which persist their loaded networks '''
+
+        for shard in self.shards:
+            # the process ends its side of the pipe, which also ends the receiver
+            with shard.send_lock:
+                shard.connection.send(None)
+            # the loaded networks are written to the snapshots before the process ends
+            shard.process.join(timeout=60)
+            shard.receiver.join(timeout=5)
+            shard.connection.close()
+        self.shards = []
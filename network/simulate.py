@@ -0,0 +1,181 @@
+'''
+Offline simulator, which applies a trace of joins and leaves to a network without the API
+
+A trace is either JSON lines, each an operation in the format of the test cases
+(e.g. {"join": {"capacity": 1}}, {"leave": {"id": 1}} or a tick of the rebalancer), a binary log in the format of the
+persistence log, or a test case file. The JSON lines and binary logs are read as a stream,
+so a trace of any length takes constant memory apart from the network.
+
+    $ python -m network.simulate trace.jsonl --summary-every 1000000
+    $ python -m network.simulate trace.jsonl --convert trace.log
+    $ python -m network.simulate trace.log --json --info info.json
+'''
+import argparse
+import json
+import sys
+from time import perf_counter
+from typing import Iterator, TextIO, Union
+from .crud import PLACEMENTS, P2PNetwork
+from .persistence import encode_operation, read_log
+
+
+def read_json_lines(f: TextIO) -> Iterator[dict]:
+    ''' Read the operations of JSON lines, skipping the empty lines '''
+
+    for line in f:
+        line = line.strip()
+        if len(line) > 0:
+            yield json.loads(line)
+
+
+def get_format(path: str) -> str:
+    if path.endswith(".log") or path.endswith(".bin"):
+        return "binary"
+    if path.endswith(".json"):
+        return "case"
+    return "jsonl"
+
+
+def read_trace(path: str, trace_format: Union[str, None] = None) -> Iterator[dict]:
+    ''' Read the operations of a trace, "-" for JSON lines from the standard input '''
+
+    if path == "-":
+        yield from read_json_lines(sys.stdin)
+        return
+
+    trace_format = trace_format or get_format(path)
+    if trace_format == "binary":
+        yield from read_log(path)
+    elif trace_format == "case":
+        with open(path) as f:
+            yield from json.load(f)["case"]
+    else:
+        with open(path) as f:
+            yield from read_json_lines(f)
+
+
+class Simulation():
+    '''
+    A simulation of a network with a trace
+
+    joins             : the number of the applied joins
+    leaves            : the number of the applied leaves
+    failed_leaves     : the number of the leaves of nodes not in the network
+    failed_joins      : the number of the joins rejected by the network, e.g. with a capacity out of range
+    rebalances        : the number of the applied ticks of the rebalancer
+    failed_rebalances : the number of the ticks of trees not in the network
+
+    The operations are applied as the writer applies them (see P2PNetwork.apply), with the placements of the joins,
+    so a log of the network replays to the same topology with the same placement and consolidation.
+    '''
+
+    def __init__(self, network: Union[P2PNetwork, None] = None):
+        self.network = network if network is not None else P2PNetwork()
+        self.joins = 0
+        self.leaves = 0
+        self.failed_leaves = 0
+        self.failed_joins = 0
+        self.rebalances = 0
+        self.failed_rebalances = 0
+        self.started_at = perf_counter()
+
+    @property
+    def operations(self) -> int:
+        return (self.joins + self.leaves + self.failed_leaves + self.failed_joins
+                + self.rebalances + self.failed_rebalances)
+
+    def apply(self, operation: dict):
+        try:
+            results = self.network.apply([operation])
+        except ValueError:
+            if "join" not in operation:
+                raise
+            self.failed_joins += 1
+            return
+        if len(results) == 0:
+            raise ValueError(f"Unknown operation: {operation}")
+
+        result = results[0]
+        if result["action"] == "join":
+            self.joins += 1
+        elif result["action"] == "leave":
+            if result["success"]:
+                self.leaves += 1
+            else:
+                self.failed_leaves += 1
+        elif result["success"]:
+            self.rebalances += 1
+        else:
+            self.failed_rebalances += 1
+
+    def summary(self) -> dict:
+        ''' Summarize the topology of the network and the progress '''
+
+        elapsed = perf_counter() - self.started_at
+        trees = self.network.trees
+        return {
+            "operations": self.operations,
+            "joins": self.joins,
+            "leaves": self.leaves,
+            "failed_leaves": self.failed_leaves,
+            "failed_joins": self.failed_joins,
+            "rebalances": self.rebalances,
+            "failed_rebalances": self.failed_rebalances,
+            "nodes": len(self.network.nodes),
+            "trees": len(trees),
+            "largest_tree": max([len(x.node_ids) for x in trees] + [0]),
+            "max_height": self.network.get_max_height(),
+            "seconds": round(elapsed, 3),
+            "ops_per_sec": round(self.operations / max(elapsed, 1e-9))
+        }
+
+
+def print_summary(summary: dict, as_json: bool):
+    if as_json:
+        print(json.dumps(summary), flush=True)
+    else:
+        print(", ".join(f"{key}: {value}" for key, value in summary.items()), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a trace of joins and leaves to a network")
+    parser.add_argument("trace", help="JSON lines, a binary log (.log, .bin) or a test case (.json), - for stdin")
+    parser.add_argument("--format", choices=["jsonl", "binary", "case"], default=None)
+    parser.add_argument("--storage", choices=["objects", "arrays"], default="objects")
+    parser.add_argument("--placement", choices=PLACEMENTS, default="best-fit", help="the placement of the logged network")
+    parser.add_argument("--consolidation", type=int, default=0, help="the consolidation of the logged network")
+    parser.add_argument("--summary-every", type=int, default=0, help="operations per summary, 0 for the last one only")
+    parser.add_argument("--json", action="store_true", help="print the summaries as JSON lines")
+    parser.add_argument("--info", default=None, help="write the final status of the network to the file")
+    parser.add_argument("--convert", default=None, help="write the trace as a binary log, without applying it")
+    args = parser.parse_args()
+
+    operations = read_trace(args.trace, args.format)
+
+    if args.convert is not None:
+        count = 0
+        with open(args.convert, "wb") as f:
+            for operation in operations:
+                f.write(encode_operation(operation))
+                count += 1
+        print(f"converted {count} operations to {args.convert}")
+        return
+
+    simulation = Simulation(P2PNetwork(args.storage, placement=args.placement, consolidation=args.consolidation))
+    summarized = -1
+    for operation in operations:
+        simulation.apply(operation)
+        if args.summary_every > 0 and simulation.operations % args.summary_every == 0:
+            print_summary(simulation.summary(), args.json)
+            summarized = simulation.operations
+
+    if summarized != simulation.operations:
+        print_summary(simulation.summary(), args.json)
+
+    if args.info is not None:
+        with open(args.info, "wb") as f:
+            f.write(simulation.network.info_json())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+'''
+Many isolated networks in one process, e.g. a swarm per content item
+
+The networks are named, created lazily on their first operation, and served by a single writer thread,
+so an idle network costs no thread and no queue. When the estimated memory of the loaded networks is over
+the budget, or when they are not used for the idle time, the least recently used ones are evicted to snapshots
+(see network.persistence), in files of the directory if it is set, otherwise in memory,
+and loaded again on their next use. With a directory, the loaded networks are also written to it when the registry
+is closed, and a new registry finds all the networks of the directory again.
+'''
+import asyncio
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import SimpleQueue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Callable, Dict, List, Union
+from .crud import P2PNetwork
+from .persistence import decode_snapshot, encode_snapshot, read_snapshot, read_snapshot_size, write_snapshot
+
+NETWORK_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+# the estimated memory of a network with its status rendered, as measured with tracemalloc
+NETWORK_BYTES = 4096
+NODE_BYTES = {"objects": 720, "arrays": 620}
+
+
+class Tenant():
+    '''
+    A network of the registry
+
+    network  : the network when it is loaded
+    snapshot : the snapshot of the evicted network, when there is no directory
+    evicted  : whether the network is in a snapshot
+    nodes    : the number of the nodes, kept when the network is evicted
+    trees    : the number of the trees, kept when the network is evicted
+    memory   : the estimated memory of the loaded network
+    used_at  : the monotonic time of the last use of the loaded network
+    '''
+
+    __slots__ = ["network", "snapshot", "evicted", "nodes", "trees", "memory", "used_at"]
+
+    def __init__(self):
+        self.network: Union[P2PNetwork, None] = None
+        self.snapshot: Union[bytes, None] = None
+        self.evicted = False
+        self.nodes = 0
+        self.trees = 0
+        self.memory = 0
+        self.used_at = 0.0
+
+
+class NetworkRegistry():
+    '''
+    The named networks, changed and read only by the writer thread
+
+    tenants       : the networks by name
+    loaded        : the loaded networks by name, the least recently used first
+    memory        : the estimated memory of the loaded networks
+    memory_budget : the memory of the loaded networks, above which the least recently used are evicted
+    directory     : the directory of the snapshots of the evicted networks, in memory if it is empty
+    storage       : the node storage of the networks, "objects" or "arrays"
+    placement     : the placement of the joins of the networks (see network.crud.PLACEMENTS)
+    consolidation : the number of the trees each join and leave may attach to the others (see P2PNetwork.consolidate)
+    idle_seconds  : the time without a use after which a loaded network is evicted, 0 to keep them
+    '''
+
+    def __init__(self, memory_budget: int = 256 * 1024 * 1024, directory: str = "", storage: str = "objects",
+                 placement: str = "best-fit", consolidation: int = 0, idle_seconds: float = 0):
+        self.tenants: Dict[str, Tenant] = {}
+        self.loaded: "OrderedDict[str, Tenant]" = OrderedDict()
+        self.memory = 0
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.storage = storage
+        self.placement = placement
+        self.consolidation = consolidation
+        self.idle_seconds = idle_seconds
+        self.evictions = 0
+        self.loads = 0
+        self.queue: SimpleQueue = SimpleQueue()
+        self.thread: Union[Thread, None] = None
+        self.start_lock = Lock()
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+            self.recover()
+
+    def recover(self):
+        ''' Add the networks of the snapshots of the directory, as evicted networks '''
+
+        for file_name in sorted(os.listdir(self.directory)):
+            network_id, extension = os.path.splitext(file_name)
+            if extension != ".snapshot" or not NETWORK_ID_PATTERN.match(network_id):
+                continue
+            tenant = Tenant()
+            tenant.evicted = True
+            tenant.nodes, tenant.trees = read_snapshot_size(self.get_snapshot_path(network_id))
+            self.tenants[network_id] = tenant
+
+    def submit(self, function: Callable[[], Any]) -> Future:
+        ''' Queue a function of the registry, returns the future of its result '''
+
+        if self.thread is None:
+            with self.start_lock:
+                if self.thread is None:
+                    self.thread = Thread(target=self.run, name="registry-writer", daemon=True)
+                    self.thread.start()
+
+        future = Future()
+        self.queue.put((function, future))
+        return future
+
+    async def execute(self, function: Callable[[], Any]) -> Any:
+        ''' Queue a function of the registry and wait for its result '''
+
+        return await asyncio.wrap_future(self.submit(function))
+
+    async def call(self, method: str, *args) -> Any:
+        ''' Run a method of the registry in the writer thread, in the same way as a sharded registry '''
+
+        return await self.execute(lambda: getattr(self, method)(*args))
+
+    def run(self):
+        ''' Run the queued functions forever, one at a time '''
+
+        while True:
+            function, future = self.queue.get()
+            try:
+                future.set_result(function())
+            except Exception as error:
+                future.set_exception(error)
+
+    def create(self, network_id: str) -> bool:
+        ''' Add an empty network, which is created on its first use, returns False if it exists '''
+
+        if not NETWORK_ID_PATTERN.match(network_id):
+            raise ValueError(f"Invalid network identifier: {network_id}")
+        if network_id in self.tenants:
+            return False
+        self.tenants[network_id] = Tenant()
+        return True
+
+    def delete(self, network_id: str) -> bool:
+        ''' Remove the network with its snapshot, returns False if it does not exist '''
+
+        tenant = self.tenants.pop(network_id, None)
+        if tenant is None:
+            return False
+        self.loaded.pop(network_id, None)
+        self.memory -= tenant.memory
+        if tenant.evicted and self.directory != "":
+            os.remove(self.get_snapshot_path(network_id))
+        return True
+
+    def list(self) -> List[dict]:
+        ''' The summaries of the networks, without loading the evicted ones '''
+
+        summaries = []
+        for network_id, tenant in self.tenants.items():
+            if tenant.network is not None:
+                tenant.nodes, tenant.trees = len(tenant.network.nodes), len(tenant.network.trees)
+            summaries.append({"id": network_id, "nodes": tenant.nodes, "trees": tenant.trees,
+                              "loaded": tenant.network is not None})
+        return summaries
+
+    def get_network(self, network_id: str) -> Union[P2PNetwork, None]:
+        ''' Get the network, creating or loading it if needed, and mark it as the most recently used '''
+
+        tenant = self.tenants.get(network_id, None)
+        if tenant is None:
+            return None
+
+        tenant.used_at = monotonic()
+        if tenant.network is not None:
+            self.loaded.move_to_end(network_id)
+        else:
+            network = P2PNetwork(self.storage, placement=self.placement, consolidation=self.consolidation)
+            if tenant.evicted:
+                if self.directory == "":
+                    decode_snapshot(tenant.snapshot, network)
+                else:
+                    read_snapshot(self.get_snapshot_path(network_id), network)
+                    os.remove(self.get_snapshot_path(network_id))
+                tenant.snapshot = None
+                tenant.evicted = False
+                self.loads += 1
+            tenant.network = network
+            self.loaded[network_id] = tenant
+            self.update_memory(tenant)
+        return tenant.network
+
+    def apply(self, network_id: str, operations: List[dict]) -> Union[List[dict], None]:
+        ''' Apply the operations to the network, returns None if it does not exist '''
+
+        network = self.get_network(network_id)
+        if network is None:
+            return None
+        results = network.apply(operations)
+        self.update_memory(self.tenants[network_id])
+        self.evict(network_id)
+        return results
+
+    def status(self, network_id: str) -> Union[bytes, None]:
+        ''' The JSON status of the network, None if it does not exist '''
+
+        network = self.get_network(network_id)
+        if network is None:
+            return None
+        status = network.info_json()
+        self.evict(network_id)
+        return status
+
+    def update_memory(self, tenant: Tenant):
+        memory = NETWORK_BYTES + len(tenant.network.nodes) * NODE_BYTES[self.storage]
+        self.memory += memory - tenant.memory
+        tenant.memory = memory
+
+    def evict(self, keep_id: str):
+        ''' Evict the least recently used networks, but the one in use, while the memory is over the budget '''
+
+        while self.memory > self.memory_budget and len(self.loaded) > 1:
+            network_id, tenant = next(iter(self.loaded.items()))
+            if network_id == keep_id:
+                self.loaded.move_to_end(network_id)
+                continue
+            self.unload(network_id, tenant)
+        self.evict_idle(keep_id)
+
+    def evict_idle(self, keep_id: str = "") -> int:
+        ''' Evict the networks not used for the idle time, but the one in use, returns the number of them '''
+
+        if self.idle_seconds <= 0:
+            return 0
+
+        # the loaded networks are in the order of their last use
+        evictions = 0
+        used_before = monotonic() - self.idle_seconds
+        for network_id, tenant in list(self.loaded.items()):
+            if tenant.used_at > used_before:
+                break
+            if network_id != keep_id:
+                self.unload(network_id, tenant)
+                evictions += 1
+        return evictions
+
+    def unload(self, network_id: str, tenant: Tenant):
+        ''' Evict the loaded network to its snapshot '''
+
+        del self.loaded[network_id]
+        network = tenant.network
+        if self.directory == "":
+            tenant.snapshot = encode_snapshot(network, 0)
+        else:
+            write_snapshot(network, self.get_snapshot_path(network_id), 0)
+        tenant.nodes, tenant.trees = len(network.nodes), len(network.trees)
+        tenant.network = None
+        tenant.evicted = True
+        self.memory -= tenant.memory
+        tenant.memory = 0
+        self.evictions += 1
+
+    def persist(self):
+        ''' Write all the loaded networks to the snapshots of the directory, if it is set '''
+
+        if self.directory == "":
+            return
+        # the networks never used are written empty, so they are found again as well
+        for network_id, tenant in self.tenants.items():
+            if not tenant.evicted:
+                self.get_network(network_id)
+        for network_id, tenant in list(self.loaded.items()):
+            self.unload(network_id, tenant)
+
+    def close(self):
+        ''' Persist the loaded networks in the writer thread, after the queued functions '''
+
+        self.submit(self.persist).result()
+
+    def get_snapshot_path(self, network_id: str) -> str:
+        return os.path.join(self.directory, f"{network_id}.snapshot")
+
+    def stats(self) -> dict:
+        return {
+            "networks": len(self.tenants),
+            "loaded": len(self.loaded),
+            "memory": self.memory,
+            "memory_budget": self.memory_budget,
+            "evictions": self.evictions,
+            "loads": self.loads
+        }
@@ -0,0 +1,137 @@
+'''
+Seeded churn workloads of the network
+
+A workload yields the operations in the format of the test cases, each with its phase:
+"warmup" grows the network to the given size, and "churn" is the pattern of the workload.
+The network gives the identifiers in increasing order from 1, so the identifiers are known
+without a network, and the same seed always gives the same operations.
+The operations are generated lazily, so a workload of any size takes constant memory
+apart from the identifiers of the nodes in the network.
+'''
+import heapq
+import random
+from typing import Dict, Iterator, List, Tuple, Union
+
+# the weights of the capacities 0, 1, 2 and 3
+CAPACITY_MIXES: Dict[str, List[float]] = {
+    "uniform": [1, 1, 1, 1],
+    "skewed": [45, 40, 10, 5]
+}
+
+
+class TraceBuilder():
+    '''
+    A builder of the operations, which follows the nodes in the network
+
+    live_ids  : the identifiers of the nodes in the network, in no order
+    positions : the position of each identifier in live_ids
+    oldest    : a heap of the identifiers, with the ones that left removed lazily
+    '''
+
+    def __init__(self, seed: int, mix: Union[str, List[float]] = "uniform"):
+        self.rand = random.Random(seed)
+        self.weights = CAPACITY_MIXES[mix] if isinstance(mix, str) else mix
+        self.next_id = 1
+        self.live_ids: List[int] = []
+        self.positions: Dict[int, int] = {}
+        self.oldest: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.live_ids)
+
+    def join(self) -> dict:
+        capacity = self.rand.choices(range(4), self.weights)[0]
+        self.positions[self.next_id] = len(self.live_ids)
+        self.live_ids.append(self.next_id)
+        heapq.heappush(self.oldest, self.next_id)
+        self.next_id += 1
+        return {"join": {"capacity": capacity}}
+
+    def leave(self, node_id: int) -> dict:
+        position = self.positions.pop(node_id)
+        last_id = self.live_ids.pop()
+        if last_id != node_id:
+            self.live_ids[position] = last_id
+            self.positions[last_id] = position
+        return {"leave": {"id": node_id}}
+
+    def leave_random(self) -> dict:
+        return self.leave(self.live_ids[self.rand.randrange(len(self.live_ids))])
+
+    def leave_oldest(self) -> dict:
+        ''' The oldest nodes are the roots and the nodes near them '''
+
+        while self.oldest[0] not in self.positions:
+            heapq.heappop(self.oldest)
+        return self.leave(heapq.heappop(self.oldest))
+
+    def churn(self) -> dict:
+        ''' A join or a leave with the same chance, never leaving an empty network '''
+
+        if len(self.live_ids) == 0 or self.rand.random() < 0.5:
+            return self.join()
+        return self.leave_random()
+
+
+def warm_up(builder: TraceBuilder, size: int) -> Iterator[Tuple[str, dict]]:
+    while len(builder) < size:
+        yield "warmup", builder.join()
+
+
+def steady(size: int, operations: int, seed: int,
+           mix: Union[str, List[float]] = "uniform") -> Iterator[Tuple[str, dict]]:
+    ''' Random joins and leaves around the size '''
+
+    builder = TraceBuilder(seed, mix)
+    yield from warm_up(builder, size)
+    for _ in range(operations):
+        yield "churn", builder.churn()
+
+
+def flash_crowd(size: int, operations: int, seed: int,
+                mix: Union[str, List[float]] = "uniform") -> Iterator[Tuple[str, dict]]:
+    ''' A burst of joins on top of the size '''
+
+    builder = TraceBuilder(seed, mix)
+    yield from warm_up(builder, size)
+    for _ in range(operations):
+        yield "churn", builder.join()
+
+
+def mass_departure(size: int, operations: int, seed: int,
+                   mix: Union[str, List[float]] = "uniform") -> Iterator[Tuple[str, dict]]:
+    ''' A burst of leaves of random nodes, at most the whole network '''
+
+    builder = TraceBuilder(seed, mix)
+    yield from warm_up(builder, size)
+    for _ in range(min(operations, size)):
+        yield "churn", builder.leave_random()
+
+
+def root_heavy(size: int, operations: int, seed: int,
+               mix: Union[str, List[float]] = "uniform") -> Iterator[Tuple[str, dict]]:
+    ''' Joins and leaves of the oldest nodes, in turn '''
+
+    builder = TraceBuilder(seed, mix)
+    yield from warm_up(builder, size)
+    for index in range(operations):
+        if index % 2 == 0 and len(builder) > 0:
+            yield "churn", builder.leave_oldest()
+        else:
+            yield "churn", builder.join()
+
+
+def skewed(size: int, operations: int, seed: int,
+           mix: Union[str, List[float]] = "skewed") -> Iterator[Tuple[str, dict]]:
+    ''' Random joins and leaves around the size, with mostly small capacities by default '''
+
+    return steady(size, operations, seed, mix)
+
+
+WORKLOADS = {
+    "steady": steady,
+    "flash_crowd": flash_crowd,
+    "mass_departure": mass_departure,
+    "root_heavy": root_heavy,
+    "skewed": skewed
+}
@@ -2,6 +2,12 @@ import unittest
 from fastapi import Response
 from app.main import get_application, route_application
 from fastapi.testclient import TestClient
+from network.api import v1
+from network.crud import P2PNetwork
+from network.engine import NetworkEngine
+from network.events import EventFeed
+from network.rebalance import Rebalancer
+from network.workloads import WORKLOADS
 
 app = get_application()
 route_application(app)
@@ -15,6 +21,8 @@ class TestAPI(unittest.TestCase):
     '''
 
     def setUp(self):
+        v1.engine = NetworkEngine(P2PNetwork())
+        v1.event_feed = EventFeed(v1.engine.network)
         self.first_capacity = 1
         self.second_capacity = 2
 
@@ -58,6 +66,122 @@ class TestAPI(unittest.TestCase):
             }
         ]
 
+    def test_batch(self):
+        response = client.post("/network/batch", json={"operations": [
+            {"join": {"capacity": self.first_capacity}},
+            {"join": {"capacity": self.second_capacity}},
+            {"leave": {"id": 1}},
+            {"leave": {"id": 9}}
+        ]})
+        assert response.status_code == 200
+        assert response.json() == [
+            {"action": "join", "id": 1, "success": True},
+            {"action": "join", "id": 2, "success": True},
+            {"action": "leave", "id": 1, "success": True},
+            {"action": "leave", "id": 9, "success": False, "detail": "Node not found"}
+        ]
+
+        response = self.get_status()
+        assert response.json() == [
+            {
+                "nodes": {
+                    "N2": self.second_capacity
+                },
+                "edges": []
+            }
+        ]
+
+        response = client.post("/network/batch", json={"operations": [{}]})
+        assert response.status_code == 422
+
+    def test_join_placement(self):
+        for capacity in [1, 3, 0, 3, 0]:
+            self.join(capacity)
+        response = client.post("/network/join", json={"capacity": 0, "placement": "shallowest"})
+        assert response.status_code == 200
+        assert client.get("/network/nodes/6/path").json() == {"path": ["N6", "N2", "N1"]}
+
+        response = client.post("/network/join", json={"capacity": 0, "placement": "deepest"})
+        assert response.status_code == 422
+
+    def test_rebalancer(self):
+        v1.rebalancer = Rebalancer(moves=8)
+        operations = [x[1] for x in WORKLOADS["steady"](200, 500, 2)]
+        client.post("/network/batch", json={"operations": operations})
+        tree_id = v1.engine.submit(v1.rebalancer.find_tree).result(timeout=5)
+        assert tree_id == 1
+
+        # a tick as the background task sends it
+        results = v1.engine.submit([{"rebalance": {"tree": tree_id, "moves": 8}}]).result(timeout=5)
+        v1.rebalancer.record(results[0])
+        response = client.get("/network/rebalancer")
+        assert response.json()["ticks"] == 1
+        assert response.json()["moves"] == 8
+        assert "p2p_rebalance_ticks_total 1" in client.get("/network/metrics").text
+
+    def test_status_encoding(self):
+        client.post("/network/batch", json={"operations": [{"join": {"capacity": 2}}] * 100})
+        identity = client.get("/network/status", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in identity.headers
+        assert identity.headers["vary"] == "Accept-Encoding"
+        # 100 joins and the tree of the first one
+        assert identity.headers["x-event-seq"] == "101"
+
+        response = client.get("/network/status", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.content == identity.content
+        assert int(response.headers["content-length"]) < len(identity.content)
+
+        response = client.get("/network/status", headers={"Accept-Encoding": "gzip, br"})
+        assert response.headers["content-encoding"] == "br"
+        assert response.content == identity.content
+
+        # a small status is not compressed
+        v1.engine = NetworkEngine(P2PNetwork())
+        response = client.get("/network/status", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        assert response.json() == []
+
+    def test_queries(self):
+        client.post("/network/batch", json={"operations": [
+            {"join": {"capacity": x}} for x in [2, 1, 1, 0, 0, 3, 0]] + [{"leave": {"id": 6}}, {"join": {"capacity": 1}}]})
+        status = self.get_status().json()
+        assert len(status) == 3
+
+        response = client.get("/network/trees", params={"limit": 2})
+        assert response.json()["next"] == 2
+        trees = response.json()["trees"]
+        response = client.get("/network/trees", params={"limit": 2, "cursor": 2})
+        assert response.json()["next"] is None
+        trees += response.json()["trees"]
+        assert [x["tree"] for x in trees] == [1, 2, 3]
+        assert [{"nodes": x["nodes"], "edges": x["edges"]} for x in trees] == status
+        assert trees[0]["root"] == "N1"
+
+        response = client.get("/network/trees/1", params={"depth": 1})
+        assert response.json() == {"tree": 1, "root": "N1", "nodes": {"N1": 2, "N2": 1, "N3": 1},
+                                   "edges": [["N1", "N2"], ["N1", "N3"]]}
+        assert client.get("/network/trees/9").status_code == 404
+
+        response = client.get("/network/nodes/4/tree")
+        assert response.json() == trees[0]
+
+        response = client.get("/network/nodes/2/subtree")
+        assert response.json() == {"tree": 1, "root": "N2", "nodes": {"N2": 1, "N4": 0}, "edges": [["N2", "N4"]]}
+
+        response = client.get("/network/nodes/4/path")
+        assert response.json() == {"path": ["N4", "N2", "N1"]}
+        assert client.get("/network/nodes/6/path").status_code == 404
+
+        response = client.get("/network/status/trees", params={"limit": 2, "cursor": 1})
+        assert response.json() == {"trees": [
+            {"tree": 2, "root": "N7", "size": 1, "remaining": 0, "attachable": 0, "height": 0, "free_depth": -1},
+            {"tree": 3, "root": "N8", "size": 1, "remaining": 1, "attachable": 1, "height": 0, "free_depth": 0}
+        ], "next": None}
+        response = client.get("/network/status/trees", params={"limit": 1})
+        assert response.json()["trees"][0]["size"] == 5
+        assert response.json()["trees"][0]["height"] == 2
+
     def join(self, capacity) -> Response:
         response = client.post("/network/join", json={"capacity": capacity})
         assert response.status_code == 200
@@ -0,0 +1,105 @@
+import unittest
+from network.arrays import NodeArrays, PositionArray
+from network.crud import P2PNetwork
+from network.models import Node
+
+
+class TestNodeArrays(unittest.TestCase):
+    '''
+    A class for testing the array storage of the nodes
+    '''
+
+    def setUp(self):
+        self.store = NodeArrays()
+        self.views = [
+            self.store.add(Node(1, 3, 0, [2, 3], 0, 1, 1)),
+            self.store.add(Node(2, 1, 1, [4], 1, 1, 0)),
+            self.store.add(Node(3, 0, 1, [], 1, 1, 0))
+        ]
+
+    def test_view(self):
+        view = self.views[0]
+        assert view.id == 1
+        assert view.child_ids == [2, 3]
+        assert len(view.child_ids) == 2
+        assert view.child_ids[0] == 2
+
+        view.child_ids.append(5)
+        view.child_ids.remove(2)
+        view.remaining -= 1
+        view.depth += 2
+        assert view.child_ids == [3, 5]
+        assert view.remaining == 0
+        assert view.depth == 2
+
+        with self.assertRaises(ValueError):
+            view.child_ids.append(6)
+            view.child_ids.append(7)
+
+    def test_remove(self):
+        self.store.remove(self.views[0])
+        assert len(self.store) == 2
+        assert self.store.views[0] is self.views[2]
+        assert self.views[2].row == 0
+        assert self.views[2].id == 3
+
+        # the removed view keeps its properties
+        assert self.views[0].id == 1
+        assert self.views[0].child_ids == [2, 3]
+
+    def test_positions(self):
+        positions = PositionArray()
+        positions[3] = 0
+        positions[5] = 1
+        assert positions.get(3, -1) == 0
+        assert positions.get(4, -1) == -1
+        assert positions[5] == 1
+
+        del positions[3]
+        assert 3 not in positions
+        with self.assertRaises(KeyError):
+            positions[3]
+
+    def test_sparse_positions(self):
+        positions = PositionArray()
+        for node_id in range(1, 1001):
+            positions[node_id] = node_id - 1
+
+        # a few old identifiers outlive the others
+        for node_id in range(1, 1001):
+            if node_id % 100 != 0:
+                del positions[node_id]
+        for node_id in range(1001, 1011):
+            positions[node_id] = node_id
+        assert len(positions) == 20
+        assert len(positions.positions) < 100
+        assert positions[500] == 499 and positions[1005] == 1005
+        assert 501 not in positions and positions.get(999, -1) == -1
+
+        del positions[500]
+        assert len(positions) == 19 and 500 not in positions
+
+    def test_network(self):
+        operations = [{"join": {"capacity": x % 4}} for x in range(30)]
+        operations += [{"leave": {"id": x}} for x in [30, 6, 99, 1]]
+
+        network = P2PNetwork()
+        compact_network = P2PNetwork("arrays")
+        assert compact_network.apply(operations) == network.apply(operations)
+        assert compact_network.info() == network.info()
+
+        with self.assertRaises(ValueError):
+            P2PNetwork("unknown")
+
+    def test_rejected_join(self):
+        network = P2PNetwork("arrays")
+        network.apply([{"join": {"capacity": x}} for x in [2, 1, 0]])
+        info = network.info()
+
+        # a capacity the rows can't hold is rejected before the node is linked or a tree is added
+        with self.assertRaises(ValueError):
+            network.join(4)
+        assert network.info() == info
+        assert len(network.trees) == 1 and len(network.node_store) == 3
+        assert network.get_node(1).child_ids == [2, 3]
+        assert network.join(0) == 4
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import random
+import unittest
+from typing import List, Tuple
+from unittest import mock
+from network import helper
+from network.crud import P2PNetwork
+from network.helper import find_best_combination, find_descendants, find_free_slots, get_max_depth
+from network.models import Tree
+
+
+def find_best_cost(heights: List[int], slot_nodes: List[List[Tuple[int, int, int]]]) -> Tuple[int, int]:
+    '''
+    Try every parent for every subtree, returns the fewest trees and then the lowest height
+    slot_nodes : the nodes of each subtree, as (depth, identifier, remaining)
+    '''
+
+    number_of_sub_trees = len(heights)
+    remainings = {node_id: remaining for x in slot_nodes for _, node_id, remaining in x}
+    choices = []
+    for sub_tree in range(number_of_sub_trees):
+        choices.append([None] + [
+            (other, node_id, depth)
+            for other in range(number_of_sub_trees) if other != sub_tree
+            for depth, node_id, remaining in slot_nodes[other] if remaining > 0])
+
+    best_cost = None
+    for parents in itertools.product(*choices):
+        used = {}
+        for parent in parents:
+            if parent is not None:
+                used[parent[1]] = used.get(parent[1], 0) + 1
+        if any(count > remainings[node_id] for node_id, count in used.items()):
+            continue
+
+        # the depth of the root of each subtree, None for a cycle
+        root_depths = []
+        for sub_tree in range(number_of_sub_trees):
+            depth, visited = 0, set()
+            while parents[sub_tree] is not None and sub_tree not in visited:
+                visited.add(sub_tree)
+                depth += parents[sub_tree][2] + 1
+                sub_tree = parents[sub_tree][0]
+            root_depths.append(None if parents[sub_tree] is not None else depth)
+        if None in root_depths:
+            continue
+
+        cost = (parents.count(None),
+                max(x + y for x, y in zip(root_depths, heights)))
+        if best_cost is None or cost < best_cost:
+            best_cost = cost
+    return best_cost
+
+
+class TestCombine(unittest.TestCase):
+    def test_best_combination(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            heights, slot_nodes, node_id = [], [], 1
+            for _ in range(rng.randint(1, 4)):
+                height = rng.randint(0, 3)
+                heights.append(height)
+                slot_nodes.append([])
+                for _ in range(rng.randint(1, 3)):
+                    slot_nodes[-1].append((rng.randint(0, height), node_id, rng.choice([0, 0, 1, 2, 3])))
+                    node_id += 1
+
+            slots = [sorted((depth, node_id) for depth, node_id, remaining in x
+                            for _ in range(remaining))[:len(heights) - 1] for x in slot_nodes]
+            combination = find_best_combination(heights, slots)
+            assert (combination.number_of_trees, combination.height) == find_best_cost(heights, slot_nodes)
+            assert len(combination.roots) + len(combination.attachments) == len(heights)
+
+    def test_best_combination_expansions(self):
+        def count_expansions(heights: List[int], slots: List[List[Tuple[int, int]]]) -> int:
+            expansions = []
+            pop = heapq.heappop
+
+            def heappop(queue):
+                expansions.append(queue[0])
+                return pop(queue)
+
+            with mock.patch.object(helper.heapq, "heappop", heappop):
+                find_best_combination(heights, slots)
+            return len(expansions)
+
+        # the search stops at the first complete combination, one step per subtree
+        assert count_expansions([1, 0, 0, 0], [[(0, 1)] * 3, [], [], []]) == 5
+
+        rng = random.Random(1)
+        for _ in range(500):
+            heights = [rng.randint(0, 3) for _ in range(4)]
+            slots = [sorted((rng.randint(0, x), rng.randint(1, 99)) for _ in range(rng.choice([0, 0, 1, 2, 3])))
+                     for x in heights]
+            # each partial combination is expanded at most once
+            assert count_expansions(heights, slots) <= 1 + 4 + 12 + 24 + 24
+
+    def test_leave(self):
+        for seed in range(30):
+            rng = random.Random(seed)
+            network = P2PNetwork()
+            for _ in range(rng.randint(10, 40)):
+                network.join(rng.choice([0, 1, 1, 2, 2, 3]))
+
+            for _ in range(10):
+                cur_node = rng.choice(network.nodes)
+                _, cur_tree = network.find_tree(cur_node.tree_id)
+                roots = network.divide_tree(cur_node, cur_node.id == cur_tree.root_id)
+
+                # the rest of the tree, if any, is the tree without the subtree of the leaving node
+                sub_trees = [[x] + find_descendants(x, network.get_node) for x in roots]
+                if cur_node.id != cur_tree.root_id:
+                    left_ids = {x.id for x in find_descendants(cur_node, network.get_node)} | {cur_node.id}
+                    sub_trees[0] = [x for x in sub_trees[0] if x.id not in left_ids]
+
+                # the parent gets back the slot of the leaving node
+                heights, slot_nodes = [], []
+                for sub_tree in sub_trees:
+                    root_depth = network.get_depth(sub_tree[0].id)
+                    depths = [network.get_depth(x.id) - root_depth for x in sub_tree]
+                    heights.append(max(depths))
+                    slot_nodes.append([(depth, x.id, x.remaining + (x.id == cur_node.parent_id))
+                                       for x, depth in zip(sub_tree, depths)])
+
+                number_of_trees = len(network.trees)
+                other_tree_ids = {x.id for x in network.trees} - {cur_tree.id}
+                network.leave(cur_node.id)
+                new_trees = [x for x in network.trees if x.id not in other_tree_ids]
+
+                if len(sub_trees) == 0:
+                    assert len(network.trees) == number_of_trees - 1
+                    continue
+
+                height = max(network.get_height(x) for x in new_trees)
+                assert (len(new_trees), height) == find_best_cost(heights, slot_nodes)
+                for tree in new_trees:
+                    assert network.get_height(tree) == max(network.get_depth(x) for x in tree.node_ids)
+                    # the depths are computed again when they are read
+                    assert network.get_height(tree) == get_max_depth([network.get_node(x) for x in tree.node_ids])
+                    for node_id in tree.node_ids:
+                        node = network.get_node(node_id)
+                        assert node.tree_id == tree.id
+                        assert node.remaining == node.capacity - len(node.child_ids)
+
+    def test_node_ids(self):
+        tree = Tree(1, [3, 1, 2], 3)
+        tree.node_ids.remove(1)
+        tree.node_ids.append(4)
+        assert tree.node_ids == [3, 2, 4]
+        assert 2 in tree.node_ids and 1 not in tree.node_ids
+        assert repr(tree.node_ids) == "[3, 2, 4]"
+
+    def test_leave_keeps_other_subtrees(self):
+        network = P2PNetwork()
+        for capacity in [2, 2, 1, 1, 0, 0]:
+            network.join(capacity)
+        cur_tree = network.trees[0]
+        kept_ids = [x for x in cur_tree.node_ids if x != 6]
+
+        # a leaf only leaves its tree, and an internal node only moves the subtrees ending up in a new tree
+        network.leave(6)
+        assert cur_tree.node_ids == kept_ids
+        network.leave(2)
+        assert sorted(x for tree in network.trees for x in tree.node_ids) == [1, 3, 4, 5]
+        for tree in network.trees:
+            assert all(network.get_node(x).tree_id == tree.id for x in tree.node_ids)
+
+    def test_leave_with_three_children(self):
+        network = P2PNetwork()
+        for capacity in [3, 1, 2, 0, 1]:
+            network.join(capacity)
+
+        # N1 has N2, N3 and N5, N3 has N4
+        network.leave(1)
+        assert len(network.trees) == 1
+        assert network.info()[0]["edges"] == [["N2", "N3"], ["N3", "N4"], ["N3", "N5"]]
+
+    def test_free_slots(self):
+        network = P2PNetwork()
+        for capacity in [2, 1, 3]:
+            network.join(capacity)
+
+        network.get_height(network.trees[0])
+        assert find_free_slots(network.get_node(1), network.get_node, 3) == [(1, 2), (1, 3), (1, 3)]
+        assert find_free_slots(network.get_node(1), network.get_node, 1) == [(1, 2)]
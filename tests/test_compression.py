@@ -0,0 +1,34 @@
+import gzip
+import unittest
+import brotli
+from network.compression import ENCODINGS, compress, negotiate_encoding, parse_accept_encoding
+
+
+class TestCompression(unittest.TestCase):
+    '''
+    A class for testing the negotiation of the content encodings
+    '''
+
+    def test_parse_accept_encoding(self):
+        assert parse_accept_encoding("gzip, deflate;q=0.5, br;q=0") == {"gzip": 1.0, "deflate": 0.5, "br": 0.0}
+        assert parse_accept_encoding("") == {}
+
+    def test_negotiate_encoding(self):
+        assert negotiate_encoding(None) is None
+        assert negotiate_encoding("identity") is None
+        assert negotiate_encoding("deflate") is None
+        assert negotiate_encoding("gzip, deflate") == "gzip"
+        assert negotiate_encoding("gzip;q=0") is None
+        assert ENCODINGS == ["br", "gzip"]
+        assert negotiate_encoding("*") == "br"
+        assert negotiate_encoding("gzip, br") == "br"
+        assert negotiate_encoding("*, gzip;q=0") == "br"
+        assert negotiate_encoding("*, br;q=0") == "gzip"
+        assert negotiate_encoding("br;q=0.5, gzip") == "gzip"
+
+    def test_compress(self):
+        content = b"[" + b",".join(b'{"nodes":{"N1":1},"edges":[]}' for _ in range(100)) + b"]"
+        assert gzip.decompress(compress(content, "gzip")) == content
+        assert brotli.decompress(compress(content, "br")) == content
+        with self.assertRaises(ValueError):
+            compress(content, "deflate")
@@ -0,0 +1,98 @@
+import asyncio
+import gzip
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from network.crud import P2PNetwork
+from network.engine import NetworkEngine
+
+
+class TestNetworkEngine(unittest.TestCase):
+    '''
+    A class for testing the single writer of the network
+    '''
+
+    def setUp(self):
+        self.engine = NetworkEngine(P2PNetwork())
+
+    def test_concurrent_submit(self):
+        def join(capacity):
+            return self.engine.submit([{"join": {"capacity": capacity}}]).result(timeout=5)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(join, [x % 4 for x in range(200)]))
+
+        node_ids = sorted(x[0]["id"] for x in results)
+        assert node_ids == list(range(1, 201))
+
+        # the status is published on the first read after the changes
+        version = self.engine.version
+        self.engine.refresh().result(timeout=5)
+        assert self.engine.version == version + 1
+        self.engine.refresh().result(timeout=5)
+        assert self.engine.version == version + 1
+        info = json.loads(self.engine.snapshot)
+        assert sum(len(x["nodes"]) for x in info) == 200
+
+        stats = self.engine.stats()
+        assert stats["applied_operations"] == 200
+        assert stats["queue_depth"] == 0
+        assert stats["version"] >= 1
+
+    def test_execute(self):
+        async def run():
+            await self.engine.execute([{"join": {"capacity": 1}}])
+            return await self.engine.execute([{"join": {"capacity": 0}}, {"leave": {"id": 5}}])
+
+        results = asyncio.run(run())
+        assert results[0] == {"action": "join", "id": 2, "success": True}
+        assert not results[1]["success"]
+        assert json.loads(self.engine.snapshot) == []
+        self.engine.refresh().result(timeout=5)
+        assert json.loads(self.engine.snapshot) == [
+            {"nodes": {"N1": 1, "N2": 0}, "edges": [["N1", "N2"]]}]
+
+    def test_error(self):
+        apply = self.engine.network.apply
+
+        def failing_apply(operations):
+            if len(operations) == 0:
+                raise ValueError("No operation")
+            return apply(operations)
+
+        self.engine.network.apply = failing_apply
+        with self.assertRaises(ValueError):
+            self.engine.submit([]).result(timeout=5)
+
+        results = self.engine.submit([{"join": {"capacity": 1}}]).result(timeout=5)
+        assert results[0]["id"] == 1
+
+    def test_get_snapshot(self):
+        self.engine.submit([{"join": {"capacity": 2}}] * 100).result(timeout=5)
+        self.engine.refresh().result(timeout=5)
+        content, encoding, seq = self.engine.get_snapshot("gzip")
+        assert encoding == "gzip"
+        assert gzip.decompress(content) == self.engine.snapshot
+        assert self.engine.get_snapshot(None) == (self.engine.snapshot, None, seq)
+        assert seq == self.engine.network.seq
+
+        # compressed once per snapshot, and kept while the status does not change
+        self.engine.submit([{"leave": {"id": 1000}}]).result(timeout=5)
+        self.engine.refresh().result(timeout=5)
+        assert self.engine.get_snapshot("gzip")[0] is content
+        self.engine.submit([{"leave": {"id": 100}}]).result(timeout=5)
+        self.engine.refresh().result(timeout=5)
+        assert gzip.decompress(self.engine.get_snapshot("gzip")[0]) == self.engine.snapshot
+        assert self.engine.get_snapshot("gzip")[0] is not content
+        assert self.engine.get_snapshot("gzip")[2] == self.engine.network.seq > seq
+
+    def test_query(self):
+        async def run():
+            self.engine.submit([{"join": {"capacity": 1}}, {"join": {"capacity": 0}}])
+            return await self.engine.query(lambda network: network.get_path(2))
+
+        assert asyncio.run(run()) == ["N2", "N1"]
+        assert self.engine.stats()["applied_batches"] == 1
+
+        with self.assertRaises(KeyError):
+            self.engine.submit(lambda network: network.get_node(9)).result(timeout=5)
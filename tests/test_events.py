@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from network.crud import P2PNetwork
+from network.events import EventFeed
+
+
+class TestEventFeed(unittest.TestCase):
+    '''
+    A class for testing the feed of the topology events
+    '''
+
+    def setUp(self):
+        self.network = P2PNetwork()
+        self.feed = EventFeed(self.network, buffer_size=4)
+
+    def test_listen_only_with_subscriptions(self):
+        assert len(self.network.listeners) == 0
+        subscription = self.feed.subscribe()
+        assert len(self.network.listeners) == 1
+        self.feed.unsubscribe(subscription)
+        assert len(self.network.listeners) == 0
+
+    def test_events(self):
+        self.feed.buffer_size = 16
+        subscription = self.feed.subscribe()
+        assert subscription.drain(self.feed.seq) == [{"type": "resync", "seq": 0}]
+        self.network.join(1)
+        self.network.join(1)
+        self.network.leave(1)
+
+        events = subscription.drain(self.feed.seq)
+        for event in events:
+            event.pop("seq")
+        assert events == [
+            {"type": "tree", "tree": 1},
+            {"type": "join", "id": 1, "capacity": 1, "parent": 0, "tree": 1},
+            {"type": "join", "id": 2, "capacity": 1, "parent": 1, "tree": 1},
+            {"type": "leave", "id": 1, "tree": 1},
+            {"type": "move", "id": 2, "parent": 0, "tree": 1}
+        ]
+        assert subscription.drain(self.feed.seq) == []
+
+    def test_resync(self):
+        subscription = self.feed.subscribe()
+        subscription.drain(self.feed.seq)
+
+        for _ in range(3):
+            self.network.join(0)
+        # the marker comes alone, the reloaded status already has the dropped events
+        assert subscription.drain(self.feed.seq) == [{"type": "resync", "seq": 6}]
+
+        self.network.join(0)
+        assert [x["seq"] for x in subscription.drain(self.feed.seq)] == [7, 8]
+
+    def test_seq_without_listeners(self):
+        # the changes are numbered without a subscription, so a status read before one tells what it has
+        self.network.join(0)
+        self.network.join(0)
+        assert self.network.seq == 4
+
+        subscription = self.feed.subscribe()
+        assert subscription.drain(self.feed.seq) == [{"type": "resync", "seq": 4}]
+        self.network.leave(1)
+        assert [x["seq"] for x in subscription.drain(self.feed.seq)] == [5, 6]
+
+    def test_get(self):
+        subscription = self.feed.subscribe()
+
+        async def consume():
+            events = await self.feed.get(subscription)
+            assert events[0]["type"] == "resync"
+            asyncio.get_running_loop().call_soon(self.network.join, 2)
+            events = await self.feed.get(subscription)
+            assert [x["type"] for x in events] == ["tree", "join"]
+
+        asyncio.run(consume())
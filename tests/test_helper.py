@@ -1,6 +1,10 @@
+import json
+import os
+import subprocess
+import sys
 import unittest
 from typing import List
-from network.models import Node
+from network.models import Node, Tree
 from network.helper import *
 
 
@@ -21,6 +25,29 @@ class TestHelper(unittest.TestCase):
         assert ["N1", "N3"] in all_edges
         assert ["N2", "N4"] in all_edges
 
+    def test_find_subtree_edges(self):
+        node_map = {x.id: x for x in self.nodes}
+        all_edges = find_subtree_edges(self.nodes[0], node_map.get)
+        assert all_edges == [["N1", "N2"], ["N2", "N4"], ["N1", "N3"]]
+
+    def test_find_subtree_info(self):
+        node_map = {x.id: x for x in self.nodes}
+        subtree_info = find_subtree_info(self.nodes[0], node_map.get)
+        assert subtree_info == {"nodes": {"N1": 3, "N2": 1, "N3": 0, "N4": 1},
+                                "edges": [["N1", "N2"], ["N2", "N4"], ["N1", "N3"]]}
+        subtree_info = find_subtree_info(self.nodes[0], node_map.get, 1)
+        assert subtree_info == {"nodes": {"N1": 3, "N2": 1, "N3": 0}, "edges": [["N1", "N2"], ["N1", "N3"]]}
+        assert find_subtree_info(self.nodes[1], node_map.get, 0) == {"nodes": {"N2": 1}, "edges": []}
+
+    def test_find_tree_position(self):
+        trees = [Tree(x, [], x) for x in [1, 3, 4, 8]]
+        assert [find_tree_position(trees, x) for x in [0, 1, 2, 4, 8, 9]] == [0, 1, 1, 3, 4, 4]
+
+    def test_find_descendants(self):
+        node_map = {x.id: x for x in self.nodes}
+        all_node_ids = [x.id for x in find_descendants(self.nodes[0], node_map.get)]
+        assert all_node_ids == [2, 4, 3]
+
     def test_find_node_in_pool(self):
         index, node = find_node_in_pool(2, self.nodes)
         assert index == 1
@@ -33,20 +60,50 @@ class TestHelper(unittest.TestCase):
         all_node_ids = [x.id for x in all_nodes]
         assert all_node_ids == [2, 4, 3]
 
-    def test_get_max_index(self):
-        assert get_max_index([2, 4, 5, 1]) == 2
-        assert get_max_index([2, 4, 4, 1]) == 1
-
-    def test_sort_by_key(self):
-        sort_by_key(self.nodes, "capacity", False)
-        assert self.nodes[0].id == 3
-        assert self.nodes[-1].id == 1
+    def test_no_numpy(self):
+        ''' The network starts without importing numpy '''
 
-    def test_check_capacity(self):
-        assert get_total_remaining_capacity(self.nodes) == 1
-
-    def test_get_possible_nodes(self):
-        assert len(get_possible_nodes(self.nodes)) == 1
+        code = "import sys, network.crud, network.api.v1; assert 'numpy' not in sys.modules"
+        subprocess.run([sys.executable, "-c", code], check=True, env=dict(os.environ, PROJECT_NAME="test"))
 
     def test_get_max_depth(self):
         assert get_max_depth(self.nodes) == 2
+
+    def test_update_subtree(self):
+        node_map = {x.id: x for x in self.nodes}
+        update_subtree(self.nodes[0], node_map.get)
+        assert [x.height for x in self.nodes] == [2, 1, 0, 0]
+        assert [x.free_depth for x in self.nodes] == [0, -1, -1, -1]
+        assert [x.free_node for x in self.nodes] == [1, 0, 0, 0]
+
+        # only the changed node and its ancestors are computed again
+        self.nodes[3].remaining = 1
+        mark_stale(self.nodes[3], node_map.get)
+        assert [x.height for x in self.nodes] == [-1, -1, 0, -1]
+        update_subtree(self.nodes[0], node_map.get)
+        assert [x.height for x in self.nodes] == [2, 1, 0, 0]
+        assert [x.free_depth for x in self.nodes] == [0, 1, -1, 0]
+        assert [x.free_node for x in self.nodes] == [1, 4, 0, 4]
+
+        # the shallowest free node, then the one with the most remaining capacity
+        self.nodes[0].remaining = 0
+        self.nodes[2].remaining = 1
+        mark_stale(self.nodes[2], node_map.get)
+        update_subtree(self.nodes[0], node_map.get)
+        assert self.nodes[0].free_node == 3
+        self.nodes[1].remaining = 2
+        mark_stale(self.nodes[1], node_map.get)
+        update_subtree(self.nodes[0], node_map.get)
+        assert (self.nodes[0].free_depth, self.nodes[0].free_node) == (1, 2)
+
+    def test_find_free_slots(self):
+        node_map = {x.id: x for x in self.nodes}
+        self.nodes[3].remaining = 1
+        update_subtree(self.nodes[0], node_map.get)
+        assert find_free_slots(self.nodes[0], node_map.get, 3) == [(0, 1), (2, 4)]
+        assert find_free_slots(self.nodes[1], node_map.get, 3) == [(1, 4)]
+        assert find_free_slots(self.nodes[2], node_map.get, 3) == []
+
+    def test_dump_json(self):
+        value = [{"nodes": {"N1": 1, "Né": 0}, "edges": [["N1", "N/2"]]}, {"success": True, "detail": None}]
+        assert dump_json(value) == json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
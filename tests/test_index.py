@@ -0,0 +1,201 @@
+import unittest
+from network.crud import P2PNetwork
+from network.index import CapacityIndex, ForestIndex, PlacementIndex, TreeList
+from network.models import Node, Tree
+
+
+class TestTreeList(unittest.TestCase):
+    '''
+    A class for testing the list of the trees
+    '''
+
+    def setUp(self):
+        self.trees = TreeList(Tree(x, [x], x) for x in range(1, 31))
+
+    def test_pop(self):
+        # the removed trees are left as tombstones, and no other tree moves
+        for tree_id in range(2, 31, 2):
+            index, tree = self.trees.find(tree_id)
+            assert self.trees.pop(index) is tree
+        assert len(self.trees) == 15
+        assert len(self.trees.items) == 30
+        assert self.trees.find(2) == (-1, None)
+        assert self.trees.find(29)[0] == 28
+        assert [x.id for x in self.trees] == list(range(1, 31, 2))
+
+        # indexing drops the tombstones first
+        assert self.trees[1].id == 3
+        assert len(self.trees.items) == 15
+        assert self.trees.find(29)[0] == 14
+
+    def test_compact(self):
+        for tree_id in range(1, 26):
+            self.trees.pop(self.trees.find(tree_id)[0])
+        assert len(self.trees.items) < 2 * len(self.trees) + 8
+        assert [x.id for x in self.trees] == list(range(26, 31))
+
+        self.trees.append(Tree(31, [31], 31))
+        assert self.trees.find(31)[1].id == 31
+
+    def test_page(self):
+        for tree_id in [3, 4, 5, 10]:
+            self.trees.pop(self.trees.find(tree_id)[0])
+        trees, more = self.trees.page(0, 3)
+        assert [x.id for x in trees] == [1, 2, 6] and more
+        trees, more = self.trees.page(2, 4)
+        assert [x.id for x in trees] == [6, 7, 8, 9] and more
+        trees, more = self.trees.page(27, 5)
+        assert [x.id for x in trees] == [28, 29, 30] and not more
+        assert self.trees.page(30, 5) == ([], False)
+
+
+class TestCapacityIndex(unittest.TestCase):
+    '''
+    A class for testing the capacity index
+    '''
+
+    def setUp(self):
+        self.index = CapacityIndex()
+        self.nodes = [
+            Node(1, 1, 0, [], 0, 1, 1),
+            Node(2, 2, 0, [], 0, 2, 2),
+            Node(3, 2, 0, [], 0, 3, 2),
+            Node(4, 0, 0, [], 0, 4, 0)
+        ]
+        for node in self.nodes:
+            self.index.add(node)
+
+    def test_best(self):
+        assert len(self.index) == 4
+        assert self.index.best().id == 2
+
+    def test_empty(self):
+        assert CapacityIndex().best() is None
+
+    def test_update(self):
+        self.nodes[1].remaining = 0
+        self.index.update(self.nodes[1], 2)
+        assert self.index.best().id == 3
+
+        self.nodes[1].remaining = 2
+        self.index.update(self.nodes[1], 0)
+        assert self.index.best().id == 2
+
+    def test_remove(self):
+        self.index.remove(self.nodes[1])
+        self.index.remove(self.nodes[2])
+        assert len(self.index) == 2
+        assert self.index.best().id == 1
+
+        self.index.remove(self.nodes[0])
+        assert self.index.best().id == 4
+
+
+class TestForestIndex(unittest.TestCase):
+    '''
+    A class for testing the forest index
+    '''
+
+    def setUp(self):
+        self.network = P2PNetwork()
+        for capacity in [0, 1, 0, 0, 1, 0]:
+            self.network.join(capacity)
+        self.index = ForestIndex()
+        self.index.rebuild(self.network.trees)
+
+    def find_tree(self, tree_id: int):
+        return self.network.find_tree(tree_id)[1]
+
+    def test_smallest(self):
+        # the trees of N1, N2 with N3, and N4, N5 with N6
+        assert [len(x.node_ids) for x in self.network.trees] == [1, 2, 1, 2]
+        assert self.index.smallest(self.find_tree).id == 3
+        assert self.index.smallest(self.find_tree, 3).id == 1
+        assert self.index.smallest(self.find_tree, 3).id == 1
+        assert ForestIndex().smallest(self.find_tree) is None
+
+    def test_touch(self):
+        self.network = P2PNetwork()
+        for capacity in [1, 0, 0]:
+            self.network.join(capacity)
+        self.index.rebuild(self.network.trees)
+        assert self.index.smallest(self.find_tree).id == 2
+
+        self.network.leave(2)
+        self.index.touch(1)
+        assert self.index.smallest(self.find_tree).id == 2
+
+        # the tree of N1 gets back to its size, so its stale entry is valid again, with a copy
+        self.network.join(0)
+        self.index.touch(1)
+        assert self.index.smallest(self.find_tree, 2).id == 1
+
+        self.network.leave(3)
+        self.index.touch(2)
+        assert self.index.smallest(self.find_tree, 1) is None
+
+    def test_churn(self):
+        # the index is not built without the consolidation
+        network = P2PNetwork()
+        for _ in range(2000):
+            network.leave(network.join(0))
+        assert not network.forest_index.active
+        assert len(network.forest_index.changed) == 0
+
+        network = P2PNetwork(consolidation=1)
+        network.join(0)
+        for _ in range(2000):
+            network.leave(network.join(0))
+        assert len(network.forest_index.changed) <= len(network.trees)
+        assert len(network.forest_index.entries) <= len(network.trees)
+
+
+class TestPlacementIndex(unittest.TestCase):
+    '''
+    A class for testing the placement index
+    '''
+
+    def setUp(self):
+        self.network = P2PNetwork()
+        for capacity in [1, 3, 0, 0, 0, 0]:
+            self.network.join(capacity)
+        self.index = PlacementIndex()
+        self.index.rebuild(self.network.trees)
+
+    def best(self) -> Node:
+        return self.index.best(lambda x: self.network.find_tree(x)[1], self.network.get_node)
+
+    def test_best(self):
+        # N1 has N2, which has N3, N4 and N5, and N6 is alone
+        assert len(self.network.trees) == 2
+        assert self.best() is None
+
+    def test_touch(self):
+        self.network.leave(5)
+        self.index.touch(1)
+        assert self.best().id == 2
+
+        # N7 takes the slot of N2, and is the only one with a remaining capacity
+        self.network.join(2)
+        self.index.touch(1)
+        assert self.best().id == 7
+
+        self.network.leave(7)
+        self.index.touch(1)
+        assert self.best().id == 2
+
+    def test_best_fit_churn(self):
+        # the index is not built while the joins take the best fitting node
+        network = P2PNetwork()
+        for _ in range(2000):
+            network.leave(network.join(0))
+        assert not network.placement_index.active
+        assert len(network.placement_index.changed) == 0
+
+        # once it is built, the removed trees are dropped from it
+        network.join(1, "shallowest")
+        for _ in range(2000):
+            network.leave(network.join(0))
+            network.leave(network.join(0, "shallowest"))
+        assert len(network.placement_index.changed) <= len(network.trees)
+        assert len(network.placement_index.entries) <= len(network.trees)
@@ -0,0 +1,81 @@
+import unittest
+from fastapi.testclient import TestClient
+from app.main import get_application, route_application
+from network.api import v1
+from network.crud import P2PNetwork
+from network.engine import NetworkEngine
+from network.metrics import Histogram, Metrics, render_gauges
+
+app = get_application()
+route_application(app)
+
+client = TestClient(app)
+
+
+class TestMetrics(unittest.TestCase):
+    '''
+    A class for testing the instrumentation of the network
+    '''
+
+    def test_histogram(self):
+        histogram = Histogram([1, 10])
+        for value in [0.5, 1, 5, 50]:
+            histogram.observe(value)
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.render("size") == ['size_bucket{le="1"} 2', 'size_bucket{le="10"} 3',
+                                            'size_bucket{le="+Inf"} 4', "size_sum 56.5", "size_count 4"]
+
+    def test_network(self):
+        metrics = Metrics(2)
+        network = P2PNetwork(metrics=metrics)
+        network.apply([{"join": {"capacity": x}} for x in [1, 0, 2, 0, 0]])
+        network.apply([{"leave": {"id": 1}}, {"leave": {"id": 9}}, {"leave": {"id": 2}}])
+        network.info_json()
+
+        assert metrics.operations["join"] == 5
+        assert metrics.operations["leave"] == 2
+        assert metrics.operations["info"] == 1
+        # one of every two operations is timed
+        assert metrics.latencies["join"].count == 2
+        assert sum(x.count for x in metrics.latencies.values()) > 0
+        assert metrics.counters["failed_leaves"] == 1
+        assert metrics.counters["trees_created"] == 2
+        assert metrics.counters["trees_removed"] == 1
+        assert metrics.subtrees.count == 1
+        # the only subtree keeps the tree, so no node is moved
+        assert metrics.moved_nodes.sum == 0
+        assert metrics.counters["nodes_reparented"] == 1
+
+        # the topology is the same without the metrics
+        other = P2PNetwork()
+        other.apply([{"join": {"capacity": x}} for x in [1, 0, 2, 0, 0]])
+        other.apply([{"leave": {"id": 1}}, {"leave": {"id": 9}}, {"leave": {"id": 2}}])
+        assert other.info() == network.info()
+
+    def test_max_height(self):
+        network = P2PNetwork()
+        network.apply([{"join": {"capacity": x % 3}} for x in range(30)])
+        assert "p2p_max_height 19" in render_gauges(network)
+
+        # only the changed trees are counted again, and the removed ones are dropped
+        network.apply([{"leave": {"id": x}} for x in range(1, 30, 2)] + [{"join": {"capacity": 0}}] * 5)
+        assert network.get_max_height() == max(network.get_height(x) for x in network.trees)
+        assert len(network.height_index.changed) == 0
+        assert len(network.height_index.entries) == len(network.trees)
+
+    def test_endpoint(self):
+        v1.engine = NetworkEngine(P2PNetwork(metrics=Metrics()))
+        client.post("/network/batch", json={"operations": [{"join": {"capacity": 1}}, {"join": {"capacity": 0}}]})
+        response = client.get("/network/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert 'p2p_operations_total{operation="join"} 2\n' in response.text
+        assert 'p2p_operation_seconds_bucket{operation="join",le="+Inf"} 2\n' in response.text
+        assert "p2p_nodes 2\n" in response.text
+        assert "p2p_max_height 1\n" in response.text
+
+        # only the gauges without the metrics
+        v1.engine = NetworkEngine(P2PNetwork())
+        response = client.get("/network/metrics")
+        assert response.text.startswith("# HELP p2p_nodes")
+        assert "p2p_trees 0\n" in response.text
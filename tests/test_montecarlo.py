@@ -0,0 +1,35 @@
+import unittest
+from network.montecarlo import aggregate, get_percentile, run_monte_carlo, run_simulation
+
+
+class TestMonteCarlo(unittest.TestCase):
+    '''
+    A class for testing the Monte-Carlo runner
+    '''
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert get_percentile(values, 50) == 50
+        assert get_percentile(values, 99) == 99
+        assert get_percentile([3], 99) == 3
+        assert get_percentile([], 50) == 0
+
+    def test_run(self):
+        result = run_simulation(("steady", 50, 100, [1, 1, 1, 1], 7))
+        assert result["seed"] == 7
+        assert result["failed_leaves"] == 0
+        assert sum(result["tree_heights"].values()) == result["trees"]
+        assert result == run_simulation(("steady", 50, 100, [1, 1, 1, 1], 7))
+
+    def test_workers(self):
+        ''' The same seeds give the same aggregates with any number of workers '''
+
+        streamed = []
+        serial = run_monte_carlo("steady", 40, 80, "skewed", runs=8, seed=3, workers=1)
+        parallel = run_monte_carlo("steady", 40, 80, "skewed", runs=8, seed=3, workers=3,
+                                   callback=streamed.append)
+        assert serial == parallel
+        assert sorted(x["seed"] for x in streamed) == list(range(3, 11))
+        assert parallel == aggregate(streamed[::-1])
+        assert parallel["runs"] == 8
+        assert sum(parallel["histograms"]["trees"].values()) == 8
@@ -0,0 +1,107 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from network.crud import P2PNetwork
+from network.engine import NetworkEngine
+from network.persistence import NetworkStore, read_log, read_snapshot, replay, write_snapshot
+
+
+class TestPersistence(unittest.TestCase):
+    '''
+    A class for testing the log and the snapshots of the network
+    '''
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.operations = [{"join": {"capacity": x % 4}} for x in range(40)]
+        self.operations += [{"leave": {"id": x}} for x in [40, 6, 99, 38]]
+        self.operations += [{"join": {"capacity": 2}} for _ in range(5)]
+        self.operations += [{"join": {"capacity": x % 4, "placement": "shallowest"}} for x in range(5)]
+        self.operations += [{"join": {"capacity": 1, "placement": "best-fit"}}]
+        self.operations += [{"rebalance": {"tree": 1, "moves": 4}}, {"rebalance": {"tree": 999, "moves": 4}}]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_network(self) -> P2PNetwork:
+        network = P2PNetwork()
+        network.apply(self.operations)
+        return network
+
+    def test_snapshot(self):
+        network = self.get_network()
+        path = os.path.join(self.directory.name, "snapshot.bin")
+        write_snapshot(network, path, 3)
+
+        restored, generation = read_snapshot(path)
+        assert generation == 3
+        assert restored.info() == network.info()
+        assert restored.max_node_id == network.max_node_id
+
+        compact_network, _ = read_snapshot(path, P2PNetwork("arrays"))
+        assert compact_network.info() == network.info()
+
+        # the restored network goes on in the same way
+        more_operations = [{"join": {"capacity": 1}}, {"leave": {"id": 2}}, {"join": {"capacity": 0}},
+                           {"join": {"capacity": 0, "placement": "shallowest"}}]
+        assert restored.apply(more_operations) == network.apply(more_operations)
+        assert restored.info() == network.info()
+
+    def test_recover(self):
+        store = NetworkStore(self.directory.name, snapshot_interval=15)
+        engine = NetworkEngine(store.recover(), store)
+        for operation in self.operations:
+            engine.submit([operation]).result(timeout=5)
+        store.close()
+        assert store.generation > 0
+
+        recovered = NetworkStore(self.directory.name).recover()
+        assert recovered.info() == engine.network.info()
+
+    def test_incomplete_record(self):
+        store = NetworkStore(self.directory.name)
+        network = store.recover()
+        for operation in self.operations:
+            store.append(operation)
+        store.commit()
+        store.close()
+        replay(network, iter(self.operations))
+
+        # a crash in the middle of a record
+        with open(store.get_log_path(0), "ab") as f:
+            f.write(b"\x01\x02")
+
+        store = NetworkStore(self.directory.name)
+        assert store.recover().info() == network.info()
+        assert store.logged_operations == len(self.operations)
+        assert store.failed_operations == 0
+        store.close()
+        assert list(read_log(store.get_log_path(0))) == self.operations
+
+    def test_failed_replay(self):
+        # a join with a capacity out of range fails in the writer, and again in the replay
+        operations = [{"join": {"capacity": 1}}, {"join": {"capacity": 9}}, {"join": {"capacity": 1}},
+                      {"join": {"capacity": 2}}, {"join": {"capacity": 0}}]
+        expected = P2PNetwork("arrays")
+        expected.apply([x for x in operations if x["join"]["capacity"] != 9])
+        network = P2PNetwork("arrays")
+        with self.assertLogs("network.persistence", "ERROR"):
+            assert replay(network, iter(operations)) == (5, 1)
+        assert network.info() == expected.info()
+        assert [x.id for x in network.nodes] == [x.id for x in expected.nodes]
+        assert [x.parent_id for x in network.nodes] == [x.parent_id for x in expected.nodes]
+        assert network.max_tree_id == expected.max_tree_id
+
+        store = NetworkStore(self.directory.name)
+        store.recover()
+        for operation in operations:
+            store.append(operation)
+        store.close()
+
+        store = NetworkStore(self.directory.name)
+        with self.assertLogs("network.persistence", "ERROR"):
+            network = store.recover(P2PNetwork("arrays"))
+        assert store.failed_operations == 1
+        assert network.info() == expected.info()
+        assert [x.id for x in network.trees] == [x.id for x in expected.trees]
+        store.close()
@@ -0,0 +1,73 @@
+import unittest
+from network.crud import P2PNetwork
+from network.rebalance import Rebalancer, get_minimum_height
+from network.workloads import WORKLOADS
+
+
+class TestRebalance(unittest.TestCase):
+    '''
+    A class for testing the rebalancer
+    '''
+
+    def setUp(self):
+        self.operations = [x[1] for x in WORKLOADS["steady"](200, 500, 2)]
+        self.network = P2PNetwork()
+        self.network.apply(self.operations)
+
+    def rebalance(self, network: P2PNetwork, rebalancer: Rebalancer) -> list:
+        ''' Send the ticks until no tree is left to rebalance, returns their results '''
+
+        results = []
+        while True:
+            tree_id = rebalancer.find_tree(network)
+            if tree_id == 0:
+                return results
+            results.extend(network.apply([{"rebalance": {"tree": tree_id, "moves": rebalancer.moves}}]))
+            rebalancer.record(results[-1])
+
+    def test_minimum_height(self):
+        assert get_minimum_height([0, 0, 0, 0]) == 0
+        assert get_minimum_height([1, 0, 0, 0]) == 0
+        assert get_minimum_height([3, 0, 0, 1]) == 1
+        assert get_minimum_height([3, 6, 0, 1]) == 3
+        assert get_minimum_height([2, 1, 1, 0]) == 2
+
+    def test_rebalance(self):
+        heights = {x.id: self.network.get_height(x) for x in self.network.trees}
+        events = []
+        self.network.listeners.append(events.append)
+        rebalancer = Rebalancer(moves=8)
+        results = self.rebalance(self.network, rebalancer)
+
+        # a swap moves two nodes
+        stats = rebalancer.stats()
+        assert stats["ticks"] == len(results)
+        assert stats["moves"] == sum(x["lifts"] + x["swaps"] for x in results)
+        assert len([x for x in events if x["type"] == "move"]) == sum(x["lifts"] + 2 * x["swaps"] for x in results)
+        assert stats["height_reduction"] > 0
+        for tree in self.network.trees:
+            height = self.network.get_height(tree)
+            assert get_minimum_height(tree.capacities) <= height <= heights[tree.id]
+            assert height - get_minimum_height(tree.capacities) < rebalancer.slack or tree.id in rebalancer.settled
+            for node in map(self.network.get_node, tree.node_ids):
+                assert node.remaining == node.capacity - len(node.child_ids)
+                assert all(self.network.get_node(x).parent_id == node.id for x in node.child_ids)
+
+        # the ticks make the same moves when they are replayed
+        network = P2PNetwork("arrays")
+        network.apply(self.operations + [{"rebalance": {"tree": x["tree"], "moves": 8}} for x in results])
+        assert network.info() == self.network.info()
+
+        # a settled tree is skipped until it changes
+        assert rebalancer.find_tree(self.network) == 0
+        assert "rebalance" in " ".join(rebalancer.render())
+
+    def test_missing_tree(self):
+        result = self.network.apply([{"rebalance": {"tree": 999, "moves": 8}}])[0]
+        assert result == {"action": "rebalance", "tree": 999, "success": False, "detail": "Tree not found"}
+
+        rebalancer = Rebalancer()
+        rebalancer.tree_id = 999
+        rebalancer.record(result)
+        assert rebalancer.tree_id == 0
+        assert rebalancer.stats()["ticks"] == 0
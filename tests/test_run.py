@@ -105,6 +105,70 @@ class TestP2PNetwork(unittest.TestCase):
         self.network.add_tree(new_tree)
         assert len(self.network.trees) == 1
 
+    def test_tree_stats(self):
+        for capacity in [2, 1, 0, 3, 0]:
+            self.network.join(capacity)
+        _, tree = self.network.find_tree(1)
+        assert (tree.remaining, tree.attachable) == (2, 1)
+
+        # N3 is attached under N4, which is left with one slot under N2
+        self.network.leave(1)
+        assert self.network.get_tree_stats(tree) == {
+            "tree": 1, "root": "N2", "size": 4, "remaining": 1, "attachable": 1, "height": 2, "free_depth": 1}
+
+        self.network.leave(4)
+        assert [self.network.get_tree_stats(x)["remaining"] for x in self.network.trees] == \
+            [sum(self.network.get_node(y).remaining for y in x.node_ids) for x in self.network.trees]
+
+    def test_join_shallowest(self):
+        for capacity in [1, 3, 0, 3]:
+            self.network.join(capacity)
+
+        # N2 is left with one slot at the depth of 1, and N4 with three at the depth of 2
+        assert self.network.get_node(self.network.join(0)).parent_id == 4
+        assert self.network.get_node(self.network.join(0, "shallowest")).parent_id == 2
+        assert self.network.get_node(self.network.join(0, "shallowest")).parent_id == 4
+        with self.assertRaises(ValueError):
+            self.network.join(0, "deepest")
+
+        network = P2PNetwork(placement="shallowest")
+        network.apply([{"join": {"capacity": x}} for x in [1, 3, 0, 3, 0]] + [{"join": {"capacity": 0, "placement": "best-fit"}}])
+        assert network.get_path(5) == ["N5", "N2", "N1"]
+        assert network.get_path(6) == ["N6", "N4", "N2", "N1"]
+
+    def test_consolidate(self):
+        network = P2PNetwork(consolidation=4)
+        for capacity in [0, 0, 0, 2]:
+            network.join(capacity)
+
+        # the newest trees go first under N4, which takes the identifier of the older tree of the same size
+        assert [x.id for x in network.trees] == [1, 3]
+        assert network.get_path(2) == ["N2", "N4"]
+        assert network.get_path(3) == ["N3", "N4"]
+        assert network.find_tree(3)[1].remaining == 0
+
+        network.leave(4)
+        assert len(network.trees) == 3
+        network.join(3)
+        assert [x.id for x in network.trees] == [5]
+        assert network.info() == [{"nodes": {"N1": 0, "N2": 0, "N3": 0, "N5": 3},
+                                   "edges": [["N5", "N1"], ["N5", "N2"], ["N5", "N3"]]}]
+        assert P2PNetwork().consolidate(1) == 0
+
+    def test_invalid_capacity(self):
+        for capacity in [1, 0]:
+            self.network.join(capacity)
+        info = self.network.info()
+
+        # a rejected join changes nothing, and the next one takes the next identifier
+        for capacity in [4, -1]:
+            with self.assertRaises(ValueError):
+                self.network.join(capacity)
+        assert self.network.max_node_id == 2 and self.network.max_tree_id == 1
+        assert [x.id for x in self.network.nodes] == [1, 2]
+        assert self.network.info() == info
+        assert self.network.join(1) == 3
+
     def test_find_tree(self):
         tree_index, tree = self.network.find_tree(1)
         assert tree_index == -1
@@ -115,6 +179,55 @@ class TestP2PNetwork(unittest.TestCase):
         assert node_index == -1
         assert node is None
 
+    def test_find_after_leave(self):
+        for capacity in [3, 0, 0, 1, 0]:
+            self.network.join(capacity)
+
+        assert self.network.leave(2)
+        assert self.network.leave(5)
+        assert len(self.network.nodes) == 3
+
+        for node_id in [1, 3, 4]:
+            node_index, node = self.network.find_node(node_id)
+            assert self.network.nodes[node_index] is node
+            assert node.id == node_id
+
+        assert self.network.find_node(2) == (-1, None)
+        tree_index, tree = self.network.find_tree(1)
+        assert self.network.trees[tree_index] is tree
+
+    def test_deep_chain(self):
+        ''' Test a chain of nodes deeper than the recursion limit '''
+
+        for _ in range(3000):
+            self.network.join(1)
+
+        all_edges = self.network.get_all_edges(self.network.trees[0])
+        assert len(all_edges) == 2999
+        assert all_edges[-1] == ["N2999", "N3000"]
+
+        assert self.network.leave(2)
+        all_edges = self.network.get_all_edges(self.network.trees[0])
+        assert len(all_edges) == 2998
+
+    def test_info_cache(self):
+        ''' Test that only the changed trees are rendered again '''
+
+        for capacity in [1, 0, 1, 0]:
+            self.network.join(capacity)
+
+        first_info = self.network.info()
+        assert len(first_info) == 2
+        assert json.loads(self.network.info_json()) == first_info
+        assert self.network.info_json() is self.network.info_json()
+
+        self.network.leave(4)
+        second_info = self.network.info()
+        assert second_info[0] is first_info[0]
+        assert second_info[1] is not first_info[1]
+        assert second_info[1] == {"nodes": {"N3": 1}, "edges": []}
+        assert json.loads(self.network.info_json()) == second_info
+
     def test_get_all_nodes(self):
         self.network.join(1)
         all_nodes = self.network.get_all_nodes([1])
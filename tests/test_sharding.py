@@ -0,0 +1,104 @@
+import asyncio
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+from app.main import get_application, route_application
+from network.api import tenants
+from network.crud import P2PNetwork
+from network.sharding import HashRing, ShardedRegistry
+
+app = get_application()
+route_application(app)
+
+client = TestClient(app)
+
+
+class TestHashRing(unittest.TestCase):
+    '''
+    A class for testing the consistent hashing of the networks
+    '''
+
+    def test_balance(self):
+        ring = HashRing(4)
+        shards = [ring.get_shard(f"swarm-{x}") for x in range(4000)]
+        assert all(600 < shards.count(x) < 1400 for x in range(4))
+        assert shards == [HashRing(4).get_shard(f"swarm-{x}") for x in range(4000)]
+
+    def test_consistency(self):
+        ''' A new shard only takes networks, from every other shard '''
+
+        old_ring, new_ring = HashRing(4), HashRing(5)
+        moved = 0
+        for x in range(4000):
+            old_shard, new_shard = old_ring.get_shard(f"swarm-{x}"), new_ring.get_shard(f"swarm-{x}")
+            if old_shard != new_shard:
+                assert new_shard == 4
+                moved += 1
+        assert 400 < moved < 1400
+
+
+class TestShardedRegistry(unittest.TestCase):
+    '''
+    A class for testing the networks sharded across processes
+    '''
+
+    def setUp(self):
+        self.registry = ShardedRegistry(2)
+
+    def tearDown(self):
+        self.registry.close()
+
+    def test_calls(self):
+        operations = [{"join": {"capacity": x % 4}} for x in range(30)] + [{"leave": {"id": 2}}]
+        expected = P2PNetwork()
+        expected.apply(operations)
+
+        async def run():
+            network_ids = [f"swarm-{x}" for x in range(8)]
+            assert all(await asyncio.gather(*[self.registry.call("create", x) for x in network_ids]))
+            assert not await self.registry.call("create", "swarm-0")
+            await asyncio.gather(*[self.registry.call("apply", x, operations) for x in network_ids])
+
+            for network_id in network_ids:
+                assert await self.registry.call("status", network_id) == expected.info_json()
+            assert await self.registry.call("status", "swarm-9") is None
+            with self.assertRaises(ValueError):
+                await self.registry.call("create", "a/b")
+
+            networks = await self.registry.call("list")
+            assert [x["id"] for x in networks] == sorted(network_ids)
+            assert all(x["nodes"] == 29 for x in networks)
+
+            stats = await self.registry.call("stats")
+            assert stats["networks"] == 8
+            assert stats["shards"] == 2
+
+        asyncio.run(run())
+        assert len({x.process.pid for x in self.registry.shards}) == 2
+
+    def test_api(self):
+        tenants.registry = self.registry
+        assert client.post("/networks", json={"id": "swarm-1"}).status_code == 201
+        assert client.post("/networks/swarm-1/join", json={"capacity": 1}).json() == {"id": 1}
+        assert client.get("/networks/swarm-1/status").json() == [{"nodes": {"N1": 1}, "edges": []}]
+        assert client.get("/networks/registry").json()["shards"] == 2
+        assert client.delete("/networks/swarm-1").status_code == 200
+        assert client.get("/networks").json() == []
+
+    def test_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.registry = ShardedRegistry(2, directory=directory)
+            network_ids = [f"swarm-{x}" for x in range(4)]
+
+            async def create():
+                for network_id in network_ids:
+                    await self.registry.call("create", network_id)
+                    await self.registry.call("apply", network_id, [{"join": {"capacity": 1}}])
+                assert await self.registry.call("evict_idle") == 0
+
+            asyncio.run(create())
+            # the shards write their loaded networks when they are stopped
+            self.registry.close()
+            self.registry = ShardedRegistry(2, directory=directory)
+            networks = asyncio.run(self.registry.call("list"))
+            assert [(x["id"], x["nodes"], x["loaded"]) for x in networks] == [(x, 1, False) for x in network_ids]
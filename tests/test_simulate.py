@@ -0,0 +1,88 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from network.crud import P2PNetwork
+from network.persistence import NetworkStore, encode_operation
+from network.simulate import Simulation, read_trace
+
+CASE_PATH = os.path.join(os.path.dirname(__file__), "cases", "1.json")
+
+
+class TestSimulate(unittest.TestCase):
+    '''
+    A class for testing the offline simulator
+    '''
+
+    def setUp(self):
+        with open(CASE_PATH) as f:
+            self.case = json.load(f)
+
+    def simulate(self, path: str) -> Simulation:
+        simulation = Simulation()
+        for operation in read_trace(path):
+            simulation.apply(operation)
+        return simulation
+
+    def test_formats(self):
+        with TemporaryDirectory() as directory:
+            jsonl_path = os.path.join(directory, "trace.jsonl")
+            with open(jsonl_path, "w") as f:
+                for operation in self.case["case"]:
+                    f.write(json.dumps(operation) + "\n\n")
+
+            binary_path = os.path.join(directory, "trace.log")
+            with open(binary_path, "wb") as f:
+                for operation in self.case["case"]:
+                    f.write(encode_operation(operation))
+
+            for path in [CASE_PATH, jsonl_path, binary_path]:
+                simulation = self.simulate(path)
+                assert simulation.network.info() == self.case["result"]
+                assert simulation.operations == len(self.case["case"])
+
+    def test_summary(self):
+        simulation = Simulation()
+        for operation in [{"join": {"capacity": 1}}, {"join": {"capacity": 0}}, {"join": {"capacity": 5}},
+                          {"join": {"capacity": 0}}, {"leave": {"id": 9}}]:
+            simulation.apply(operation)
+
+        summary = simulation.summary()
+        assert summary["joins"] == 3
+        assert summary["failed_joins"] == 1
+        assert summary["failed_leaves"] == 1
+        assert summary["trees"] == 2
+        assert summary["largest_tree"] == 2
+        assert summary["max_height"] == 1
+
+    def test_replay_log(self):
+        # a log with shallowest joins and ticks of the rebalancer replays to the same topology
+        operations = [{"join": {"capacity": x % 3}} for x in range(40)]
+        operations += [{"join": {"capacity": 2, "placement": "shallowest"}} for _ in range(5)]
+        operations += [{"leave": {"id": x}} for x in [2, 5, 9]]
+        operations += [{"rebalance": {"tree": 1, "moves": 8}}, {"rebalance": {"tree": 99, "moves": 8}}]
+        operations += [{"join": {"capacity": 0}}]
+        network = P2PNetwork(consolidation=1)
+        network.apply(operations)
+
+        with TemporaryDirectory() as directory:
+            store = NetworkStore(directory)
+            store.recover()
+            for operation in operations:
+                store.append(operation)
+            store.close()
+
+            simulation = Simulation(P2PNetwork(consolidation=1))
+            for operation in read_trace(store.get_log_path(0)):
+                simulation.apply(operation)
+
+        assert simulation.network.info() == network.info()
+        summary = simulation.summary()
+        assert summary["joins"] == 46
+        assert summary["leaves"] == 3
+        assert summary["rebalances"] == 1
+        assert summary["failed_rebalances"] == 1
+        assert simulation.operations == len(operations)
+
+        with self.assertRaises(ValueError):
+            simulation.apply({"unknown": {}})
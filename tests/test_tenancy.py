@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+from app.main import get_application, route_application
+from network.api import tenants
+from network.crud import P2PNetwork
+from network.tenancy import NETWORK_BYTES, NODE_BYTES, NetworkRegistry
+
+app = get_application()
+route_application(app)
+
+client = TestClient(app)
+
+OPERATIONS = [{"join": {"capacity": x % 4}} for x in range(20)] + [{"leave": {"id": 1}}, {"leave": {"id": 7}}]
+
+
+class TestNetworkRegistry(unittest.TestCase):
+    '''
+    A class for testing the networks of the registry
+    '''
+
+    def test_isolation(self):
+        registry = NetworkRegistry()
+        assert registry.create("a")
+        assert registry.create("b")
+        assert not registry.create("a")
+        with self.assertRaises(ValueError):
+            registry.create("../a")
+
+        registry.apply("a", [{"join": {"capacity": 1}}, {"join": {"capacity": 0}}])
+        registry.apply("b", [{"join": {"capacity": 2}}])
+        assert registry.list() == [{"id": "a", "nodes": 2, "trees": 1, "loaded": True},
+                                   {"id": "b", "nodes": 1, "trees": 1, "loaded": True}]
+        assert registry.apply("c", [{"join": {"capacity": 1}}]) is None
+
+        assert registry.delete("a")
+        assert not registry.delete("a")
+        assert registry.memory == NETWORK_BYTES + NODE_BYTES["objects"]
+
+    def test_lazy_creation(self):
+        registry = NetworkRegistry()
+        registry.create("a")
+        assert registry.list() == [{"id": "a", "nodes": 0, "trees": 0, "loaded": False}]
+        assert registry.status("a") == b"[]"
+        assert registry.list()[0]["loaded"]
+
+    def test_settings(self):
+        # the networks take the placement and the consolidation of the default network
+        registry = NetworkRegistry(placement="shallowest", consolidation=2)
+        expected = P2PNetwork(placement="shallowest", consolidation=2)
+        expected.apply(OPERATIONS)
+        registry.create("a")
+        registry.apply("a", OPERATIONS)
+        assert registry.status("a") == expected.info_json()
+        assert registry.get_network("a").consolidation == 2
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for snapshot_directory in ["", directory]:
+                # the budget holds two of the networks
+                registry = NetworkRegistry(2 * (NETWORK_BYTES + 20 * NODE_BYTES["objects"]), snapshot_directory)
+                expected = P2PNetwork()
+                expected.apply(OPERATIONS)
+                for network_id in ["a", "b", "c"]:
+                    registry.create(network_id)
+                    registry.apply(network_id, OPERATIONS)
+
+                # the least recently used is evicted
+                assert [x["loaded"] for x in registry.list()] == [False, True, True]
+                assert registry.list()[0]["nodes"] == 18
+                assert registry.stats()["evictions"] == 1
+                if snapshot_directory != "":
+                    assert os.listdir(directory) == ["a.snapshot"]
+
+                # and loaded again, evicting the next one
+                assert registry.status("a") == expected.info_json()
+                assert [x["loaded"] for x in registry.list()] == [True, False, True]
+                registry.apply("a", [{"leave": {"id": 2}}])
+                expected.apply([{"leave": {"id": 2}}])
+                assert registry.status("a") == expected.info_json()
+
+                assert registry.delete("b")
+                if snapshot_directory != "":
+                    assert os.listdir(directory) == []
+
+    def test_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = NetworkRegistry(directory=directory)
+            expected = P2PNetwork()
+            expected.apply(OPERATIONS)
+            for network_id in ["a", "b"]:
+                registry.create(network_id)
+            registry.apply("a", OPERATIONS)
+            registry.close()
+            assert sorted(os.listdir(directory)) == ["a.snapshot", "b.snapshot"]
+            assert [x["loaded"] for x in registry.list()] == [False, False]
+
+            # a new registry finds the written networks, without loading them
+            registry = NetworkRegistry(directory=directory)
+            assert registry.list() == [{"id": "a", "nodes": 18, "trees": len(expected.trees), "loaded": False},
+                                       {"id": "b", "nodes": 0, "trees": 0, "loaded": False}]
+            assert registry.status("a") == expected.info_json()
+            assert registry.status("b") == b"[]"
+
+    def test_idle_eviction(self):
+        registry = NetworkRegistry(idle_seconds=60)
+        for network_id in ["a", "b", "c"]:
+            registry.create(network_id)
+            registry.apply(network_id, OPERATIONS)
+        assert registry.evict_idle() == 0
+
+        # the networks not used for the idle time are evicted, the least recently used first
+        registry.tenants["a"].used_at -= 120
+        registry.tenants["b"].used_at -= 90
+        registry.apply("c", [{"leave": {"id": 2}}])
+        assert [x["loaded"] for x in registry.list()] == [False, False, True]
+        assert registry.stats()["evictions"] == 2
+
+        registry.tenants["c"].used_at -= 120
+        assert registry.evict_idle() == 1
+        assert registry.memory == 0
+        assert registry.status("a") is not None
+
+
+class TestTenantAPI(unittest.TestCase):
+    '''
+    A class for testing the API of the networks
+    '''
+
+    def setUp(self):
+        tenants.registry = NetworkRegistry()
+
+    def test_networks(self):
+        assert client.post("/networks", json={"id": "swarm-1"}).status_code == 201
+        assert client.post("/networks", json={"id": "swarm-1"}).status_code == 409
+        assert client.post("/networks", json={"id": "a/b"}).status_code == 422
+        assert client.post("/networks", json={"id": "swarm-2"}).status_code == 201
+
+        response = client.post("/networks/swarm-1/join", json={"capacity": 1})
+        assert response.json() == {"id": 1}
+        client.post("/networks/swarm-1/join", json={"capacity": 0})
+        client.post("/networks/swarm-2/batch", json={"operations": [{"join": {"capacity": 3}}]})
+
+        response = client.get("/networks/swarm-1/status")
+        assert response.json() == [{"nodes": {"N1": 1, "N2": 0}, "edges": [["N1", "N2"]]}]
+        assert client.post("/networks/swarm-2/leave", json={"id": 2}).status_code == 400
+        assert client.post("/networks/swarm-2/leave", json={"id": 1}).status_code == 200
+        assert client.get("/networks/swarm-2/status").json() == []
+
+        response = client.get("/networks")
+        assert [x["id"] for x in response.json()] == ["swarm-1", "swarm-2"]
+        assert client.get("/networks/registry").json()["networks"] == 2
+
+        assert client.delete("/networks/swarm-1").status_code == 200
+        assert client.delete("/networks/swarm-1").status_code == 404
+        assert client.get("/networks/swarm-1/status").status_code == 404
+        assert client.post("/networks/swarm-1/join", json={"capacity": 1}).status_code == 404
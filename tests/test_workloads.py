@@ -0,0 +1,27 @@
+import unittest
+from network.workloads import WORKLOADS
+from network.crud import P2PNetwork
+
+
+class TestWorkloads(unittest.TestCase):
+    '''
+    A class for testing the churn workloads of the benchmarks
+    '''
+
+    def test_seeded(self):
+        for workload in WORKLOADS.values():
+            assert list(workload(50, 100, 1)) == list(workload(50, 100, 1))
+            assert list(workload(50, 100, 1)) != list(workload(50, 100, 2))
+
+    def test_identifiers(self):
+        ''' Every leave is of a node in the network '''
+
+        for name, workload in WORKLOADS.items():
+            network = P2PNetwork()
+            phases = []
+            for phase, operation in workload(100, 300, 0):
+                result = network.apply([operation])[0]
+                assert result["success"], (name, operation)
+                phases.append(phase)
+            assert phases.count("warmup") == 100
+            assert phases[-1] == "churn"